@@ -0,0 +1,148 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection, router, transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+
+# Поля пользователя, которые хранит кэш аутентификации: их хватает правам доступа и /users/me/.
+# Хеш пароля и прочие поля в общий кэш (Redis) не попадают.
+CACHED_USER_FIELDS = (
+	'id', 'username', 'email', 'first_name', 'last_name',
+	'is_active', 'is_staff', 'is_superuser', 'last_login', 'date_joined',
+)
+
+
+def get_auth_cache():
+	return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def token_cache_key(key):
+	# Сам ключ токена - секрет, в общем кэше (Redis) хранится только его хеш.
+	return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_cache_key(user_id):
+	return f'auth:user:{user_id}'
+
+
+def user_token_cache_key(user_id):
+	# Ключ записи токена пользователя (у DRF один токен на пользователя), чтобы сбросить ее
+	# при сохранении пользователя без запроса к таблице токенов.
+	return f'auth:user-token:{user_id}'
+
+
+def dump_user(user):
+	return {field: getattr(user, field) for field in CACHED_USER_FIELDS}
+
+
+def load_user(values):
+	"""
+	Пользователь из полей кэша. Остальные поля (хеш пароля) отложены, как у ``only()``:
+	``check_password`` в djoser загрузит пароль отдельным запросом.
+	"""
+	User = get_user_model()
+	# from_db ждет значения в порядке полей модели.
+	fields = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+	return User.from_db(router.db_for_read(User), fields, [values[field] for field in fields])
+
+
+def get_cached_user(cache_key):
+	"""
+	Пользователь из кэша аутентификации или None. Каждый запрос получает свой объект,
+	поэтому изменения объекта в одном запросе не видны другим.
+	"""
+	return _cached_user(get_auth_cache().get(cache_key))
+
+
+async def aget_cached_user(cache_key):
+	return _cached_user(await get_auth_cache().aget(cache_key))
+
+
+def _cached_user(values):
+	if values is None:
+		return None
+	if not values['is_active']:
+		raise exceptions.AuthenticationFailed('User inactive or deleted.')
+	return load_user(values)
+
+
+def cache_user(cache_key, user):
+	get_auth_cache().set(cache_key, dump_user(user))
+
+
+async def acache_user(cache_key, user):
+	await get_auth_cache().aset(cache_key, dump_user(user))
+
+
+def _token_user_values(key, user):
+	# Ключ токена запоминается по пользователю, чтобы сбросить его при изменении пользователя.
+	cache_key = token_cache_key(key)
+	return {cache_key: dump_user(user), user_token_cache_key(user.pk): cache_key}
+
+
+def cache_token_user(key, user):
+	get_auth_cache().set_many(_token_user_values(key, user))
+
+
+async def acache_token_user(key, user):
+	await get_auth_cache().aset_many(_token_user_values(key, user))
+
+
+def _delete(cache_keys):
+	get_auth_cache().delete_many(cache_keys)
+
+
+def invalidate(cache_keys):
+	"""
+	Удаляет записи кэша аутентификации. Внутри транзакции записи удаляются еще раз после
+	коммита, чтобы параллельный запрос не закэшировал пользователя в состоянии до коммита.
+	"""
+	cache_keys = list(cache_keys)
+	if not cache_keys:
+		return
+	_delete(cache_keys)
+	if connection.in_atomic_block:
+		transaction.on_commit(lambda: _delete(cache_keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+	"""
+	TokenAuthentication, которая запоминает пользователя по ключу токена на AUTH_CACHE_TIMEOUT
+	секунд. Записи удаляются при удалении токена (выход через djoser) и при сохранении пользователя
+	(смена пароля, ``is_active``), см. ``accounts.signals``.
+	"""
+
+	def authenticate_credentials(self, key):
+		cache_key = token_cache_key(key)
+		user = get_cached_user(cache_key)
+		if user is not None:
+			return user, self.get_model()(key=key, user=user)
+
+		user, token = super().authenticate_credentials(key)
+		cache_token_user(key, user)
+		return user, token
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+	"""
+	JWTAuthentication, которая запоминает пользователя по ``sub`` токена на AUTH_CACHE_TIMEOUT секунд.
+	Подпись и срок действия проверяются на каждом запросе, из кэша берется только пользователь.
+	"""
+
+	def get_user(self, validated_token):
+		user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+		if user_id is None:
+			return super().get_user(validated_token)
+
+		cache_key = user_cache_key(user_id)
+		user = get_cached_user(cache_key)
+		if user is None:
+			user = super().get_user(validated_token)
+			cache_user(cache_key, user)
+		return user
@@ -0,0 +1,77 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.authentication import (
+	CachedJWTAuthentication,
+	CachedTokenAuthentication,
+	invalidate,
+	token_cache_key,
+	user_cache_key,
+)
+
+User = get_user_model()
+
+# Схема заголовка и классы без кэша и с кэшем.
+BENCH_SCHEMES = (
+	('token', 'Token', TokenAuthentication, CachedTokenAuthentication),
+	('jwt', 'Bearer', JWTAuthentication, CachedJWTAuthentication),
+)
+
+
+class Command(BaseCommand):
+	help = (
+		'Накладные расходы аутентификации на запрос: время и число SQL-запросов authenticate() '
+		'для Token и JWT без кэша и с кэшем пользователей. Пользователь и токен откатываются.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--repeat', type=int, default=2000, help='Число замеров каждого варианта')
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			user = User.objects.create_user('bench_auth', 'bench_auth@example.com', 'bench_auth')
+			credentials = {
+				'token': Token.objects.create(user=user).key,
+				'jwt': str(AccessToken.for_user(user)),
+			}
+			try:
+				self.run(credentials, options['repeat'])
+			finally:
+				invalidate([token_cache_key(credentials['token']), user_cache_key(user.pk)])
+				transaction.set_rollback(True)
+
+	def run(self, credentials, repeat):
+		factory = APIRequestFactory()
+		for name, keyword, *classes in BENCH_SCHEMES:
+			http_request = factory.get('/', HTTP_AUTHORIZATION=f'{keyword} {credentials[name]}')
+			for authentication_class in classes:
+				authenticator = authentication_class()
+				# Первый вызов заполняет кэш, замеряется установившийся режим. Запросы считаются
+				# отдельно: CaptureQueriesContext сам замедляет выполнение SQL.
+				authenticator.authenticate(Request(http_request))
+				with CaptureQueriesContext(connection) as queries:
+					authenticator.authenticate(Request(http_request))
+
+				timings = []
+				for _ in range(repeat):
+					request = Request(http_request)
+					started = time.perf_counter()
+					authenticator.authenticate(request)
+					timings.append((time.perf_counter() - started) * 1e6)
+				timings.sort()
+				self.stdout.write(
+					f'{authentication_class.__name__:<26} mean {statistics.mean(timings):8.1f}us  '
+					f'p50 {timings[len(timings) // 2]:8.1f}us  p99 {timings[len(timings) * 99 // 100]:8.1f}us  '
+					f'queries {len(queries)}'
+				)
@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model, user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .authentication import get_auth_cache, invalidate, token_cache_key, user_cache_key, user_token_cache_key
+
+User = get_user_model()
+
+
+def invalidate_user(user):
+	"""
+	Сбрасывает закэшированную аутентификацию пользователя: по JWT и по всем его токенам.
+	"""
+	token_key = user_token_cache_key(user.pk)
+	keys = [user_cache_key(getattr(user, jwt_settings.USER_ID_FIELD)), token_key]
+	cached_token_key = get_auth_cache().get(token_key)
+	if cached_token_key is not None:
+		keys.append(cached_token_key)
+	invalidate(keys)
+
+
+@receiver(post_save, sender=User, dispatch_uid='accounts_user_saved')
+@receiver(post_delete, sender=User, dispatch_uid='accounts_user_deleted')
+def user_changed(sender, instance, **kwargs):
+	# Любое сохранение: смена пароля (set_password, reset_password_confirm), активация, блокировка.
+	invalidate_user(instance)
+
+
+@receiver(user_logged_out, dispatch_uid='accounts_user_logged_out')
+def user_logged_out_handler(sender, user, **kwargs):
+	if user is not None and user.is_authenticated:
+		invalidate_user(user)
+
+
+@receiver(post_delete, sender=Token, dispatch_uid='accounts_token_deleted')
+def token_deleted(sender, instance, **kwargs):
+	# Выход через djoser удаляет токен запросом filter().delete(), сигнал приходит на каждую строку.
+	invalidate([token_cache_key(instance.key)])
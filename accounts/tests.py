@@ -1,3 +1,116 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CACHED_USER_FIELDS, get_auth_cache, token_cache_key, user_cache_key
+
+User = get_user_model()
+
+
+class CachedAuthenticationTest(APITestCase):
+	def setUp(self):
+		# id пользователей повторяются между тестами, а откат транзакции не присылает сигналов.
+		get_auth_cache().clear()
+		self.user = User.objects.create_user('user', 'user@example.com', 'password')
+		self.token = Token.objects.create(user=self.user)
+		self.access = str(AccessToken.for_user(self.user))
+		self.url = reverse('customuser-me')
+
+	def get_me(self, authorization, queries=None):
+		self.client.credentials(HTTP_AUTHORIZATION=authorization)
+		if queries is None:
+			return self.client.get(self.url)
+		with self.assertNumQueries(queries):
+			return self.client.get(self.url)
+
+	def test_token_cached(self):
+		authorization = f'Token {self.token.key}'
+		# /me/ отдает request.user, поэтому единственный запрос - аутентификация.
+		self.assertEqual(self.get_me(authorization, 1).status_code, status.HTTP_200_OK)
+		response = self.get_me(authorization, 0)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['username'], 'user')
+		self.assertIsNotNone(get_auth_cache().get(token_cache_key(self.token.key)))
+
+	def test_jwt_cached(self):
+		authorization = f'Bearer {self.access}'
+		self.assertEqual(self.get_me(authorization, 1).status_code, status.HTTP_200_OK)
+		self.assertEqual(self.get_me(authorization, 0).status_code, status.HTTP_200_OK)
+		self.assertIsNotNone(get_auth_cache().get(user_cache_key(self.user.id)))
+
+	def test_invalid_credentials_not_cached(self):
+		self.assertEqual(self.get_me('Token invalid', 1).status_code, status.HTTP_401_UNAUTHORIZED)
+		self.assertEqual(self.get_me('Token invalid', 1).status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_logout_invalidates(self):
+		authorization = f'Token {self.token.key}'
+		self.get_me(authorization)
+		self.client.credentials(HTTP_AUTHORIZATION=authorization)
+		response = self.client.post(reverse('logout'))
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+		self.assertIsNone(get_auth_cache().get(token_cache_key(self.token.key)))
+		self.assertEqual(self.get_me(authorization).status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_token_delete_invalidates(self):
+		authorization = f'Token {self.token.key}'
+		self.get_me(authorization)
+		self.token.delete()
+
+		self.assertEqual(self.get_me(authorization).status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_set_password_invalidates(self):
+		for authorization in (f'Token {self.token.key}', f'Bearer {self.access}'):
+			self.get_me(authorization)
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+		response = self.client.post(
+			reverse('customuser-set-password'),
+			{'current_password': 'password', 'new_password': 'Jx8-new-password'},
+		)
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+		self.assertIsNone(get_auth_cache().get(token_cache_key(self.token.key)))
+		self.assertIsNone(get_auth_cache().get(user_cache_key(self.user.id)))
+
+	def test_deactivation_invalidates(self):
+		for authorization in (f'Token {self.token.key}', f'Bearer {self.access}'):
+			self.assertEqual(self.get_me(authorization).status_code, status.HTTP_200_OK)
+
+		self.user.is_active = False
+		self.user.save()
+
+		for authorization in (f'Token {self.token.key}', f'Bearer {self.access}'):
+			self.assertEqual(self.get_me(authorization).status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_cached_user_fields(self):
+		authorization = f'Token {self.token.key}'
+		self.get_me(authorization)
+		cached = get_auth_cache().get(token_cache_key(self.token.key))
+
+		# В кэше только поля из CACHED_USER_FIELDS, без хеша пароля.
+		self.assertEqual(set(cached), set(CACHED_USER_FIELDS))
+		self.assertNotIn(self.user.password, map(str, cached.values()))
+		self.assertEqual(self.get_me(authorization, 0).data['username'], 'user')
+
+		# Пароль загружается по требованию, смена пароля через кэшированного пользователя работает.
+		response = self.client.post(
+			reverse('customuser-set-password'),
+			{'current_password': 'password', 'new_password': 'Jx8-new-password'},
+		)
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		self.user.refresh_from_db()
+		self.assertTrue(self.user.check_password('Jx8-new-password'))
+
+	def test_bench_auth(self):
+		out = StringIO()
+		call_command('bench_auth', repeat=5, stdout=out)
+
+		self.assertIn('CachedTokenAuthentication', out.getvalue())
+		self.assertIn('queries 0', out.getvalue())
+		self.assertFalse(User.objects.filter(username='bench_auth').exists())
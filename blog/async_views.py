@@ -0,0 +1,245 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from accounts.authentication import (
+	CachedJWTAuthentication,
+	CachedTokenAuthentication,
+	acache_token_user,
+	acache_user,
+	aget_cached_user,
+	token_cache_key,
+	user_cache_key,
+)
+
+from .cache import acached_response
+from .models import Post
+from .views import PostViewSet, CommentViewSet
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class AsyncTokenAuthentication(TokenAuthentication):
+	"""
+	TokenAuthentication с проверкой ключа через асинхронный ORM.
+	Разбор заголовка берется из ``authenticate``, которая здесь возвращает корутину.
+	"""
+
+	async def aauthenticate(self, request):
+		credentials = self.authenticate(request)
+		return await credentials if credentials is not None else None
+
+	async def authenticate_credentials(self, key):
+		model = self.get_model()
+		try:
+			token = await model.objects.select_related('user').aget(key=key)
+		except model.DoesNotExist:
+			raise exceptions.AuthenticationFailed('Invalid token.')
+
+		if not token.user.is_active:
+			raise exceptions.AuthenticationFailed('User inactive or deleted.')
+		return token.user, token
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+	"""
+	JWTAuthentication с загрузкой пользователя через асинхронный ORM.
+	Проверка подписи не обращается к БД; ``authenticate`` здесь возвращает корутину вместо пользователя.
+	"""
+
+	async def aauthenticate(self, request):
+		credentials = self.authenticate(request)
+		if credentials is None:
+			return None
+		user, validated_token = credentials
+		return await user, validated_token
+
+	async def get_user(self, validated_token):
+		try:
+			user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+		except KeyError:
+			raise InvalidToken('Token contained no recognizable user identification')
+
+		try:
+			user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+		except self.user_model.DoesNotExist:
+			raise exceptions.AuthenticationFailed('User not found', code='user_not_found')
+
+		if not user.is_active:
+			raise exceptions.AuthenticationFailed('User is inactive', code='user_inactive')
+		return user
+
+
+class AsyncCachedTokenAuthentication(AsyncTokenAuthentication):
+	"""
+	AsyncTokenAuthentication с кэшем пользователей CachedTokenAuthentication.
+	"""
+
+	async def authenticate_credentials(self, key):
+		cache_key = token_cache_key(key)
+		user = await aget_cached_user(cache_key)
+		if user is not None:
+			return user, self.get_model()(key=key, user=user)
+
+		user, token = await super().authenticate_credentials(key)
+		await acache_token_user(key, user)
+		return user, token
+
+
+class AsyncCachedJWTAuthentication(AsyncJWTAuthentication):
+	"""
+	AsyncJWTAuthentication с кэшем пользователей CachedJWTAuthentication.
+	"""
+
+	async def get_user(self, validated_token):
+		user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+		if user_id is None:
+			return await super().get_user(validated_token)
+
+		cache_key = user_cache_key(user_id)
+		user = await aget_cached_user(cache_key)
+		if user is None:
+			user = await super().get_user(validated_token)
+			await acache_user(cache_key, user)
+		return user
+
+
+ASYNC_AUTHENTICATION = {
+	TokenAuthentication: AsyncTokenAuthentication,
+	JWTAuthentication: AsyncJWTAuthentication,
+	CachedTokenAuthentication: AsyncCachedTokenAuthentication,
+	CachedJWTAuthentication: AsyncCachedJWTAuthentication,
+}
+
+
+async def authenticate(request):
+	"""
+	Асинхронный аналог ``Request._authenticate``. Классы без асинхронной версии
+	выполняются в потоке через sync_to_async.
+	"""
+	for authenticator in request.authenticators:
+		async_class = ASYNC_AUTHENTICATION.get(type(authenticator))
+		if async_class is not None:
+			aauthenticate = async_class().aauthenticate
+		else:
+			aauthenticate = sync_to_async(authenticator.authenticate)
+		try:
+			credentials = await aauthenticate(request)
+		except exceptions.APIException:
+			request._not_authenticated()
+			raise
+
+		if credentials is not None:
+			request._authenticator = authenticator
+			request.user, request.auth = credentials
+			return
+	request._not_authenticated()
+
+
+def filter_queryset(view, queryset):
+	"""
+	Фильтры (IdFilter без проверки существования объекта), поиск и сортировка только строят
+	queryset, без запросов к базе, поэтому выполняются прямо в цикле событий.
+	"""
+	return view.filter_queryset(queryset)
+
+
+async def list_objects(view, request):
+	queryset = filter_queryset(view, view.get_queryset())
+	paginator = view.paginator
+	page_queryset = paginator.get_page_queryset(queryset, request, view) if paginator is not None else None
+	# Список читается строками values_list (RowReadMixin), а aiterator() для них в Django 4.1
+	# открывает курсор в цикле событий, поэтому, как в post_comment_tree, - через __aiter__.
+	if page_queryset is None:
+		objects = [obj async for obj in queryset]
+		return Response(view.get_serializer(objects, many=True).data)
+
+	page = paginator.set_page([obj async for obj in page_queryset])
+	return paginator.get_paginated_response(view.get_serializer(page, many=True).data)
+
+
+async def retrieve_object(view, request):
+	queryset = filter_queryset(view, view.get_queryset())
+	lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+	try:
+		obj = await queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]}).afirst()
+	except (TypeError, ValueError, DjangoValidationError):
+		obj = None
+	if obj is None:
+		raise Http404
+	view.check_object_permissions(request, obj)
+	return Response(view.get_serializer(obj).data)
+
+
+async def post_comment_tree(view, request):
+	post_id = view.kwargs['post_id']
+	if not await Post.objects.filter(id=post_id).aexists():
+		raise Http404
+	# aiterator() для values_list в Django 4.1 открывает курсор в цикле событий, поэтому
+	# строки читаются через __aiter__ (один _fetch_all в потоке).
+	rows = [row async for row in view.get_tree_queryset(request, post_id)]
+	return view.get_tree_response(request, rows)
+
+
+def async_read_view(viewset_class, actions, handler, cache_kwarg=None, cache_param=None):
+	"""
+	Асинхронное представление для чтения поверх настроек ``viewset_class``: queryset, фильтры,
+	сортировка, пагинация, сериализатор, права и кэш ответов те же, что у синхронного ViewSet,
+	а запросы к БД выполняются асинхронным ORM (``aiterator``, ``afirst``, ``aexists``).
+	Остальные методы из ``actions`` передаются синхронному ViewSet.
+
+	Ответ рендерится сразу: отложенный ``render()`` Django выполнил бы в отдельном потоке.
+	"""
+	sync_view = viewset_class.as_view(actions)
+	actions = {'head': actions['get'], **actions}
+
+	async def view(request, *args, **kwargs):
+		if request.method not in READ_METHODS:
+			return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+		viewset = viewset_class(action_map=actions, args=args, kwargs=kwargs, format_kwarg=None)
+		request = viewset.initialize_request(request, *args, **kwargs)
+		viewset.request = request
+		viewset.headers = viewset.default_response_headers
+
+		async def get_response():
+			return await handler(viewset, request)
+
+		try:
+			await authenticate(request)
+			viewset.initial(request, *args, **kwargs)
+			if cache_kwarg is not None:
+				response = await acached_response(request, kwargs.get(cache_kwarg), get_response)
+			elif cache_param is not None:
+				response = await acached_response(request, request.query_params.get(cache_param), get_response)
+			else:
+				response = await get_response()
+		except Exception as exc:
+			response = viewset.handle_exception(exc)
+
+		response = viewset.finalize_response(request, response, *args, **kwargs)
+		response.render()
+		rendered = HttpResponse(response.content, status=response.status_code)
+		for name, value in response.items():
+			rendered[name] = value
+		return rendered
+
+	view.csrf_exempt = True
+	return view
+
+
+post_list = async_read_view(PostViewSet, {'get': 'list', 'post': 'create'}, list_objects)
+post_detail = async_read_view(
+	PostViewSet,
+	{'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+	retrieve_object,
+	cache_kwarg='pk',
+)
+comment_list = async_read_view(CommentViewSet, {'get': 'list', 'post': 'create'}, list_objects, cache_param='post')
+comment_post_tree = async_read_view(CommentViewSet, {'get': 'post_comment_tree'}, post_comment_tree, cache_kwarg='post_id')
@@ -0,0 +1,340 @@
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from .cache import bump_post_version
+from .export import parse_export_datetime
+from .hierarchy import path_step, tree_ordering, uses_paths
+from .models import Post, Comment, Job
+
+User = get_user_model()
+
+IMPORT_BATCH_SIZE = 1000
+
+ImportResult = namedtuple('ImportResult', ['comments', 'trees', 'seconds'])
+
+
+class CommentImportError(ValueError):
+	pass
+
+
+def _prepare(records):
+	"""
+	Проверяет записи и раскладывает их по родителям.
+	Ссылкой на запись служит её ``id`` (например, id в старой системе), а при его отсутствии - номер в пакете.
+	"""
+	nodes = {}
+	for index, record in enumerate(records):
+		ref = record.get('id', index)
+		if ref in nodes:
+			raise CommentImportError(f'Duplicate comment id {ref!r}')
+		created_at = record.get('created_at') or timezone.now()
+		if isinstance(created_at, str):
+			created_at = parse_export_datetime(created_at)
+		nodes[ref] = {
+			'ref': ref,
+			'index': index,
+			'parent': record.get('parent'),
+			'parent_id': record.get('parent_id'),
+			'post': record.get('post'),
+			'user': record['user'],
+			'body': record['body'],
+			'created_at': created_at,
+		}
+
+	children = defaultdict(list)
+	for node in nodes.values():
+		if node['parent'] is not None and node['parent'] not in nodes:
+			raise CommentImportError(f'Parent {node["parent"]!r} of comment {node["ref"]!r} is not in the batch')
+		children[node['parent']].append(node)
+	for siblings in children.values():
+		siblings.sort(key=lambda node: (node['created_at'], node['index']))
+	return nodes, children
+
+
+def _number_subtree(root, children, tree_id, lft, level, post, levels):
+	"""
+	Проставляет lft/rght/level/tree_id поддереву ``root`` начиная с ``lft`` обходом в глубину
+	без рекурсии и раскладывает узлы в ``levels`` по глубине относительно ``root``. Возвращает rght корня.
+	"""
+	cursor = lft
+	root.update(tree_id=tree_id, level=level, lft=cursor, post=post)
+	stack = [(root, iter(children.get(root['ref'], ())))]
+	while stack:
+		node, pending = stack[-1]
+		child = next(pending, None)
+		cursor += 1
+		if child is None:
+			node['rght'] = cursor
+			levels[node['level'] - level].append(node)
+			stack.pop()
+			continue
+		child.update(tree_id=tree_id, level=node['level'] + 1, lft=cursor, post=node['post'])
+		stack.append((child, iter(children.get(child['ref'], ()))))
+	return cursor
+
+
+def _number_trees(roots, children, first_tree_id, levels):
+	"""
+	Нумерует новые деревья с корнями ``roots``, начиная с ``first_tree_id``.
+	"""
+	for tree_id, root in enumerate(roots, start=first_tree_id):
+		if root['post'] is None:
+			raise CommentImportError(f'Root comment {root["ref"]!r} has no post')
+		_number_subtree(root, children, tree_id, 1, 0, root['post'], levels)
+
+
+def _assign_paths(root, children, prefix=''):
+	"""
+	Проставляет материализованные пути поддереву ``root`` с уже известными ``pk``,
+	начиная с пути родителя ``prefix``.
+	"""
+	root['path'] = prefix + path_step(root['pk'])
+	stack = [root]
+	while stack:
+		node = stack.pop()
+		for child in children.get(node['ref'], ()):
+			child['path'] = node['path'] + path_step(child['pk'])
+			stack.append(child)
+
+
+def _save_paths(nodes, children, created, subtrees, batch_size):
+	"""
+	Записывает пути комментариев пакета после ``_insert_levels`` одним ``bulk_update``,
+	``subtrees`` - пары (корень поддерева из пакета, путь его родителя).
+	"""
+	for root, prefix in subtrees:
+		_assign_paths(root, children, prefix)
+	for ref, comment in created.items():
+		comment.path = nodes[ref]['path']
+	Comment.objects.bulk_update(list(created.values()), ['path'], batch_size=batch_size)
+
+
+def _insert_levels(nodes, children, levels, batch_size):
+	"""
+	Сохраняет пронумерованные узлы через ``bulk_create`` по глубине в пакете, чтобы родитель
+	из пакета получил pk раньше потомков. Возвращает созданные комментарии по ``ref`` узла.
+	"""
+	if sum(len(level) for level in levels.values()) != len(nodes):
+		raise CommentImportError('Comment parents form a cycle')
+
+	created = {}
+	for level in sorted(levels):
+		comments = [
+			Comment(
+				user_id=node['user'],
+				post_id=node['post'],
+				parent_id=nodes[node['parent']]['pk'] if node['parent'] is not None else node['parent_id'],
+				body=node['body'],
+				created_at=node['created_at'],
+				tree_id=node['tree_id'],
+				lft=node['lft'],
+				rght=node['rght'],
+				level=node['level'],
+				reply_count=len(children.get(node['ref'], ())),
+				descendant_count=(node['rght'] - node['lft'] - 1) // 2,
+			)
+			for node in levels[level]
+		]
+		Comment.objects.bulk_create(comments, batch_size=batch_size)
+		for node, comment in zip(levels[level], comments):
+			node['pk'] = comment.pk
+			created[node['ref']] = comment
+	return created
+
+
+def _add_comment_counts(comment_counts):
+	# Один UPDATE на каждое различное приращение, а не на каждый пост.
+	posts_by_count = defaultdict(list)
+	for post_id, count in comment_counts.items():
+		posts_by_count[count].append(post_id)
+	for count, post_ids in posts_by_count.items():
+		Post.objects.filter(pk__in=post_ids).update(comment_count=F('comment_count') + count)
+
+
+def import_comments(records, batch_size=IMPORT_BATCH_SIZE):
+	"""
+	Загружает пакет новых деревьев комментариев за одну транзакцию.
+
+	Записи - словари с ключами ``id``, ``parent``, ``post``, ``user``, ``body``, ``created_at``,
+	где ``parent`` ссылается на ``id`` другой записи пакета. Значения MPTT вычисляются в памяти,
+	а комментарии сохраняются через ``bulk_create`` по уровням дерева, так что ни одна запись
+	не вызывает пересчета lft/rght существующих деревьев. Новые деревья получают tree_id
+	после уже существующих. Ответы на существующие комментарии (``parent_id``) создает
+	``append_comments``.
+	"""
+	started = time.perf_counter()
+	nodes, children = _prepare(records)
+	attached = [node['ref'] for node in nodes.values() if node['parent_id'] is not None]
+	if attached:
+		raise CommentImportError(f'Comments {attached} reply to existing comments, use append_comments')
+	roots = children.get(None, [])
+
+	post_ids = {node['post'] for node in nodes.values() if node['post'] is not None}
+	missing = post_ids - set(Post.objects.filter(id__in=post_ids).values_list('id', flat=True))
+	if missing:
+		raise CommentImportError(f'Posts do not exist: {sorted(missing)}')
+	user_ids = {node['user'] for node in nodes.values()}
+	missing = user_ids - set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+	if missing:
+		raise CommentImportError(f'Users do not exist: {sorted(missing)}')
+
+	with transaction.atomic():
+		levels = defaultdict(list)
+		_number_trees(roots, children, Comment._tree_manager._get_next_tree_id(), levels)
+		created = _insert_levels(nodes, children, levels, batch_size)
+		if uses_paths():
+			_save_paths(nodes, children, created, [(root, '') for root in roots], batch_size)
+		comment_counts = Counter(node['post'] for node in nodes.values())
+		_add_comment_counts(comment_counts)
+		# bulk_create и update() не вызывают Comment.save, поэтому кэш ответов сбрасывается здесь.
+		for post_id in comment_counts:
+			bump_post_version(post_id)
+
+	return ImportResult(comments=len(nodes), trees=len(roots), seconds=time.perf_counter() - started)
+
+
+def _open_gaps(tree_id, gaps):
+	"""
+	Раздвигает lft/rght существующего дерева одним UPDATE под все вставки в нем.
+	``gaps`` - пары (rght родителя до вставки, суммарная ширина вставок до этой позиции
+	включительно) по возрастанию позиции: значение сдвигается на ширину всех вставок не правее него.
+	"""
+	def shifted(field):
+		return Case(
+			*(When(**{f'{field}__gte': position, 'then': F(field) + shift}) for position, shift in reversed(gaps)),
+			default=F(field),
+			output_field=models.PositiveIntegerField(),
+		)
+
+	Comment.objects.filter(tree_id=tree_id, rght__gte=gaps[0][0]).update(lft=shifted('lft'), rght=shifted('rght'))
+
+
+def append_comments(records, batch_size=IMPORT_BATCH_SIZE):
+	"""
+	Создает пакет комментариев за одну транзакцию и возвращает их в порядке записей.
+
+	Записи - словари ``id``, ``parent``, ``parent_id``, ``post``, ``user``, ``body``: ``parent`` ссылается
+	на ``id`` более ранней записи пакета, ``parent_id`` - на существующий комментарий, без них
+	комментарий начинает новое дерево поста ``post``. Новые деревья нумеруются как в ``import_comments``,
+	а ответы встают последними детьми своих родителей: деревья с ними блокируются, как в
+	``CommentManager.append_node``, и раздвигаются одним UPDATE на дерево. В режиме
+	COMMENT_HIERARCHY = 'path' деревья не блокируются и не раздвигаются, ответы получают пути,
+	а lft/rght перенумерует задача ``comments.rebuild_tree``. Существование постов,
+	родителей и авторов проверяет вызывающий код.
+	"""
+	nodes, children = _prepare(records)
+	attached = defaultdict(list)
+	roots = []
+	for node in children.get(None, []):
+		if node['parent_id'] is None:
+			roots.append(node)
+		else:
+			attached[node['parent_id']].append(node)
+
+	with transaction.atomic(savepoint=False):
+		levels = defaultdict(list)
+		_number_trees(roots, children, Comment._tree_manager._get_next_tree_id(), levels)
+
+		paths = uses_paths()
+		parents = []
+		if attached:
+			fields = ('id', 'post_id', 'tree_id', 'rght', 'level', 'path')
+			if paths:
+				parents = list(Comment.objects.filter(pk__in=attached).values_list(*fields))
+			else:
+				parents = Comment.objects.lock_comment_trees(list(attached), fields)
+			missing = set(attached) - {parent[0] for parent in parents}
+			if missing:
+				raise CommentImportError(f'Parent comments do not exist: {sorted(missing)}')
+
+		trees = defaultdict(list)
+		for parent in parents:
+			trees[parent[2]].append(parent)
+		for tree_id, tree_parents in trees.items():
+			gaps = []
+			shift = 0
+			for parent_id, post_id, _, rght, level, _ in sorted(tree_parents, key=lambda parent: parent[3]):
+				cursor = rght + shift
+				for child in attached[parent_id]:
+					cursor = _number_subtree(child, children, tree_id, cursor, level + 1, post_id, levels) + 1
+				shift = cursor - rght
+				gaps.append((rght, shift))
+			if paths:
+				Job.objects.enqueue('comments.rebuild_tree', delay=settings.COMMENT_PATH_REBUILD_DELAY, tree_id=tree_id)
+			else:
+				_open_gaps(tree_id, gaps)
+
+		created = _insert_levels(nodes, children, levels, batch_size)
+		if paths:
+			subtrees = [(root, '') for root in roots]
+			subtrees.extend((child, parent[5]) for parent in parents for child in attached[parent[0]])
+			_save_paths(nodes, children, created, subtrees, batch_size)
+		if attached:
+			Comment.objects.add_to_ancestor_counters({
+				parent_id: (len(replies), sum((node['rght'] - node['lft'] + 1) // 2 for node in replies))
+				for parent_id, replies in attached.items()
+			})
+		comment_counts = Counter(node['post'] for node in nodes.values())
+		_add_comment_counts(comment_counts)
+		for post_id in comment_counts:
+			bump_post_version(post_id)
+
+	return [created[node['ref']] for node in sorted(nodes.values(), key=lambda node: node['index'])]
+
+
+def renumber_tree(tree_id, batch_size=IMPORT_BATCH_SIZE, order_by=None, paths=None):
+	"""
+	Перенумеровывает lft/rght/level дерева ``tree_id`` по связям parent_id без пропусков.
+	Комментарии без родителя в дереве (потомки удаленного комментария) переносятся в новые
+	деревья, первый корень сохраняет ``tree_id``. Порядок детей берется из ``order_by``
+	(по умолчанию порядок дерева текущего режима, см. ``tree_ordering``). С ``paths``
+	(по умолчанию в режиме COMMENT_HIERARCHY = 'path') пересчитываются и пути.
+	Дерево блокируется ``CommentManager.lock_trees``, как в ``append_node``, даже если его корень
+	удален, а номера новых деревьев выдаются под блокировкой ``CommentManager._get_next_tree_id``.
+	Кэш ответов постов с измененными строками сбрасывается. Возвращает число измененных строк.
+	"""
+	if paths is None:
+		paths = uses_paths()
+	if order_by is None:
+		order_by = tree_ordering()[-1]
+	fields = ['tree_id', 'lft', 'rght', 'level'] + (['path'] if paths else [])
+	with transaction.atomic():
+		Comment.objects.lock_trees([tree_id])
+		rows = Comment.objects.filter(tree_id=tree_id).order_by(order_by, 'id').values_list(
+			'id', 'parent_id', 'post_id', *fields,
+		)
+		nodes = {}
+		for pk, parent_id, post_id, *stored in rows:
+			nodes[pk] = {'ref': pk, 'pk': pk, 'parent': parent_id, 'post': post_id, 'stored': stored}
+		children = defaultdict(list)
+		roots = []
+		for node in nodes.values():
+			if node['parent'] in nodes:
+				children[node['parent']].append(node)
+			else:
+				roots.append(node)
+
+		levels = defaultdict(list)
+		next_tree_id = Comment._tree_manager._get_next_tree_id() if len(roots) > 1 else None
+		for index, root in enumerate(roots):
+			root_tree_id = tree_id if index == 0 else next_tree_id + index - 1
+			_number_subtree(root, children, root_tree_id, 1, 0, root['post'], levels)
+			if paths:
+				_assign_paths(root, children)
+
+		changed = [
+			Comment(id=node['ref'], **{field: node[field] for field in fields})
+			for node in nodes.values()
+			if 'lft' in node and [node[field] for field in fields] != node['stored']
+		]
+		Comment.objects.bulk_update(changed, fields, batch_size=batch_size)
+		# lft/rght/level отдаются в ответах, поэтому их кэш устаревает вместе с нумерацией.
+		for post_id in {nodes[comment.id]['post'] for comment in changed}:
+			bump_post_version(post_id)
+	return len(changed)
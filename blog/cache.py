@@ -0,0 +1,146 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from test_comments.timing import timed
+
+
+def get_response_cache():
+	return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(post_id):
+	return f'post:{post_id}:version'
+
+
+def get_post_version(post_id):
+	"""
+	Текущая версия данных поста. Начальное значение берется из часов, поэтому после вытеснения
+	ключа из кэша версия не возвращается к старому значению и старые ответы не оживают.
+	"""
+	return get_response_cache().get_or_set(_version_key(post_id), time.time_ns, None)
+
+
+async def aget_post_version(post_id):
+	return await get_response_cache().aget_or_set(_version_key(post_id), time.time_ns, None)
+
+
+def _bump(post_id):
+	cache = get_response_cache()
+	try:
+		cache.incr(_version_key(post_id))
+	except ValueError:
+		cache.set(_version_key(post_id), time.time_ns(), None)
+
+
+def bump_post_version(post_id):
+	"""
+	Делает устаревшими все кэшированные ответы по посту: детальный просмотр, комментарии и дерево.
+	Внутри транзакции версия повышается еще раз после коммита, чтобы ответ, прочитанный
+	параллельным запросом до коммита, не остался в кэше под новой версией.
+	"""
+	if post_id is None:
+		return
+	_bump(post_id)
+	if connection.in_atomic_block:
+		transaction.on_commit(lambda: _bump(post_id))
+
+
+def _is_cacheable(post_id):
+	# Для неканонической записи id (``abc``, ``05``) версия ключа никогда бы не повышалась.
+	return post_id is not None and str(post_id).isdigit() and str(post_id) == str(post_id).lstrip('0')
+
+
+def _cache_key(request, post_id, version):
+	"""
+	Ключ кэша, заголовки ответа и ответ 304, если ETag совпадает с If-None-Match, иначе None.
+	"""
+	# Одни данные в разных представлениях (JSON, колонки, с отступами) - разные ответы для ETag.
+	representation = f'{request.build_absolute_uri()}\n{request.accepted_media_type}'
+	digest = hashlib.md5(representation.encode()).hexdigest()
+	key = f'response:{post_id}:{version}:{digest}'
+	etag = f'"{post_id}-{version}-{digest[:16]}"'
+	headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+	# If-None-Match сравнивается слабо: сжатый ответ уходит с W/-версией ETag.
+	if etag in {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}:
+		return key, headers, Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+	return key, headers, None
+
+
+def _cached(key, headers, data):
+	return key, headers, Response(data, headers=headers) if data is not None else None
+
+
+def _lookup(request, post_id):
+	with timed('cache'):
+		key, headers, response = _cache_key(request, post_id, get_post_version(post_id))
+		if response is not None:
+			return key, headers, response
+		return _cached(key, headers, get_response_cache().get(key))
+
+
+async def _alookup(request, post_id):
+	with timed('cache'):
+		key, headers, response = _cache_key(request, post_id, await aget_post_version(post_id))
+		if response is not None:
+			return key, headers, response
+		return _cached(key, headers, await get_response_cache().aget(key))
+
+
+def _set_headers(headers, response):
+	for name, value in headers.items():
+		response[name] = value
+	return response
+
+
+def _store(key, headers, response):
+	if response.status_code == status.HTTP_200_OK:
+		get_response_cache().set(key, response.data)
+		_set_headers(headers, response)
+	return response
+
+
+async def _astore(key, headers, response):
+	if response.status_code == status.HTTP_200_OK:
+		await get_response_cache().aset(key, response.data)
+		_set_headers(headers, response)
+	return response
+
+
+def cached_response(request, post_id, get_response):
+	"""
+	Отдает ответ ``get_response()`` из кэша по ключу (пост, версия, полный URL запроса и выбранный
+	по Accept тип ответа).
+	Ответ получает ETag, и при совпадении ``If-None-Match`` возвращается 304 без обращения к БД.
+	Кэшируются только ответы 200.
+
+	Версию поста повышают ``save()``/``delete()`` моделей и функции ``blog.bulk``. Изменения через
+	``QuerySet.update()``, ``QuerySet.delete()``, ``bulk_create`` или SQL в обход этих путей кэш
+	не сбрасывают: после них нужно вызвать ``bump_post_version`` для затронутых постов.
+	"""
+	if not _is_cacheable(post_id):
+		return get_response()
+	key, headers, response = _lookup(request, post_id)
+	if response is None:
+		response = _store(key, headers, get_response())
+	return response
+
+
+async def acached_response(request, post_id, get_response):
+	"""
+	``cached_response`` для асинхронных представлений, ``get_response`` - корутинная функция.
+	Кэш читается асинхронным API (``aget``), чтобы общий кэш (Redis) не блокировал цикл событий.
+	"""
+	if not _is_cacheable(post_id):
+		return await get_response()
+	key, headers, response = await _alookup(request, post_id)
+	if response is None:
+		response = await _astore(key, headers, await get_response())
+	return response
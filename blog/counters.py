@@ -0,0 +1,65 @@
+from collections import Counter, defaultdict, namedtuple
+
+from django.db import transaction
+
+from .cache import bump_post_version
+from .models import Post, Comment
+
+REPAIR_BATCH_SIZE = 1000
+
+RepairResult = namedtuple('RepairResult', ['posts', 'comments'])
+
+
+def _count_descendants(children):
+	"""
+	Число потомков каждого комментария по связям parent_id, обходом в глубину без рекурсии.
+	"""
+	descendants = defaultdict(int)
+	order = []
+	stack = list(children.get(None, ()))
+	while stack:
+		comment_id = stack.pop()
+		order.append(comment_id)
+		stack.extend(children.get(comment_id, ()))
+	for comment_id in reversed(order):
+		for child_id in children.get(comment_id, ()):
+			descendants[comment_id] += descendants[child_id] + 1
+	return descendants
+
+
+def repair_counters(post_model=Post, comment_model=Comment, batch_size=REPAIR_BATCH_SIZE):
+	"""
+	Пересчитывает ``comment_count``, ``reply_count`` и ``descendant_count`` по фактическим данным
+	и сохраняет только расходящиеся значения. Нужен после массовых изменений в обход моделей
+	и сигналов (``update()``, ``bulk_create``, правки в БД).
+	"""
+	with transaction.atomic():
+		children = defaultdict(list)
+		stored = {}
+		comment_counts = Counter()
+		rows = comment_model.objects.values_list('id', 'parent_id', 'post_id', 'reply_count', 'descendant_count')
+		for comment_id, parent_id, post_id, reply_count, descendant_count in rows.iterator(chunk_size=batch_size):
+			children[parent_id].append(comment_id)
+			stored[comment_id] = (post_id, reply_count, descendant_count)
+			comment_counts[post_id] += 1
+
+		descendants = _count_descendants(children)
+		comments = []
+		touched = set()
+		for comment_id, (post_id, reply_count, descendant_count) in stored.items():
+			actual = (len(children.get(comment_id, ())), descendants[comment_id])
+			if (reply_count, descendant_count) != actual:
+				comments.append(comment_model(id=comment_id, reply_count=actual[0], descendant_count=actual[1]))
+				touched.add(post_id)
+		comment_model.objects.bulk_update(comments, ['reply_count', 'descendant_count'], batch_size=batch_size)
+
+		posts = [
+			post_model(id=post_id, comment_count=comment_counts[post_id])
+			for post_id, comment_count in post_model.objects.values_list('id', 'comment_count').iterator(chunk_size=batch_size)
+			if comment_count != comment_counts[post_id]
+		]
+		post_model.objects.bulk_update(posts, ['comment_count'], batch_size=batch_size)
+
+		for post_id in touched | {post.id for post in posts}:
+			bump_post_version(post_id)
+	return RepairResult(posts=len(posts), comments=len(comments))
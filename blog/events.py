@@ -0,0 +1,327 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Post, CommentEvent
+
+logger = logging.getLogger('blog.events')
+
+EVENTS_PATH = re.compile(r'/api/v1/posts/(?P<post_id>[0-9]+)/comments/events/')
+
+EVENT_FIELDS = ('id', 'post_id', 'type', 'data')
+
+
+def publish(event_type, post_id, comment_id, data):
+	"""
+	Записывает событие ``comment.<event_type>`` в журнал поста ``post_id`` в текущей транзакции.
+	После коммита опрос журнала в этом процессе запускается сразу, остальные процессы
+	увидят событие при следующем опросе.
+	"""
+	publish_many([CommentEvent(post_id=post_id, comment_id=comment_id, type=event_type, data=data)])
+
+
+def publish_many(events):
+	CommentEvent.objects.bulk_create(events)
+	transaction.on_commit(broker.notify)
+
+
+def prune_events():
+	deadline = timezone.now() - timezone.timedelta(seconds=settings.COMMENT_EVENTS_RETENTION)
+	return CommentEvent.objects.filter(created_at__lt=deadline).delete()[0]
+
+
+def format_event(event_id, event_type, data):
+	payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+	return f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'.encode()
+
+
+def _query(func):
+	"""
+	Запрос к БД вне цикла запрос-ответ Django: соединение закрывается по CONN_MAX_AGE, как после запроса.
+	"""
+	def run(*args):
+		try:
+			return func(*args)
+		finally:
+			close_old_connections()
+	return sync_to_async(run)
+
+
+@_query
+def _latest_event_id():
+	return CommentEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+@_query
+def _fetch_events(after_id, gap_ids, limit):
+	"""
+	События после ``after_id`` и события с id из ``gap_ids`` - пропусков, которые еще могут
+	закоммититься, - в порядке id, не больше ``limit``.
+	"""
+	condition = Q(id__gt=after_id)
+	if gap_ids:
+		condition |= Q(id__in=gap_ids)
+	return list(CommentEvent.objects.filter(condition).order_by('id').values_list(*EVENT_FIELDS)[:limit])
+
+
+@_query
+def _replay(post_id, after_id, limit):
+	"""
+	События поста после ``after_id`` (не больше ``limit``) и признак того, что часть из них
+	уже удалена из журнала. Id выдаются до коммита, поэтому событие с меньшим id может
+	закоммититься позже ``after_id``: события последних COMMENT_EVENTS_WINDOW секунд
+	повторяются и с меньшими id, клиент применяет их по id комментария идемпотентно.
+	"""
+	oldest_id = CommentEvent.objects.order_by('id').values_list('id', flat=True).first()
+	since = timezone.now() - timezone.timedelta(seconds=settings.COMMENT_EVENTS_WINDOW)
+	events = list(
+		CommentEvent.objects
+		.filter(Q(id__gt=after_id) | Q(created_at__gte=since), post_id=post_id)
+		.order_by('id')
+		.values_list(*EVENT_FIELDS)[:limit]
+	)
+	return events, oldest_id is not None and after_id < oldest_id - 1
+
+
+@_query
+def _post_exists(post_id):
+	return Post.objects.filter(pk=post_id).exists()
+
+
+class Subscription:
+	def __init__(self, post_id):
+		self.post_id = post_id
+		self.queue = asyncio.Queue(settings.COMMENT_EVENTS_QUEUE_SIZE)
+		self.overflowed = False
+
+
+class EventBroker:
+	"""
+	Раздача событий подписчикам процесса. Журнал читает одна задача цикла событий на весь
+	процесс - один запрос по первичному ключу раз в COMMENT_EVENTS_POLL_INTERVAL секунд
+	независимо от числа подписчиков, - а подписчик без событий стоит только очереди asyncio.
+	Очередь подписчика ограничена COMMENT_EVENTS_QUEUE_SIZE: отстающий подписчик отключается
+	и продолжает с Last-Event-ID, не задерживая остальных.
+
+	Id событий выдаются до коммита, и на Postgres событие с меньшим id может стать видимым
+	позже большего. Пропущенные id до последнего разосланного события опрос перечитывает
+	COMMENT_EVENTS_WINDOW секунд (не больше ``max_gaps`` самых новых), каждое событие
+	рассылается один раз.
+	"""
+	batch_size = 1000
+	max_gaps = 1000
+
+	def __init__(self):
+		self.subscriptions = defaultdict(set)
+		self.count = 0
+		self.last_id = 0
+		# Пропущенный id -> время (time.monotonic), после которого он больше не ждется.
+		self.gaps = {}
+		self.loop = None
+		self.poller = None
+		self.ready = None
+		self.wakeup = None
+
+	def subscribe(self, post_id):
+		if self.count >= settings.COMMENT_EVENTS_MAX_SUBSCRIBERS:
+			return None
+		subscription = Subscription(post_id)
+		self.subscriptions[post_id].add(subscription)
+		self.count += 1
+		return subscription
+
+	def unsubscribe(self, subscription):
+		subscriptions = self.subscriptions.get(subscription.post_id)
+		if subscriptions is None or subscription not in subscriptions:
+			return
+		subscriptions.discard(subscription)
+		if not subscriptions:
+			del self.subscriptions[subscription.post_id]
+		self.count -= 1
+
+	async def start(self):
+		"""
+		Запускает опрос журнала, если он еще не идет в текущем цикле событий, и ждет, пока опрос
+		узнает последнее событие: с него начинается раздача, более ранние события подписчик
+		получает повтором из журнала.
+		"""
+		loop = asyncio.get_running_loop()
+		if self.poller is None or self.poller.done() or self.loop is not loop:
+			self.loop = loop
+			self.wakeup = asyncio.Event()
+			self.ready = loop.create_future()
+			self.poller = loop.create_task(self.poll())
+		await asyncio.shield(self.ready)
+
+	def notify(self):
+		"""
+		Будит опрос после коммита; вызывается из любого потока.
+		"""
+		loop, wakeup = self.loop, self.wakeup
+		if loop is not None and wakeup is not None and not loop.is_closed():
+			loop.call_soon_threadsafe(wakeup.set)
+
+	async def poll(self):
+		try:
+			self.last_id = await _latest_event_id()
+		except Exception as exc:
+			self.ready.set_exception(exc)
+			return
+		self.gaps = {}
+		self.ready.set_result(None)
+		while self.count:
+			try:
+				events = await _fetch_events(self.last_id, list(self.gaps), self.batch_size)
+			except Exception:
+				logger.exception('Comment event poll failed')
+				events = []
+			self.dispatch(events)
+			if len(events) < self.batch_size:
+				self.wakeup.clear()
+				try:
+					await asyncio.wait_for(self.wakeup.wait(), settings.COMMENT_EVENTS_POLL_INTERVAL)
+				except asyncio.TimeoutError:
+					pass
+
+	def dispatch(self, events):
+		now = time.monotonic()
+		for event in events:
+			event_id = event[0]
+			if event_id > self.last_id:
+				deadline = now + settings.COMMENT_EVENTS_WINDOW
+				self.gaps.update((gap_id, deadline) for gap_id in range(max(self.last_id + 1, event_id - self.max_gaps), event_id))
+				self.last_id = event_id
+			elif self.gaps.pop(event_id, None) is None:
+				continue
+			for subscription in list(self.subscriptions.get(event[1], ())):
+				try:
+					subscription.queue.put_nowait(event)
+				except asyncio.QueueFull:
+					subscription.overflowed = True
+					self.unsubscribe(subscription)
+		self.gaps = {gap_id: deadline for gap_id, deadline in self.gaps.items() if deadline > now}
+		if len(self.gaps) > self.max_gaps:
+			self.gaps = dict(sorted(self.gaps.items())[-self.max_gaps:])
+
+
+broker = EventBroker()
+
+
+async def _send_response(send, status, body, headers=()):
+	await send({
+		'type': 'http.response.start',
+		'status': status,
+		'headers': [(b'content-type', b'application/json'), *headers],
+	})
+	await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+async def _wait_disconnect(receive):
+	while (await receive())['type'] != 'http.disconnect':
+		pass
+
+
+def _last_event_id(scope):
+	headers = dict(scope['headers'])
+	value = headers.get(b'last-event-id', b'').decode('latin-1')
+	if not value:
+		value = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('last_event_id', [''])[0]
+	return int(value) if value.isdigit() else None
+
+
+async def stream_events(scope, receive, send, post_id):
+	"""
+	Поток событий комментариев поста в формате Server-Sent Events: ``comment.created``,
+	``comment.updated`` (данные - комментарий, как в ответе API) и ``comment.deleted``
+	(``id`` и ``parent``). С заголовком Last-Event-ID (или ``?last_event_id=``) сначала
+	повторяются пропущенные события из журнала; если их больше COMMENT_EVENTS_REPLAY_LIMIT
+	или часть уже удалена, вместо них приходит ``reset`` - комментарии нужно перечитать.
+	События идут в порядке коммита, поэтому id в потоке не обязательно возрастают.
+	"""
+	if scope['method'] != 'GET':
+		await _send_response(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'}, [(b'allow', b'GET')])
+		return
+	if not await _post_exists(post_id):
+		await _send_response(send, 404, {'detail': 'Not found.'})
+		return
+	subscription = broker.subscribe(post_id)
+	if subscription is None:
+		retry_after = str(settings.COMMENT_EVENTS_RETRY // 1000 or 1).encode()
+		await _send_response(send, 503, {'detail': 'Too many subscribers, retry later.'}, [(b'retry-after', retry_after)])
+		return
+
+	disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+	try:
+		await broker.start()
+		# После ``reset`` клиент перечитывает комментарии и продолжает с события, уже известного опросу.
+		reset_id = broker.last_id
+		await send({
+			'type': 'http.response.start',
+			'status': 200,
+			'headers': [
+				(b'content-type', b'text/event-stream; charset=utf-8'),
+				(b'cache-control', b'no-cache'),
+				(b'x-accel-buffering', b'no'),
+			],
+		})
+		chunks = [f'retry: {settings.COMMENT_EVENTS_RETRY}\n\n'.encode()]
+
+		# Повторенные события могут прийти и от опроса, если он разослал их после подписки.
+		replayed = set()
+		last_event_id = _last_event_id(scope)
+		if last_event_id is not None:
+			limit = settings.COMMENT_EVENTS_REPLAY_LIMIT
+			events, pruned = await _replay(post_id, last_event_id, limit + 1)
+			if pruned or len(events) > limit:
+				chunks.append(format_event(reset_id, 'reset', {'post': post_id}))
+			else:
+				chunks.extend(format_event(event_id, f'comment.{event_type}', data) for event_id, _, event_type, data in events)
+				replayed.update(event[0] for event in events)
+		await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': True})
+
+		# Переполненная очередь дочитывается до конца, затем поток закрывается: клиент
+		# переподключится с Last-Event-ID и получит остальное повтором из журнала.
+		while not disconnect.done() and not (subscription.overflowed and subscription.queue.empty()):
+			get = asyncio.ensure_future(subscription.queue.get())
+			await asyncio.wait({get, disconnect}, timeout=settings.COMMENT_EVENTS_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+			if not get.done():
+				get.cancel()
+				if not disconnect.done():
+					await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+				continue
+			event_id, _, event_type, data = get.result()
+			if event_id in replayed:
+				replayed.discard(event_id)
+				continue
+			await send({'type': 'http.response.body', 'body': format_event(event_id, f'comment.{event_type}', data), 'more_body': True})
+	finally:
+		broker.unsubscribe(subscription)
+		client_gone = disconnect.done()
+		disconnect.cancel()
+	if not client_gone:
+		await send({'type': 'http.response.body', 'body': b''})
+
+
+def events_application(application):
+	"""
+	Оборачивает ASGI-приложение Django: запросы к /api/v1/posts/<id>/comments/events/
+	обслуживает ``stream_events`` в цикле событий, без потока на соединение.
+	Django 4.1 не умеет отдавать асинхронный поток через StreamingHttpResponse.
+	"""
+	async def app(scope, receive, send):
+		if scope['type'] == 'http':
+			match = EVENTS_PATH.fullmatch(scope['path'])
+			if match is not None:
+				return await stream_events(scope, receive, send, int(match['post_id']))
+		return await application(scope, receive, send)
+	return app
@@ -0,0 +1,56 @@
+import json
+
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from rest_framework import serializers
+
+from .hierarchy import tree_ordering
+from .models import Comment
+
+EXPORT_FIELDS = ('id', 'user_id', 'body', 'created_at', 'updated_at', 'post_id', 'parent_id', 'lft', 'rght', 'tree_id', 'level')
+EXPORT_KEYS = ('id', 'user', 'body', 'created_at', 'updated_at', 'post', 'parent', 'lft', 'rght', 'tree_id', 'level')
+
+EXPORT_CHUNK_SIZE = 2000
+
+_datetime_field = serializers.DateTimeField()
+
+
+def parse_export_datetime(value):
+	"""
+	Разбирает границу периода выгрузки в формате ISO 8601.
+	Наивное время считается временем в текущей временной зоне.
+	"""
+	parsed = parse_datetime(value) if value else None
+	if parsed is None:
+		raise ValueError(f'Invalid datetime: {value!r}')
+	return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+def get_export_queryset(post=None, since=None, until=None):
+	"""
+	Комментарии поста выгружаются в порядке дерева, выгрузка за период - по времени создания.
+	"""
+	queryset = Comment.objects.all()
+	if post is not None:
+		queryset = queryset.filter(post=post).order_by(*tree_ordering())
+	else:
+		queryset = queryset.order_by('created_at', 'id')
+	if since is not None:
+		queryset = queryset.filter(created_at__gte=since)
+	if until is not None:
+		queryset = queryset.filter(created_at__lt=until)
+	return queryset.values_list(*EXPORT_FIELDS)
+
+
+def iter_ndjson(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+	"""
+	Построчно сериализует комментарии в NDJSON, читая их из серверного курсора
+	порциями по ``chunk_size``, поэтому память не зависит от размера выгрузки.
+	"""
+	dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+	datetime_indexes = (EXPORT_FIELDS.index('created_at'), EXPORT_FIELDS.index('updated_at'))
+	for row in queryset.iterator(chunk_size=chunk_size):
+		row = list(row)
+		for index in datetime_indexes:
+			row[index] = _datetime_field.to_representation(row[index])
+		yield dumps(dict(zip(EXPORT_KEYS, row))) + '\n'
@@ -0,0 +1,50 @@
+from django import forms
+from django_filters import rest_framework as filters
+
+from .models import Post, Comment
+
+DATETIME_LOOKUPS = ['exact', 'gt', 'gte', 'lt', 'lte']
+
+
+class IdFilter(filters.NumberFilter):
+	"""
+	Фильтр по id внешнего ключа без проверки существования объекта: ModelChoiceFilter
+	делал бы для этого отдельный запрос, а несуществующий id и так дает пустой список.
+	"""
+	field_class = forms.IntegerField
+
+
+class IdInFilter(filters.BaseInFilter, IdFilter):
+	"""
+	``?user__in=1,2,3``
+	"""
+
+
+class PostFilter(filters.FilterSet):
+	"""
+	Автор (``user``, ``user__in``) и период (``created_at__gte``, ``created_at__lt`` и т.д.).
+	Запрос постов автора по дате читается по индексу (user, created_at, id).
+	"""
+	user = IdFilter(field_name='user_id')
+	user__in = IdInFilter(field_name='user_id', lookup_expr='in')
+
+	class Meta:
+		model = Post
+		fields = {'created_at': DATETIME_LOOKUPS}
+
+
+class CommentFilter(filters.FilterSet):
+	"""
+	Автор, пост (``user``, ``post`` и ``__in``), родитель и период ``created_at``.
+	Комментарии поста читаются по индексу (post, tree_id, lft) или (post, tree_id, path) сразу в порядке дерева,
+	комментарии автора по дате - по индексу (user, created_at, id).
+	"""
+	user = IdFilter(field_name='user_id')
+	user__in = IdInFilter(field_name='user_id', lookup_expr='in')
+	post = IdFilter(field_name='post_id')
+	post__in = IdInFilter(field_name='post_id', lookup_expr='in')
+	parent = IdFilter(field_name='parent_id')
+
+	class Meta:
+		model = Comment
+		fields = {'created_at': DATETIME_LOOKUPS}
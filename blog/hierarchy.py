@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db.models import Subquery, TextField, Value
+from django.db.models.functions import Concat, Length, Substr
+
+# Шаг материализованного пути - id комментария в base36, дополненный нулями до одной ширины,
+# чтобы строковый порядок путей совпадал с обходом дерева в глубину (братья по возрастанию id).
+# Это порядок вставки COMMENT_INSERTION_MODE = 'append'; в режиме 'ordered' MPTT ставит братьев
+# по created_at, и ветки с комментариями, созданными задним числом (импорт), после перехода
+# на пути читаются в другом порядке.
+# 7 знаков хватает до id 36 ** 7 - 1 (около 7.8e10); индекс Postgres вмещает около 380 уровней.
+PATH_STEP = 7
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_step(pk):
+	digits = []
+	while pk:
+		pk, digit = divmod(pk, len(PATH_DIGITS))
+		digits.append(PATH_DIGITS[digit])
+	return ''.join(reversed(digits)).rjust(PATH_STEP, '0')
+
+
+def uses_paths():
+	"""
+	COMMENT_HIERARCHY = 'path': порядок дерева и поддеревья читаются по ``path``, ответ вставляется
+	без сдвига lft/rght соседей, а nested set догоняет фоновая задача ``comments.rebuild_tree``.
+	"""
+	return settings.COMMENT_HIERARCHY == 'path'
+
+
+def tree_ordering():
+	"""
+	Порядок обхода деревьев в глубину для текущего режима.
+	"""
+	return ('tree_id', 'path') if uses_paths() else ('tree_id', 'lft')
+
+
+def subtree_filter(comment_id, comment):
+	"""
+	Условия выборки комментария ``comment_id`` и его поддерева одним диапазоном по индексу;
+	``comment`` - queryset этой строки, границы берутся из нее подзапросами.
+	Путь потомка начинается с пути комментария, а пути правее поддерева - не меньше пути
+	со следующим id в последнем шаге.
+	"""
+	if uses_paths():
+		path = Subquery(comment.values('path'))
+		return {
+			'path__gte': path,
+			'path__lt': Concat(
+				Substr(path, 1, Length(path) - PATH_STEP),
+				Value(path_step(comment_id + 1)),
+				output_field=TextField(),
+			),
+		}
+	return {
+		'tree_id': Subquery(comment.values('tree_id')),
+		'lft__gte': Subquery(comment.values('lft')),
+		'lft__lt': Subquery(comment.values('rght')),
+	}
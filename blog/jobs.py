@@ -0,0 +1,187 @@
+import json
+import logging
+import statistics
+import time
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .bulk import renumber_tree
+from .counters import repair_counters
+from .models import Comment, Job
+
+logger = logging.getLogger('blog.jobs')
+
+HANDLERS = {}
+
+# Сколько ближайших задач перебирать при захвате, если их уже забрали другие воркеры.
+CLAIM_CANDIDATES = 10
+
+
+def job(name):
+	"""
+	Регистрирует функцию как обработчик задач ``name``, аргументы задачи передаются именованными.
+	Обработчик выполняется в транзакции и должен быть идемпотентным: при ошибке он повторяется.
+	"""
+	def register(func):
+		HANDLERS[name] = func
+		return func
+	return register
+
+
+@job('comments.rebuild_tree')
+def rebuild_tree(tree_id):
+	return {'changed': renumber_tree(tree_id)}
+
+
+@job('comments.rebuild_trees')
+def rebuild_trees():
+	tree_ids = Comment.objects.order_by().values_list('tree_id', flat=True).distinct()
+	for tree_id in tree_ids.iterator():
+		Job.objects.enqueue('comments.rebuild_tree', tree_id=tree_id)
+
+
+@job('comments.repair_counters')
+def repair_comment_counters():
+	return repair_counters()._asdict()
+
+
+def requeue_stale():
+	"""
+	Возвращает в очередь задачи, которые выполняются дольше JOB_TIMEOUT: их воркер, скорее всего, упал.
+	Задача, у которой попытки исчерпаны, получает статус ``failed``, как после ошибки в ``run``:
+	иначе задача, роняющая воркер, перезапускалась бы бесконечно. Возвращает число возвращенных задач.
+	"""
+	now = timezone.now()
+	stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=now - timezone.timedelta(seconds=settings.JOB_TIMEOUT))
+	failed = stale.filter(attempts__gte=F('max_attempts')).update(
+		status=Job.FAILED,
+		finished_at=now,
+		last_error=f'Timed out after {settings.JOB_TIMEOUT}s, no attempts left',
+	)
+	if failed:
+		logger.warning(json.dumps({'stale_jobs_failed': failed}))
+	return stale.update(status=Job.PENDING)
+
+
+def prune():
+	deadline = timezone.now() - timezone.timedelta(seconds=settings.JOB_RETENTION)
+	return Job.objects.filter(status=Job.DONE, finished_at__lt=deadline).delete()[0]
+
+
+def claim():
+	"""
+	Забирает ближайшую готовую задачу. Захват - условный UPDATE по статусу, поэтому несколько
+	воркеров не получат одну задачу ни в Postgres, ни в SQLite (где нет SELECT ... SKIP LOCKED).
+	"""
+	now = timezone.now()
+	candidates = (
+		Job.objects
+		.filter(status=Job.PENDING, run_after__lte=now)
+		.order_by('run_after', 'id')
+		.values_list('id', flat=True)[:CLAIM_CANDIDATES]
+	)
+	for job_id in candidates:
+		claimed = Job.objects.filter(id=job_id, status=Job.PENDING).update(
+			status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1,
+		)
+		if claimed:
+			return Job.objects.get(id=job_id)
+	return None
+
+
+def run(job):
+	"""
+	Выполняет задачу. При ошибке задача возвращается в очередь с задержкой JOB_RETRY_DELAY * 2^(попытка - 1),
+	пока не исчерпаны попытки, после чего получает статус ``failed``.
+	"""
+	started = time.perf_counter()
+	result = None
+	try:
+		handler = HANDLERS.get(job.name)
+		if handler is None:
+			raise LookupError(f'Unknown job {job.name!r}')
+		with transaction.atomic():
+			result = handler(**job.kwargs)
+	except Exception:
+		job.last_error = traceback.format_exc()
+		if job.attempts < job.max_attempts:
+			job.status = Job.PENDING
+			job.run_after = timezone.now() + timezone.timedelta(
+				seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1),
+			)
+		else:
+			job.status = Job.FAILED
+	else:
+		job.status = Job.DONE
+		job.last_error = ''
+
+	job.finished_at = timezone.now()
+	job.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+	job.save(update_fields=['status', 'run_after', 'finished_at', 'duration_ms', 'last_error'])
+
+	record = {
+		'job': job.name,
+		'id': job.id,
+		'status': job.status,
+		'attempt': job.attempts,
+		'duration_ms': job.duration_ms,
+	}
+	if result is not None:
+		record['result'] = result
+	if job.status == Job.DONE:
+		logger.info(json.dumps(record))
+	else:
+		logger.warning(json.dumps({**record, 'error': job.last_error.strip().splitlines()[-1]}))
+	return job
+
+
+def run_pending(limit=None):
+	"""
+	Выполняет готовые задачи, пока они есть (или ``limit`` штук). Возвращает число выполненных.
+	"""
+	count = 0
+	while limit is None or count < limit:
+		job = claim()
+		if job is None:
+			break
+		run(job)
+		count += 1
+	return count
+
+
+def queue_stats(sample_size=1000):
+	"""
+	Метрики очереди: число задач по статусам, готовые к выполнению, возраст самой старой из них,
+	а по каждому типу задач - глубина очереди и длительность последних ``sample_size`` выполнений.
+	"""
+	now = timezone.now()
+	stats = {'statuses': {status: 0 for status, _ in Job.STATUS_CHOICES}, 'jobs': {}}
+	for name, status, count in Job.objects.order_by().values_list('name', 'status').annotate(count=Count('id')):
+		stats['statuses'][status] += count
+		stats['jobs'].setdefault(name, {status: 0 for status, _ in Job.STATUS_CHOICES})[status] = count
+
+	due = Job.objects.filter(status=Job.PENDING, run_after__lte=now)
+	stats['due'] = due.count()
+	oldest = due.aggregate(oldest=Min('run_after'))['oldest']
+	stats['oldest_due_seconds'] = round((now - oldest).total_seconds(), 3) if oldest else 0
+
+	for name, job_stats in stats['jobs'].items():
+		durations = list(
+			Job.objects
+			.filter(name=name, status=Job.DONE)
+			.order_by('-finished_at')
+			.values_list('duration_ms', flat=True)[:sample_size]
+		)
+		if durations:
+			durations.sort()
+			job_stats['duration_ms'] = {
+				'mean': round(statistics.mean(durations), 2),
+				'p50': durations[len(durations) // 2],
+				'p95': durations[int(len(durations) * 0.95)],
+				'max': durations[-1],
+			}
+	return stats
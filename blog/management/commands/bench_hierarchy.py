@@ -0,0 +1,91 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from blog.bulk import import_comments, renumber_tree
+from blog.hierarchy import subtree_filter, tree_ordering
+from blog.models import Post, Comment
+from blog.tree import TREE_FIELDS
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Сравнивает режимы COMMENT_HIERARCHY mptt и path на смешанной нагрузке по одной горячей '
+		'ветке: чтение поддерева случайного комментария и ответ на случайный комментарий. '
+		'Все изменения откатываются.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--nodes', type=int, default=20000, help='Размер дерева')
+		parser.add_argument('--ops', type=int, default=1000, help='Число операций в каждом режиме')
+		parser.add_argument('--writes', type=float, default=0.2, help='Доля записей')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			self.run(options['nodes'], options['ops'], options['writes'], options['seed'])
+			transaction.set_rollback(True)
+
+	def run(self, nodes, ops, writes, seed):
+		rnd = random.Random(seed)
+		user = User.objects.create(username='bench_hierarchy', email='bench_hierarchy@example.com')
+		post = Post.objects.create(user=user, title='bench_hierarchy', body='')
+
+		# Как в bench_replies: свежие комментарии чаще получают ответы.
+		records = [{'id': 0, 'parent': None, 'post': post.id, 'user': user.id, 'body': 'root'}]
+		for index in range(1, nodes):
+			parent = int(index * rnd.random() ** 0.5)
+			records.append({'id': index, 'parent': parent, 'user': user.id, 'body': f'comment {index}'})
+		result = import_comments(records)
+		tree_id = Comment.objects.filter(post=post).values_list('tree_id', flat=True).first()
+		renumber_tree(tree_id, order_by='lft', paths=True)
+		self.stdout.write(f'Built a {result.comments}-node thread in {result.seconds:.2f}s')
+
+		ids = list(Comment.objects.filter(post=post).values_list('id', flat=True))
+		workload = [(rnd.random() < writes, rnd.choice(ids)) for _ in range(ops)]
+		for mode in ('mptt', 'path'):
+			with override_settings(COMMENT_HIERARCHY=mode), transaction.atomic():
+				self.report(mode, *self.measure(user, workload))
+				started = time.perf_counter()
+				changed = renumber_tree(tree_id)
+				self.stdout.write(f'{mode:<5} renumber after workload {(time.perf_counter() - started) * 1000:.1f}ms, {changed} rows')
+				transaction.set_rollback(True)
+
+	def measure(self, user, workload):
+		timings = {True: [], False: []}
+		queries = 0
+		started = time.perf_counter()
+		for write, comment_id in workload:
+			with CaptureQueriesContext(connection) as context:
+				operation_started = time.perf_counter()
+				if write:
+					Comment(user=user, parent_id=comment_id, body='reply').save()
+				else:
+					comment = Comment.objects.filter(pk=comment_id)
+					list(
+						Comment.objects
+						.filter(**subtree_filter(comment_id, comment))
+						.order_by(*tree_ordering())
+						.values_list(*TREE_FIELDS)
+					)
+				timings[write].append((time.perf_counter() - operation_started) * 1000)
+			if write:
+				queries += len(context.captured_queries)
+		return time.perf_counter() - started, timings, queries / max(len(timings[True]), 1)
+
+	def report(self, mode, seconds, timings, queries):
+		line = f'{mode:<5} {sum(len(values) for values in timings.values()) / seconds:8.1f} ops/s'
+		for write, label in ((False, 'read'), (True, 'write')):
+			values = sorted(timings[write])
+			if values:
+				line += (
+					f'  {label} p50 {values[len(values) // 2]:6.2f}ms'
+					f' p95 {values[int(len(values) * 0.95)]:6.2f}ms'
+				)
+		self.stdout.write(f'{line}  queries/write {queries:.1f}')
@@ -0,0 +1,123 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from blog.bulk import import_comments
+from blog.models import Post, Comment
+
+User = get_user_model()
+
+# Индексы из 0007_query_pattern_indexes, которые сравниваются с их отсутствием.
+BENCH_INDEXES = (
+	(Comment, 'blog_comment_post_tree_idx'),
+	(Comment, 'blog_comment_user_created_idx'),
+	(Post, 'blog_post_user_created_idx'),
+)
+PAGE_SIZE = 100
+
+
+class Command(BaseCommand):
+	help = (
+		'Планы EXPLAIN и время типичных запросов списка (комментарии поста за период, '
+		'последние комментарии автора, посты автора по дате) без составных индексов и с ними '
+		'на сгенерированных данных. Все изменения откатываются.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--users', type=int, default=500)
+		parser.add_argument('--posts', type=int, default=5000)
+		parser.add_argument('--comments', type=int, default=100000)
+		parser.add_argument('--repeat', type=int, default=50, help='Число замеров каждого запроса')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			self.run(options, random.Random(options['seed']))
+			transaction.set_rollback(True)
+
+	def run(self, options, rnd):
+		users = User.objects.bulk_create(
+			User(username=f'bench_indexes_{index}', email=f'bench_indexes_{index}@example.com')
+			for index in range(options['users'])
+		)
+		started = timezone.now() - timezone.timedelta(days=365)
+		posts = Post.objects.bulk_create(
+			Post(user=rnd.choice(users), title=f'post {index}', body='')
+			for index in range(options['posts'])
+		)
+
+		def skewed(objects):
+			# Немногие активные авторы и популярные посты дают большую часть комментариев.
+			return objects[int(len(objects) * rnd.random() ** 3)]
+
+		records = []
+		for index in range(options['comments']):
+			record = {
+				'id': index,
+				'user': skewed(users).id,
+				'body': f'comment {index}',
+				'created_at': started + timezone.timedelta(seconds=index * 365 * 86400 // options['comments']),
+				'parent': None,
+				'post': None,
+			}
+			if records and rnd.random() < 0.7:
+				record['parent'] = rnd.randrange(len(records))
+			else:
+				record['post'] = skewed(posts).id
+			records.append(record)
+		result = import_comments(records)
+		self.stdout.write(f'{len(users)} users, {len(posts)} posts, {result.comments} comments')
+
+		post = Post.objects.order_by('-comment_count').first()
+		user = users[0]
+		Post.objects.bulk_create(Post(user=user, title=f'own post {index}', body='') for index in range(options['posts'] // 10))
+		since = started + timezone.timedelta(days=180)
+		queries = {
+			'comments on post since T': (
+				Comment.objects.filter(post_id=post.id, created_at__gte=since).order_by('tree_id', 'lft', 'id')
+			),
+			"user's latest comments": Comment.objects.filter(user_id=user.id).order_by('-created_at', '-id'),
+			'posts by user by date': Post.objects.filter(user_id=user.id).order_by('created_at', 'id'),
+		}
+
+		# Контекст schema_editor в SQLite нельзя открыть внутри транзакции, а одиночные
+		# CREATE/DROP INDEX в ней выполняются и откатываются на обеих СУБД.
+		schema_editor = connection.schema_editor()
+		indexes = [(model, next(index for index in model._meta.indexes if index.name == name)) for model, name in BENCH_INDEXES]
+
+		for model, index in indexes:
+			schema_editor.execute(index.remove_sql(model, schema_editor))
+		self.analyze()
+		self.measure('without indexes', queries, options['repeat'])
+
+		for model, index in indexes:
+			schema_editor.execute(index.create_sql(model, schema_editor))
+		self.analyze()
+		self.measure('with indexes', queries, options['repeat'])
+
+	def analyze(self):
+		# Статистика нужна планировщику, чтобы выбрать составной индекс вместо индекса внешнего ключа.
+		with connection.cursor() as cursor:
+			cursor.execute('ANALYZE')
+
+	def measure(self, label, queries, repeat):
+		self.stdout.write(self.style.MIGRATE_HEADING(label))
+		for name, queryset in queries.items():
+			page = queryset[:PAGE_SIZE + 1]
+			timings = []
+			for _ in range(repeat):
+				started = time.perf_counter()
+				list(page.all())
+				timings.append((time.perf_counter() - started) * 1000)
+			timings.sort()
+			self.stdout.write(
+				f'{name:<26} mean {statistics.mean(timings):7.2f}ms  '
+				f'p50 {timings[len(timings) // 2]:7.2f}ms  max {timings[-1]:7.2f}ms'
+			)
+			for line in page.explain().splitlines():
+				self.stdout.write(f'    {line}')
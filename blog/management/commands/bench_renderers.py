@@ -0,0 +1,78 @@
+import gzip
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from blog.bulk import import_comments
+from blog.models import Post, Comment
+from blog.serializers import CommentSerializer
+from test_comments.compression import brotli
+from test_comments.renderers import ColumnarJSONRenderer, FastJSONRenderer
+
+User = get_user_model()
+
+BENCH_RENDERERS = (
+	('json', JSONRenderer),
+	('orjson', FastJSONRenderer),
+	('columns', ColumnarJSONRenderer),
+)
+
+
+class Command(BaseCommand):
+	help = (
+		'Стоимость ответа со списком комментариев: мкс на комментарий для CommentSerializer и '
+		'рендеров JSON, orjson и колонок, размер тела без сжатия, в gzip и brotli. '
+		'Все изменения откатываются.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--comments', type=int, default=1000, help='Комментариев в ответе')
+		parser.add_argument('--repeat', type=int, default=20, help='Число замеров, берется медиана')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			self.run(options['comments'], options['repeat'], options['seed'])
+			transaction.set_rollback(True)
+
+	def run(self, count, repeat, seed):
+		rnd = random.Random(seed)
+		user = User.objects.create(username='bench_renderers', email='bench_renderers@example.com')
+		post = Post.objects.create(user=user, title='bench_renderers', body='')
+		records = [{'id': 0, 'parent': None, 'post': post.id, 'user': user.id, 'body': 'root'}]
+		for index in range(1, count):
+			words = ' '.join(rnd.choice(('комментарий', 'comment', 'reply', 'ответ')) for _ in range(rnd.randint(3, 30)))
+			records.append({'id': index, 'parent': int(index * rnd.random()), 'user': user.id, 'body': words})
+		import_comments(records)
+		comments = list(Comment.objects.filter(post=post).order_by('tree_id', 'lft'))
+
+		def serialize():
+			return {'next': None, 'previous': None, 'results': CommentSerializer(comments, many=True).data}
+
+		data = serialize()
+		serialize_us = self.measure(serialize, repeat) / count
+		self.stdout.write(f'{count} comments, serializer {serialize_us:.2f}us/comment')
+		for name, renderer_class in BENCH_RENDERERS:
+			renderer = renderer_class()
+			content = renderer.render(data)
+			render_us = self.measure(lambda: renderer.render(data), repeat) / count
+			line = (
+				f'{name:<8} render {render_us:6.2f}us/comment  total {serialize_us + render_us:6.2f}us/comment'
+				f'  {len(content):>9} B  gzip {len(gzip.compress(content, settings.COMPRESSION_GZIP_LEVEL)):>8} B'
+			)
+			if brotli is not None:
+				line += f'  br {len(brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)):>8} B'
+			self.stdout.write(line)
+
+	def measure(self, func, repeat):
+		timings = []
+		for _ in range(repeat):
+			started = time.perf_counter()
+			func()
+			timings.append((time.perf_counter() - started) * 1e6)
+		return sorted(timings)[len(timings) // 2]
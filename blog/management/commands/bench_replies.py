@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from blog.bulk import import_comments
+from blog.models import Post, Comment
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Сравнивает задержку ответа на комментарий в режимах вставки ordered и append '
+		'на одном большом дереве. Все изменения откатываются.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--nodes', type=int, default=50000, help='Размер дерева')
+		parser.add_argument('--replies', type=int, default=200, help='Число ответов в каждом режиме')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			self.run(options['nodes'], options['replies'], random.Random(options['seed']))
+			transaction.set_rollback(True)
+
+	def run(self, nodes, replies, rnd):
+		user = User.objects.create(username='bench_replies', email='bench_replies@example.com')
+		post = Post.objects.create(user=user, title='bench_replies', body='')
+
+		# Свежие комментарии чаще получают ответы, поэтому родитель выбирается со смещением к концу.
+		records = [{'id': 0, 'parent': None, 'post': post.id, 'user': user.id, 'body': 'root'}]
+		for index in range(1, nodes):
+			parent = int(index * rnd.random() ** 0.5)
+			records.append({'id': index, 'parent': parent, 'user': user.id, 'body': f'comment {index}'})
+		result = import_comments(records)
+		self.stdout.write(f'Built a {result.comments}-node thread in {result.seconds:.2f}s')
+
+		ids = list(Comment.objects.filter(post=post).values_list('id', flat=True))
+		rightmost = Comment.objects.filter(post=post).order_by('-lft').values_list('id', flat=True).first()
+		scenarios = {
+			'random parent': [rnd.choice(ids) for _ in range(replies)],
+			'newest branch': [rightmost] * replies,
+		}
+		for scenario, parents in scenarios.items():
+			for mode in ('ordered', 'append'):
+				with override_settings(COMMENT_INSERTION_MODE=mode):
+					self.report(f'{scenario:<14} {mode:<8}', *self.measure(user, parents))
+
+	def measure(self, user, parents):
+		timings = []
+		queries = 0
+		for parent_id in parents:
+			parent = Comment.objects.get(pk=parent_id)
+			with CaptureQueriesContext(connection) as context:
+				started = time.perf_counter()
+				Comment(user=user, parent=parent, body='reply').save()
+				timings.append((time.perf_counter() - started) * 1000)
+			queries += len(context.captured_queries)
+		return timings, queries / len(parents)
+
+	def report(self, label, timings, queries):
+		timings.sort()
+		self.stdout.write(
+			f'{label} mean {statistics.mean(timings):7.2f}ms  '
+			f'p50 {timings[len(timings) // 2]:7.2f}ms  '
+			f'p95 {timings[int(len(timings) * 0.95)]:7.2f}ms  '
+			f'queries/reply {queries:.1f}'
+		)
@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from blog.bulk import import_comments
+from blog.models import Post, Comment
+from blog.serializers import CommentRowSerializer, CommentSerializer, PostRowSerializer, PostSerializer
+from test_comments.renderers import FastJSONRenderer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Сравнивает чтение списков через ModelSerializer и через строки values_list '
+		'(PostRowSerializer, CommentRowSerializer): мкс на строку для выборки и сериализации '
+		'и проверка, что JSON совпадает. Все изменения откатываются.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=10000, help='Строк в списке')
+		parser.add_argument('--repeat', type=int, default=5, help='Число замеров, берется медиана')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			self.run(options['rows'], options['repeat'], options['seed'])
+			transaction.set_rollback(True)
+
+	def run(self, rows, repeat, seed):
+		rnd = random.Random(seed)
+		user = User.objects.create(username='bench_serializers', email='bench_serializers@example.com')
+		post = Post.objects.create(user=user, title='bench_serializers', body='')
+		Post.objects.bulk_create(Post(user=user, title=f'bench_serializers {index}', body='body') for index in range(rows - 1))
+		records = [{'id': 0, 'parent': None, 'post': post.id, 'user': user.id, 'body': 'root'}]
+		for index in range(1, rows):
+			records.append({'id': index, 'parent': int(index * rnd.random()), 'user': user.id, 'body': f'comment {index}'})
+		import_comments(records)
+
+		benchmarks = (
+			('posts', Post.objects.filter(user=user).order_by('id'), PostSerializer, PostRowSerializer),
+			('comments', Comment.objects.filter(post=post).order_by('tree_id', 'lft'), CommentSerializer, CommentRowSerializer),
+		)
+		for name, queryset, serializer_class, row_serializer_class in benchmarks:
+			model_us = self.measure(lambda: serializer_class(list(queryset), many=True).data, repeat) / rows
+			row_queryset = row_serializer_class.get_row_queryset(queryset)
+			row_us = self.measure(lambda: row_serializer_class(list(row_queryset), many=True).data, repeat) / rows
+
+			render = FastJSONRenderer().render
+			if render(serializer_class(queryset, many=True).data) != render(row_serializer_class(row_queryset, many=True).data):
+				raise CommandError(f'{row_serializer_class.__name__} output differs from {serializer_class.__name__}')
+			self.stdout.write(
+				f'{name:<8} {rows} rows  ModelSerializer {model_us:6.2f}us/row  values_list {row_us:6.2f}us/row'
+				f'  speedup {model_us / row_us:4.1f}x  identical JSON'
+			)
+
+	def measure(self, func, repeat):
+		timings = []
+		for _ in range(repeat):
+			started = time.perf_counter()
+			func()
+			timings.append((time.perf_counter() - started) * 1e6)
+		return sorted(timings)[len(timings) // 2]
@@ -0,0 +1,30 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from test_comments.yasg import SCHEMA_FORMATS, encode_schema
+
+
+class Command(BaseCommand):
+	help = (
+		'Строит схему OpenAPI и записывает openapi.json и openapi.yaml в каталог, '
+		'из которого их отдает /swagger.json и /swagger.yaml при заданном OPENAPI_SCHEMA_DIR.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--output', default=settings.OPENAPI_SCHEMA_DIR, help='Каталог, по умолчанию OPENAPI_SCHEMA_DIR')
+
+	def handle(self, *args, **options):
+		output = options['output']
+		if not output:
+			raise CommandError('Pass --output or set OPENAPI_SCHEMA_DIR')
+		os.makedirs(output, exist_ok=True)
+		for schema_format, (filename, _, _) in SCHEMA_FORMATS.items():
+			path = os.path.join(output, filename)
+			content = encode_schema(schema_format)
+			# Запись через временный файл: работающий сервер не прочитает половину документа.
+			with open(f'{path}.tmp', 'wb') as file:
+				file.write(content)
+			os.replace(f'{path}.tmp', path)
+			self.stdout.write(f'{path}: {len(content)} bytes')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from blog.bulk import IMPORT_BATCH_SIZE, renumber_tree
+from blog.models import Comment
+
+
+class Command(BaseCommand):
+	help = (
+		'Готовит комментарии к смене COMMENT_HIERARCHY. --to path строит материализованные пути '
+		'по lft/rght, --to mptt перенумеровывает lft/rght в порядке путей. Каждое дерево '
+		'обрабатывается в своей транзакции под блокировкой корня, повторный запуск безопасен.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--to', choices=('path', 'mptt'), required=True, help='Целевой режим')
+		parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+	def handle(self, *args, **options):
+		to_paths = options['to'] == 'path'
+		trees = changed = 0
+		tree_ids = Comment.objects.order_by('tree_id').values_list('tree_id', flat=True).distinct()
+		for tree_id in list(tree_ids):
+			changed += renumber_tree(
+				tree_id,
+				batch_size=options['batch_size'],
+				order_by='lft' if to_paths else 'path',
+				paths=to_paths,
+			)
+			trees += 1
+		self.stdout.write(self.style.SUCCESS(f'Converted {trees} trees to {options["to"]}, updated {changed} comments'))
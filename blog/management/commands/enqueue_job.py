@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.jobs import HANDLERS
+from blog.models import Job
+
+
+class Command(BaseCommand):
+	help = (
+		'Ставит фоновую задачу в очередь, например полную перенумерацию деревьев комментариев:\n'
+		'  python manage.py enqueue_job comments.rebuild_trees\n'
+		'  python manage.py enqueue_job comments.rebuild_tree --kwargs \'{"tree_id": 42}\''
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('name', help=f'Одна из: {", ".join(sorted(HANDLERS))}')
+		parser.add_argument('--kwargs', default='{}', help='Аргументы задачи в JSON')
+		parser.add_argument('--delay', type=float, default=0, help='Не выполнять раньше чем через столько секунд')
+
+	def handle(self, *args, **options):
+		if options['name'] not in HANDLERS:
+			raise CommandError(f'Unknown job {options["name"]!r}, expected one of: {", ".join(sorted(HANDLERS))}')
+		try:
+			kwargs = json.loads(options['kwargs'])
+		except ValueError as exc:
+			raise CommandError(f'Invalid --kwargs: {exc}')
+		if not isinstance(kwargs, dict):
+			raise CommandError('--kwargs must be a JSON object')
+
+		job = Job.objects.enqueue(options['name'], delay=options['delay'], **kwargs)
+		if job is None:
+			self.stdout.write('The same job is already pending')
+		else:
+			self.stdout.write(self.style.SUCCESS(f'Enqueued {job}'))
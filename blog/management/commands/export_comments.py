@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.export import EXPORT_CHUNK_SIZE, get_export_queryset, iter_ndjson, parse_export_datetime
+from blog.models import Post
+
+
+class Command(BaseCommand):
+	help = 'Потоково выгружает комментарии поста или периода в NDJSON.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--post', type=int, help='id поста')
+		parser.add_argument('--since', help='Начало периода (ISO 8601), включительно')
+		parser.add_argument('--until', help='Конец периода (ISO 8601), не включительно')
+		parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+		parser.add_argument('--output', '-o', help='Файл для записи, по умолчанию stdout')
+
+	def handle(self, *args, **options):
+		params = {}
+		if options['post'] is not None:
+			try:
+				params['post'] = Post.objects.only('id').get(id=options['post'])
+			except Post.DoesNotExist:
+				raise CommandError(f'Post {options["post"]} does not exist')
+		for name in ('since', 'until'):
+			if options[name] is not None:
+				try:
+					params[name] = parse_export_datetime(options[name])
+				except ValueError as e:
+					raise CommandError(e)
+
+		lines = iter_ndjson(get_export_queryset(**params), chunk_size=options['chunk_size'])
+		if options['output']:
+			with open(options['output'], 'w', encoding='utf-8') as output:
+				output.writelines(lines)
+		else:
+			for line in lines:
+				self.stdout.write(line, ending='')
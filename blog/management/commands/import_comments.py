@@ -0,0 +1,34 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.bulk import IMPORT_BATCH_SIZE, import_comments
+
+
+class Command(BaseCommand):
+	help = (
+		'Загружает новые деревья комментариев из NDJSON (ключи id, parent, post, user, body, created_at) '
+		'одной транзакцией без пересчета MPTT на каждую запись.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('input', nargs='?', help='NDJSON файл, по умолчанию stdin')
+		parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+	def handle(self, *args, **options):
+		try:
+			if options['input']:
+				with open(options['input'], encoding='utf-8') as input_file:
+					records = [json.loads(line) for line in input_file if line.strip()]
+			else:
+				records = [json.loads(line) for line in sys.stdin if line.strip()]
+			result = import_comments(records, batch_size=options['batch_size'])
+		except (KeyError, ValueError) as e:
+			raise CommandError(f'Import failed: {e}')
+
+		rate = result.comments / result.seconds if result.seconds else 0
+		self.stdout.write(self.style.SUCCESS(
+			f'Imported {result.comments} comments in {result.trees} trees '
+			f'in {result.seconds:.2f}s ({rate:.0f} comments/s)'
+		))
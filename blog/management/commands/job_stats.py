@@ -0,0 +1,15 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from blog.jobs import queue_stats
+
+
+class Command(BaseCommand):
+	help = 'Метрики очереди фоновых задач в JSON: глубина по статусам и типам задач, возраст очереди, длительность выполнения.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sample-size', type=int, default=1000, help='Сколько последних выполнений учитывать в длительности')
+
+	def handle(self, *args, **options):
+		self.stdout.write(json.dumps(queue_stats(options['sample_size']), indent=2))
@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.models import Post
+
+READ_PATHS = (
+	'/api/v1/posts/',
+	'/api/v1/posts/{post}/',
+	'/api/v1/comments/?post={post}',
+	'/api/v1/posts/{post}/comments/tree/?max_nodes=500',
+)
+
+# Локальные серверы для --serve: команда и переменные окружения поверх текущих.
+SERVER_PROFILES = {
+	'runserver': ([sys.executable, 'manage.py', 'runserver', '{bind}', '--noreload'], {'DB_CONN_MAX_AGE': '0'}),
+	'gunicorn-no-persist': ([sys.executable, '-m', 'gunicorn', 'test_comments.wsgi'], {'DB_CONN_MAX_AGE': '0'}),
+	'gunicorn': ([sys.executable, '-m', 'gunicorn', 'test_comments.wsgi'], {}),
+	'uvicorn': (
+		[sys.executable, '-m', 'gunicorn', 'test_comments.asgi'],
+		{'WEB_WORKER_CLASS': 'uvicorn.workers.UvicornWorker', 'ASYNC_READ_VIEWS': 'True', 'DB_CONN_MAX_AGE': '0'},
+	),
+}
+SERVER_START_TIMEOUT = 30
+
+
+async def read_response(reader):
+	status_line = await reader.readline()
+	if not status_line:
+		raise ConnectionError('Connection closed')
+	status = int(status_line.split()[1])
+
+	headers = {}
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b''):
+			break
+		name, _, value = line.decode('latin1').partition(':')
+		headers[name.strip().lower()] = value.strip()
+
+	if headers.get('transfer-encoding') == 'chunked':
+		while True:
+			size = int((await reader.readline()).split(b';')[0], 16)
+			await reader.readexactly(size + 2)
+			if size == 0:
+				break
+	else:
+		await reader.readexactly(int(headers.get('content-length', 0)))
+	return status, headers.get('connection') == 'close'
+
+
+class Command(BaseCommand):
+	help = (
+		'Нагрузочный тест чтения: запросы/с и задержки p50/p95/p99 для нескольких запущенных серверов '
+		'при одинаковой конкуренции, например синхронного WSGI и асинхронного ASGI:\n'
+		'  WEB_BIND=127.0.0.1:8000 gunicorn test_comments.wsgi\n'
+		'  WEB_BIND=127.0.0.1:8001 WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker ASYNC_READ_VIEWS=True gunicorn test_comments.asgi\n'
+		'  python manage.py loadtest --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001\n'
+		'или запускает серверы сам по очереди: --serve runserver --serve gunicorn --serve uvicorn.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--target', action='append', default=[], help='имя=URL запущенного сервера, можно несколько')
+		parser.add_argument('--serve', action='append', default=[], choices=SERVER_PROFILES, help='Запустить локальный сервер')
+		parser.add_argument('--port', type=int, default=8100, help='Первый порт для --serve')
+		parser.add_argument('--concurrency', type=int, default=200, help='Число одновременных соединений')
+		parser.add_argument('--duration', type=float, default=10, help='Длительность замера, с')
+		parser.add_argument('--warmup', type=float, default=2, help='Прогрев перед замером, с')
+		parser.add_argument('--post', type=int, help='Пост для запросов, по умолчанию с наибольшим числом комментариев')
+		parser.add_argument('--path', action='append', help='Путь запроса, {post} заменяется id поста')
+
+	def handle(self, *args, **options):
+		targets = []
+		for target in options['target']:
+			name, _, url = target.partition('=')
+			if not url:
+				raise CommandError(f'Expected name=URL, got {target!r}')
+			targets.append((name, urlsplit(url)))
+		for port, name in enumerate(options['serve'], start=options['port']):
+			targets.append((name, urlsplit(f'http://127.0.0.1:{port}')))
+		if not targets:
+			raise CommandError('Pass at least one --target or --serve')
+
+		post = options['post']
+		if post is None:
+			post = Post.objects.order_by('-comment_count').values_list('id', flat=True).first()
+		paths = [path.format(post=post) for path in options['path'] or READ_PATHS]
+
+		self.stdout.write(f'{options["concurrency"]} connections, {options["duration"]}s, {len(paths)} paths')
+		for name, url in targets:
+			server = self.serve(name, url) if name in options['serve'] else None
+			try:
+				result = asyncio.run(self.run(url, paths, options['concurrency'], options['warmup'], options['duration']))
+			finally:
+				if server is not None:
+					server.terminate()
+					server.wait()
+			self.report(name, options['duration'], *result)
+
+	def serve(self, name, url):
+		command, env = SERVER_PROFILES[name]
+		bind = f'{url.hostname}:{url.port}'
+		server = subprocess.Popen(
+			[part.format(bind=bind) for part in command],
+			cwd=settings.BASE_DIR,
+			env={**os.environ, **env, 'WEB_BIND': bind},
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL,
+		)
+		deadline = time.monotonic() + SERVER_START_TIMEOUT
+		while time.monotonic() < deadline:
+			if server.poll() is not None:
+				raise CommandError(f'{name} exited with code {server.returncode}')
+			try:
+				status = asyncio.run(self.get(url, '/api/v1/'))
+			except (OSError, ConnectionError, asyncio.IncompleteReadError):
+				time.sleep(0.2)
+				continue
+			if status < 500:
+				return server
+		server.terminate()
+		raise CommandError(f'{name} did not start in {SERVER_START_TIMEOUT}s')
+
+	async def get(self, url, path):
+		reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+		try:
+			writer.write(f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: close\r\n\r\n'.encode())
+			status, _ = await read_response(reader)
+		finally:
+			writer.close()
+		return status
+
+	async def run(self, url, paths, concurrency, warmup, duration):
+		started = time.perf_counter()
+		measure_from = started + warmup
+		deadline = measure_from + duration
+		timings = []
+		errors = [0, 0]
+
+		async def worker(offset):
+			reader = writer = None
+			for path in itertools.islice(itertools.cycle(paths), offset, None):
+				if time.perf_counter() >= deadline:
+					break
+				try:
+					if writer is None:
+						reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+					request_started = time.perf_counter()
+					writer.write(f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\n\r\n'.encode())
+					status, close = await read_response(reader)
+					finished = time.perf_counter()
+				except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+					errors[0] += 1
+					if writer is not None:
+						writer.close()
+					reader = writer = None
+					continue
+
+				if close:
+					writer.close()
+					reader = writer = None
+				if request_started >= measure_from:
+					timings.append((finished - request_started) * 1000)
+					if status >= 400:
+						errors[1] += 1
+			if writer is not None:
+				writer.close()
+
+		await asyncio.gather(*(worker(index) for index in range(concurrency)))
+		return timings, errors
+
+	def report(self, name, duration, timings, errors):
+		if not timings:
+			self.stdout.write(self.style.ERROR(f'{name}: no successful requests ({errors[0]} connection errors)'))
+			return
+		timings.sort()
+		quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+		self.stdout.write(
+			f'{name:<20} {len(timings) / duration:8.1f} req/s  '
+			f'p50 {quantiles[49]:7.1f}ms  p95 {quantiles[94]:7.1f}ms  p99 {quantiles[98]:7.1f}ms  '
+			f'errors {errors[0]}  4xx/5xx {errors[1]}'
+		)
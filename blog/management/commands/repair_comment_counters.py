@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from blog.counters import REPAIR_BATCH_SIZE, repair_counters
+
+
+class Command(BaseCommand):
+	help = 'Пересчитывает comment_count постов и reply_count/descendant_count комментариев и исправляет расхождения.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=REPAIR_BATCH_SIZE)
+
+	def handle(self, *args, **options):
+		result = repair_counters(batch_size=options['batch_size'])
+		self.stdout.write(self.style.SUCCESS(
+			f'Repaired {result.posts} posts and {result.comments} comments'
+		))
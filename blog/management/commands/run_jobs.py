@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog import jobs
+from blog.events import prune_events
+from blog.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+	help = (
+		'Воркер очереди фоновых задач (перенумерация деревьев комментариев, пересчет счетчиков): '
+		'выполняет готовые задачи, повторяет упавшие с задержкой и возвращает в очередь зависшие. '
+		'Можно запускать несколько воркеров одновременно.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--burst', action='store_true', help='Выйти, когда готовых задач не останется')
+		parser.add_argument('--max-jobs', type=int, help='Выйти после этого числа задач')
+		parser.add_argument('--sleep', type=float, default=settings.JOB_POLL_INTERVAL, help='Пауза при пустой очереди, с')
+
+	def handle(self, *args, **options):
+		if not options['burst'] and settings.RESPONSE_CACHE_BACKEND.endswith('LocMemCache'):
+			# Задачи перенумеровывают деревья и повышают версии постов в кэше своего процесса.
+			self.stderr.write(self.style.WARNING(
+				'The response cache is local to this process: renumbered trees stay cached in web workers '
+				'until RESPONSE_CACHE_TIMEOUT. Set RESPONSE_CACHE_BACKEND to a shared cache.'
+			))
+		processed = 0
+		try:
+			while True:
+				jobs.requeue_stale()
+				limit = options['max_jobs'] - processed if options['max_jobs'] is not None else None
+				count = jobs.run_pending(limit)
+				processed += count
+				if options['burst'] and not count or limit is not None and count >= limit:
+					break
+				if not count:
+					jobs.prune()
+					prune_events()
+					prune_tombstones()
+					time.sleep(options['sleep'])
+		except KeyboardInterrupt:
+			pass
+		self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs'))
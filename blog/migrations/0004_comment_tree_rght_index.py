@@ -0,0 +1,17 @@
+# Generated by Django 4.1.2 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_comment_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['tree_id', 'rght'], name='blog_comment_tree_rght_idx'),
+        ),
+    ]
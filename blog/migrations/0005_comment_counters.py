@@ -0,0 +1,69 @@
+# Generated by Django 4.1.2 on 2026-10-18 15:32
+
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    # Замороженная копия blog.counters.repair_counters на исторических моделях и без сброса кэша
+    # ответов: при миграции кэша еще нет, а код приложения со временем меняется.
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    db = schema_editor.connection.alias
+
+    children = defaultdict(list)
+    comment_counts = Counter()
+    for comment_id, parent_id, post_id in Comment.objects.using(db).values_list('id', 'parent_id', 'post_id').iterator(chunk_size=1000):
+        children[parent_id].append(comment_id)
+        comment_counts[post_id] += 1
+
+    order = []
+    stack = list(children.get(None, ()))
+    while stack:
+        comment_id = stack.pop()
+        order.append(comment_id)
+        stack.extend(children.get(comment_id, ()))
+    descendants = defaultdict(int)
+    for comment_id in reversed(order):
+        for child_id in children.get(comment_id, ()):
+            descendants[comment_id] += descendants[child_id] + 1
+
+    comments = [
+        Comment(id=comment_id, reply_count=len(children.get(comment_id, ())), descendant_count=descendants[comment_id])
+        for comment_id in order
+        if comment_id in children
+    ]
+    Comment.objects.using(db).bulk_update(comments, ['reply_count', 'descendant_count'], batch_size=1000)
+    posts = [Post(id=post_id, comment_count=count) for post_id, count in comment_counts.items()]
+    Post.objects.using(db).bulk_update(posts, ['comment_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_comment_tree_rght_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='descendant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['comment_count', 'id'], name='blog_post_comment_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
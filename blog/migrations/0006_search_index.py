@@ -0,0 +1,90 @@
+from django.db import migrations
+
+# DDL заморожен в миграции: индекс должен совпадать с выражением поиска в blog.search на момент
+# этой миграции, а не с текущим кодом приложения. Смена полей или конфигурации - новая миграция.
+SEARCH_FIELDS = {
+    'Post': ('title', 'body'),
+    'Comment': ('body',),
+}
+
+SQLITE_CREATE = {
+    'Post': [
+        "CREATE VIRTUAL TABLE blog_post_fts USING fts5(title, body, content='blog_post', content_rowid='id')",
+        'CREATE TRIGGER blog_post_fts_ai AFTER INSERT ON blog_post BEGIN '
+        'INSERT INTO blog_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END',
+        'CREATE TRIGGER blog_post_fts_ad AFTER DELETE ON blog_post BEGIN '
+        "INSERT INTO blog_post_fts (blog_post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+        'CREATE TRIGGER blog_post_fts_au AFTER UPDATE OF title, body ON blog_post BEGIN '
+        "INSERT INTO blog_post_fts (blog_post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+        'INSERT INTO blog_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END',
+        "INSERT INTO blog_post_fts (blog_post_fts) VALUES ('rebuild')",
+    ],
+    'Comment': [
+        "CREATE VIRTUAL TABLE blog_comment_fts USING fts5(body, content='blog_comment', content_rowid='id')",
+        'CREATE TRIGGER blog_comment_fts_ai AFTER INSERT ON blog_comment BEGIN '
+        'INSERT INTO blog_comment_fts (rowid, body) VALUES (new.id, new.body); END',
+        'CREATE TRIGGER blog_comment_fts_ad AFTER DELETE ON blog_comment BEGIN '
+        "INSERT INTO blog_comment_fts (blog_comment_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+        'CREATE TRIGGER blog_comment_fts_au AFTER UPDATE OF body ON blog_comment BEGIN '
+        "INSERT INTO blog_comment_fts (blog_comment_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+        'INSERT INTO blog_comment_fts (rowid, body) VALUES (new.id, new.body); END',
+        "INSERT INTO blog_comment_fts (blog_comment_fts) VALUES ('rebuild')",
+    ],
+}
+
+SQLITE_DROP = {
+    'Post': [
+        'DROP TRIGGER IF EXISTS blog_post_fts_ai',
+        'DROP TRIGGER IF EXISTS blog_post_fts_ad',
+        'DROP TRIGGER IF EXISTS blog_post_fts_au',
+        'DROP TABLE IF EXISTS blog_post_fts',
+    ],
+    'Comment': [
+        'DROP TRIGGER IF EXISTS blog_comment_fts_ai',
+        'DROP TRIGGER IF EXISTS blog_comment_fts_ad',
+        'DROP TRIGGER IF EXISTS blog_comment_fts_au',
+        'DROP TABLE IF EXISTS blog_comment_fts',
+    ],
+}
+
+
+def search_index(model_name):
+    # Postgres: GIN-индекс по выражению to_tsvector('simple', ...), как в запросе поиска.
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(
+        SearchVector(*SEARCH_FIELDS[model_name], config='simple'),
+        name=f'blog_{model_name.lower()}_search_idx',
+    )
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model_name in ('Post', 'Comment'):
+        if vendor == 'postgresql':
+            schema_editor.add_index(apps.get_model('blog', model_name), search_index(model_name))
+        elif vendor == 'sqlite':
+            for statement in SQLITE_CREATE[model_name]:
+                schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model_name in ('Post', 'Comment'):
+        if vendor == 'postgresql':
+            schema_editor.remove_index(apps.get_model('blog', model_name), search_index(model_name))
+        elif vendor == 'sqlite':
+            for statement in SQLITE_DROP[model_name]:
+                schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_comment_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
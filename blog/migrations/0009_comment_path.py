@@ -0,0 +1,58 @@
+# Generated by Django 4.1.2 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+# SQLite добавляет колонку с default пересозданием таблицы, которое теряет триггеры FTS5,
+# поэтому индекс из 0006 пересоздается вокруг AddField. DDL заморожен, как в 0006.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE blog_comment_fts USING fts5(body, content='blog_comment', content_rowid='id')",
+    'CREATE TRIGGER blog_comment_fts_ai AFTER INSERT ON blog_comment BEGIN INSERT INTO blog_comment_fts (rowid, body) VALUES (new.id, new.body); END',
+    "CREATE TRIGGER blog_comment_fts_ad AFTER DELETE ON blog_comment BEGIN INSERT INTO blog_comment_fts (blog_comment_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER blog_comment_fts_au AFTER UPDATE OF body ON blog_comment BEGIN INSERT INTO blog_comment_fts (blog_comment_fts, rowid, body) VALUES ('delete', old.id, old.body); INSERT INTO blog_comment_fts (rowid, body) VALUES (new.id, new.body); END",
+    "INSERT INTO blog_comment_fts (blog_comment_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS blog_comment_fts_ai',
+    'DROP TRIGGER IF EXISTS blog_comment_fts_ad',
+    'DROP TRIGGER IF EXISTS blog_comment_fts_au',
+    'DROP TABLE IF EXISTS blog_comment_fts',
+]
+
+
+def drop_sqlite_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+def create_sqlite_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_sqlite_search_index, create_sqlite_search_index),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['path'], name='blog_comment_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'tree_id', 'path'], name='blog_comment_post_path_idx'),
+        ),
+        migrations.RunPython(create_sqlite_search_index, drop_sqlite_search_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.2 on 2026-10-18 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_comment_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment_id', models.BigIntegerField()),
+                ('type', models.CharField(choices=[('created', 'Создан'), ('updated', 'Изменен'), ('deleted', 'Удален')], max_length=10)),
+                ('data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('post', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='blog.post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='commentevent',
+            index=models.Index(fields=['post', 'id'], name='blog_commentevent_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentevent',
+            index=models.Index(fields=['created_at'], name='blog_commentevent_created_idx'),
+        ),
+    ]
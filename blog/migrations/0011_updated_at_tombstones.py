@@ -0,0 +1,107 @@
+# Generated by Django 4.1.2 on 2026-10-18 16:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# SQLite добавляет колонку с default пересозданием таблицы, которое теряет триггеры FTS5,
+# поэтому индекс из 0006 пересоздается вокруг AddField. DDL заморожен, как в 0006.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE blog_post_fts USING fts5(title, body, content='blog_post', content_rowid='id')",
+    'CREATE TRIGGER blog_post_fts_ai AFTER INSERT ON blog_post BEGIN INSERT INTO blog_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END',
+    "CREATE TRIGGER blog_post_fts_ad AFTER DELETE ON blog_post BEGIN INSERT INTO blog_post_fts (blog_post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER blog_post_fts_au AFTER UPDATE OF title, body ON blog_post BEGIN INSERT INTO blog_post_fts (blog_post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); INSERT INTO blog_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "INSERT INTO blog_post_fts (blog_post_fts) VALUES ('rebuild')",
+    "CREATE VIRTUAL TABLE blog_comment_fts USING fts5(body, content='blog_comment', content_rowid='id')",
+    'CREATE TRIGGER blog_comment_fts_ai AFTER INSERT ON blog_comment BEGIN INSERT INTO blog_comment_fts (rowid, body) VALUES (new.id, new.body); END',
+    "CREATE TRIGGER blog_comment_fts_ad AFTER DELETE ON blog_comment BEGIN INSERT INTO blog_comment_fts (blog_comment_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER blog_comment_fts_au AFTER UPDATE OF body ON blog_comment BEGIN INSERT INTO blog_comment_fts (blog_comment_fts, rowid, body) VALUES ('delete', old.id, old.body); INSERT INTO blog_comment_fts (rowid, body) VALUES (new.id, new.body); END",
+    "INSERT INTO blog_comment_fts (blog_comment_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS blog_post_fts_ai',
+    'DROP TRIGGER IF EXISTS blog_post_fts_ad',
+    'DROP TRIGGER IF EXISTS blog_post_fts_au',
+    'DROP TABLE IF EXISTS blog_post_fts',
+    'DROP TRIGGER IF EXISTS blog_comment_fts_ai',
+    'DROP TRIGGER IF EXISTS blog_comment_fts_ad',
+    'DROP TRIGGER IF EXISTS blog_comment_fts_au',
+    'DROP TABLE IF EXISTS blog_comment_fts',
+]
+
+
+def drop_sqlite_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+def create_sqlite_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Существующие строки считаются неизменными с момента создания.
+    for model_name in ('Post', 'Comment'):
+        apps.get_model('blog', model_name).objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_comment_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_sqlite_search_index, create_sqlite_search_index),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Пост'), ('comment', 'Комментарий')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['updated_at', 'id'], name='blog_comment_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'updated_at', 'id'], name='blog_comment_post_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['updated_at', 'id'], name='blog_post_updated_idx'),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.RunPython(create_sqlite_search_index, drop_sqlite_search_index),
+        migrations.AddField(
+            model_name='tombstone',
+            name='post',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='blog.post'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='blog_tombstone_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['post', 'deleted_at', 'id'], name='blog_tombstone_post_idx'),
+        ),
+    ]
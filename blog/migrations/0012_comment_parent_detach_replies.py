@@ -0,0 +1,20 @@
+# Generated by Django 4.1.2 on 2026-10-18 17:04
+
+import blog.models
+from django.db import migrations
+import mptt.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_updated_at_tombstones'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='parent',
+            field=mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=blog.models.detach_replies, related_name='children_comment', to='blog.comment'),
+        ),
+    ]
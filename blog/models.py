@@ -1,21 +1,262 @@
+import json
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, F, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
 
+from .cache import bump_post_version
+from .hierarchy import path_step, uses_paths
+from .throttling import record_tree_lock_wait
+
 User = get_user_model()
 
+# Ключ транзакционной advisory-блокировки, под которой выдаются новые tree_id в PostgreSQL.
+# Блокировки отдельных деревьев берутся по паре (TREE_ID_LOCK, tree_id): пары ключей
+# и одиночные ключи в PostgreSQL не пересекаются.
+TREE_ID_LOCK = 0x626c6f67
+
 
 class Post(models.Model):
 	user = models.ForeignKey(User, related_name='post', on_delete=models.CASCADE)
 	title = models.CharField(max_length=200)
 	body = models.TextField()
 	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(default=timezone.now, editable=False)
+	comment_count = models.PositiveIntegerField(default=0, editable=False)
 
 	def __str__(self):
 		return self.title
 
+	def save(self, *args, **kwargs):
+		self.updated_at = timezone.now()
+		super().save(*args, **kwargs)
+		bump_post_version(self.pk)
+
 	class Meta:
 		ordering = ['title', 'created_at']
+		indexes = [
+			models.Index(fields=['title', 'created_at', 'id'], name='blog_post_title_created_idx'),
+			models.Index(fields=['created_at', 'id'], name='blog_post_created_idx'),
+			models.Index(fields=['comment_count', 'id'], name='blog_post_comment_count_idx'),
+			models.Index(fields=['user', 'created_at', 'id'], name='blog_post_user_created_idx'),
+			models.Index(fields=['updated_at', 'id'], name='blog_post_updated_idx'),
+		]
+
+
+class CommentManager(TreeManager):
+	def update_counters(self, post_id, parent_id, comments, descendants):
+		"""
+		Меняет ``comment_count`` поста и ``reply_count`` родителя на ``comments``,
+		а ``descendant_count`` родителя и всех его предков на ``descendants``.
+
+		Предки находятся рекурсивным запросом по ``parent_id``, а не по lft/rght, которые
+		после удаления с SET_NULL у оставшихся потомков уже не соответствуют дереву.
+		Вызывается в одной транзакции с созданием или удалением комментария.
+		"""
+		Post.objects.filter(pk=post_id).update(comment_count=Greatest(F('comment_count') + comments, 0))
+		if parent_id is not None:
+			self.update_ancestor_counters(parent_id, comments, descendants)
+
+	def update_ancestor_counters(self, parent_id, replies, descendants):
+		"""
+		Меняет ``reply_count`` комментария ``parent_id`` на ``replies``, а ``descendant_count``
+		его и всех его предков на ``descendants`` одним запросом.
+		"""
+		table = self._quoted_table()
+		with connections[self.db].cursor() as cursor:
+			cursor.execute(
+				f'{self._ancestors_cte(table)} '
+				f'UPDATE {table} SET '
+				f'descendant_count = CASE WHEN descendant_count + %s < 0 THEN 0 ELSE descendant_count + %s END, '
+				f'reply_count = CASE WHEN id <> %s THEN reply_count WHEN reply_count + %s < 0 THEN 0 ELSE reply_count + %s END '
+				f'WHERE id IN (SELECT id FROM ancestors)',
+				[parent_id, descendants, descendants, parent_id, replies, replies],
+			)
+
+	def add_to_ancestor_counters(self, increments):
+		"""
+		``update_ancestor_counters`` для многих родителей сразу, ``increments`` - {parent_id: (replies, descendants)}
+		с неотрицательными значениями. Предки всех родителей читаются одним рекурсивным запросом,
+		приращения суммируются в памяти и записываются одним UPDATE.
+		"""
+		table = self._quoted_table()
+		placeholders = ', '.join(['%s'] * len(increments))
+		with connections[self.db].cursor() as cursor:
+			cursor.execute(
+				f'WITH RECURSIVE ancestors (seed, id) AS ('
+				f'SELECT id, id FROM {table} WHERE id IN ({placeholders}) '
+				f'UNION ALL '
+				f'SELECT a.seed, c.parent_id FROM {table} c INNER JOIN ancestors a ON c.id = a.id WHERE c.parent_id IS NOT NULL'
+				f') '
+				f'SELECT seed, id FROM ancestors',
+				list(increments),
+			)
+			rows = cursor.fetchall()
+
+		descendants = Counter()
+		for seed, comment_id in rows:
+			descendants[comment_id] += increments[seed][1]
+		replies = {parent_id: value for parent_id, (value, _) in increments.items()}
+
+		def added(field, values):
+			ids_by_value = defaultdict(list)
+			for comment_id, value in values.items():
+				ids_by_value[value].append(comment_id)
+			return Case(
+				*(When(id__in=ids, then=F(field) + value) for value, ids in ids_by_value.items()),
+				default=F(field),
+				output_field=models.PositiveIntegerField(),
+			)
+
+		self.filter(id__in=list(descendants)).update(
+			descendant_count=added('descendant_count', descendants),
+			reply_count=added('reply_count', replies),
+		)
+
+	def _get_next_tree_id(self):
+		"""
+		Следующий свободный tree_id. Максимум читается под advisory-блокировкой до конца
+		транзакции, поэтому параллельные вставки новых деревьев, импорт и перенумерация
+		не получают одинаковые номера: следующая транзакция прочитает максимум после коммита
+		предыдущей. Номера подряд после выданного тоже принадлежат этой транзакции
+		(``import_comments`` нумерует ими все свои деревья). SQLite и так выполняет пишущие
+		транзакции по очереди. Вызывается внутри транзакции.
+		"""
+		connection = connections[self.db]
+		if connection.vendor == 'postgresql':
+			with connection.cursor() as cursor:
+				cursor.execute('SELECT pg_advisory_xact_lock(%s)', [TREE_ID_LOCK])
+		return super()._get_next_tree_id()
+
+	def lock_trees(self, tree_ids):
+		"""
+		Блокирует деревья ``tree_ids`` до конца транзакции перед изменением их lft/rght.
+		Блокируется номер дерева, а не строка корня: после удаления корня строки с lft = 1
+		нет до перенумерации, и блокировать было бы нечего. Деревья блокируются по возрастанию
+		номера, чтобы пакеты не ждали друг друга по кругу. SQLite и так выполняет пишущие
+		транзакции по очереди. Вызывается внутри транзакции.
+		"""
+		connection = connections[self.db]
+		if connection.vendor != 'postgresql':
+			return
+		with connection.cursor() as cursor:
+			for tree_id in sorted(set(tree_ids)):
+				cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [TREE_ID_LOCK, tree_id])
+
+	def lock_comment_trees(self, comment_ids, fields):
+		"""
+		Блокирует деревья комментариев ``comment_ids`` и возвращает их строки ``values_list(*fields)``
+		(``fields`` содержит ``tree_id``), прочитанные под блокировкой. Пока блокировка ожидалась,
+		перенумерация могла перенести комментарий в новое дерево: тогда блокируется и оно,
+		а строки читаются заново.
+		"""
+		tree_index = fields.index('tree_id')
+		locked = set()
+		while True:
+			rows = list(self.filter(pk__in=comment_ids).order_by().values_list(*fields))
+			trees = {row[tree_index] for row in rows} - locked
+			if not trees or connections[self.db].vendor != 'postgresql':
+				return rows
+			self.lock_trees(trees)
+			locked |= trees
+
+	def _quoted_table(self):
+		return connections[self.db].ops.quote_name(self.model._meta.db_table)
+
+	def _ancestors_cte(self, table):
+		# Комментарий с параметром %s и все его предки по цепочке parent_id.
+		return (
+			f'WITH RECURSIVE ancestors (id) AS ('
+			f'SELECT id FROM {table} WHERE id = %s '
+			f'UNION ALL '
+			f'SELECT c.parent_id FROM {table} c INNER JOIN ancestors a ON c.id = a.id WHERE c.parent_id IS NOT NULL'
+			f')'
+		)
+
+	def with_ancestors(self, comment_id):
+		"""
+		Комментарий и все его предки одним запросом. Как и в ``update_counters``, предки ищутся
+		по ``parent_id``, поэтому путь верен и после удалений с SET_NULL.
+		"""
+		table = self._quoted_table()
+		return self.filter(id__in=RawSQL(f'{self._ancestors_cte(table)} SELECT id FROM ancestors', (comment_id,)))
+
+	def append_node(self, node):
+		"""
+		Готовит новый комментарий к вставке последним ребенком родителя (или новым деревом).
+
+		Новый комментарий всегда самый свежий, поэтому поиск позиции по ``order_insertion_by``
+		не нужен, а место создается одним UPDATE только тех узлов, что правее вставки
+		(при ответе на последнюю ветку это лишь предки). Дерево блокируется на время вставки
+		(``lock_trees``), поэтому параллельные ответы в одном дереве выполняются по очереди
+		и не портят lft/rght, а ответы в разных деревьях друг другу не мешают.
+		Вызывается внутри транзакции до ``save()``.
+		"""
+		if node.parent_id is None:
+			node.tree_id = self._get_next_tree_id()
+			node.lft, node.rght, node.level = 1, 2, 0
+			return node
+
+		started = time.perf_counter()
+		rows = self.lock_comment_trees([node.parent_id], ('post_id', 'tree_id', 'rght', 'level'))
+		if not rows:
+			raise self.model.DoesNotExist('Parent comment does not exist.')
+		post_id, tree_id, rght, level = rows[0]
+		# Долгое ожидание блокировки переводит дерево в режим перегрузки, см. blog.throttling.
+		record_tree_lock_wait(tree_id, time.perf_counter() - started)
+
+		# Узлы, у которых lft > rght родителя, имеют и rght больше него, поэтому условие
+		# по одному rght покрывает весь сдвиг и читается по индексу (tree_id, rght).
+		self.filter(tree_id=tree_id, rght__gte=rght).update(
+			lft=Case(When(lft__gt=rght, then=F('lft') + 2), default=F('lft'), output_field=models.PositiveIntegerField()),
+			rght=F('rght') + 2,
+		)
+		node.post_id = post_id
+		node.tree_id = tree_id
+		node.lft, node.rght, node.level = rght, rght + 1, level + 1
+
+		if self.model.parent.is_cached(node) and node.parent is not None:
+			self._post_insert_update_cached_parent_right(node.parent, 2)
+		return node
+
+	def prepare_path_node(self, node):
+		"""
+		Готовит новый комментарий к вставке в режиме COMMENT_HIERARCHY = 'path' и возвращает путь родителя.
+
+		Ответ читает только строку родителя и не сдвигает lft/rght других узлов и не блокирует
+		дерево: он получает временные lft/rght сразу за родителем (с ними MPTT не ищет позицию
+		сам), а точную нумерацию проставит задача ``comments.rebuild_tree``. До нее ответы API
+		отдают временные значения (у соседних ответов они могут совпадать); перенумерация
+		увеличивает версию поста, и кэш ответов с ними сбрасывается. Собственный путь узла
+		зависит от pk и записывается после вставки.
+		"""
+		if node.parent_id is None:
+			node.tree_id = self._get_next_tree_id()
+			node.lft, node.rght, node.level = 1, 2, 0
+			return ''
+
+		parent = self.only('post_id', 'tree_id', 'rght', 'level', 'path').get(pk=node.parent_id)
+		node.post_id = parent.post_id
+		node.tree_id = parent.tree_id
+		node.lft, node.rght, node.level = parent.rght, parent.rght + 1, parent.level + 1
+		return parent.path
+
+
+def detach_replies(collector, field, sub_objs, using):
+	"""
+	SET_NULL для ответов удаленного комментария, который заодно обновляет их ``updated_at``:
+	у ответа меняется родитель, и синхронизация должна прислать его заново.
+	"""
+	collector.add_field_update(field, None, sub_objs)
+	collector.add_field_update(field.model._meta.get_field('updated_at'), timezone.now(), sub_objs)
 
 
 class Comment(MPTTModel):
@@ -26,14 +267,36 @@ class Comment(MPTTModel):
 		related_name='comment'
 	)
 	body = models.TextField(verbose_name='Comment')
-	created_at = models.DateTimeField(auto_now_add=True)
+	created_at = models.DateTimeField(default=timezone.now, editable=False)
+	# Время создания или последнего изменения текста; перенумерация lft/rght и счетчики его не меняют.
+	updated_at = models.DateTimeField(default=timezone.now, editable=False)
+	reply_count = models.PositiveIntegerField(default=0, editable=False)
+	descendant_count = models.PositiveIntegerField(default=0, editable=False)
 	parent = TreeForeignKey(
 		'self',
 		null=True,
 		blank=True,
 		related_name='children_comment',
-		on_delete=models.SET_NULL,
+		on_delete=detach_replies,
 	)
+	# Материализованный путь: шаги ``path_step`` от корня до комментария, см. blog.hierarchy.
+	# Заполняется только в режиме COMMENT_HIERARCHY = 'path'.
+	path = models.TextField(blank=True, default='', editable=False)
+
+	objects = CommentManager()
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['tree_id', 'lft'], name='blog_comment_tree_lft_idx'),
+			models.Index(fields=['tree_id', 'rght'], name='blog_comment_tree_rght_idx'),
+			models.Index(fields=['created_at', 'id'], name='blog_comment_created_idx'),
+			models.Index(fields=['post', 'tree_id', 'lft'], name='blog_comment_post_tree_idx'),
+			models.Index(fields=['user', 'created_at', 'id'], name='blog_comment_user_created_idx'),
+			models.Index(fields=['path'], name='blog_comment_path_idx'),
+			models.Index(fields=['post', 'tree_id', 'path'], name='blog_comment_post_path_idx'),
+			models.Index(fields=['updated_at', 'id'], name='blog_comment_updated_idx'),
+			models.Index(fields=['post', 'updated_at', 'id'], name='blog_comment_post_updated_idx'),
+		]
 
 	class MPTTMeta:
 		order_insertion_by = ['created_at']
@@ -42,8 +305,149 @@ class Comment(MPTTModel):
 		return self.body
 
 	def save(self, *args, **kwargs):
-		try:
-			self.post = self.parent.post
-		except AttributeError:
-			pass
-		super().save(*args, **kwargs)
+		adding = self._state.adding
+		self.updated_at = timezone.now()
+		inserting = adding and self.lft is None and self._mptt_updates_enabled and not self._mptt_is_tracking
+		with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+			parent_path = None
+			if inserting and uses_paths():
+				parent_path = self._tree_manager.prepare_path_node(self)
+			elif inserting and settings.COMMENT_INSERTION_MODE == 'append':
+				self._tree_manager.append_node(self)
+			else:
+				try:
+					self.post = self.parent.post
+				except AttributeError:
+					pass
+			super().save(*args, **kwargs)
+			if parent_path is not None:
+				self.path = parent_path + path_step(self.pk)
+				self._tree_manager.filter(pk=self.pk).update(path=self.path)
+				if self.parent_id is not None:
+					# Одна ожидающая задача на дерево: ответы, пришедшие за задержку, перенумеруются вместе.
+					Job.objects.enqueue('comments.rebuild_tree', delay=settings.COMMENT_PATH_REBUILD_DELAY, tree_id=self.tree_id)
+			if adding:
+				self._tree_manager.update_counters(self.post_id, self.parent_id, 1, 1)
+		bump_post_version(self.post_id)
+
+	def delete(self, *args, **kwargs):
+		# Счетчики, надгробие, событие и перенумерацию дерева ставит ``blog.signals.comment_deleted``:
+		# он срабатывает и при каскадном удалении, которое этот метод не вызывает.
+		# MPTT закрыл бы пропуск в lft/rght UPDATE по всему дереву прямо в запросе; вместо этого
+		# удаляется одна строка, а перенос потомков в отдельные деревья и перенумерацию выполняет
+		# фоновая задача. До нее в нумерации дерева остается пропуск, чтению он не мешает.
+		return models.Model.delete(self, *args, **kwargs)
+
+
+class JobManager(models.Manager):
+	def enqueue(self, name, delay=0, **kwargs):
+		"""
+		Ставит задачу ``name`` с аргументами ``kwargs`` в очередь в текущей транзакции: воркер увидит
+		ее только после коммита, а при откате она исчезнет вместе с изменениями. Если такая же задача
+		уже ждет выполнения, новая не создается.
+		"""
+		key = f'{name}:{json.dumps(kwargs, sort_keys=True)}'
+		if self.filter(key=key, status=Job.PENDING).exists():
+			return None
+		return self.create(
+			name=name,
+			key=key,
+			kwargs=kwargs,
+			max_attempts=settings.JOB_MAX_ATTEMPTS,
+			run_after=timezone.now() + timezone.timedelta(seconds=delay),
+		)
+
+
+class Job(models.Model):
+	PENDING = 'pending'
+	RUNNING = 'running'
+	DONE = 'done'
+	FAILED = 'failed'
+	STATUS_CHOICES = (
+		(PENDING, 'Ожидает'),
+		(RUNNING, 'Выполняется'),
+		(DONE, 'Выполнена'),
+		(FAILED, 'Ошибка'),
+	)
+
+	name = models.CharField(max_length=100)
+	key = models.CharField(max_length=255)
+	kwargs = models.JSONField(default=dict)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+	attempts = models.PositiveIntegerField(default=0)
+	max_attempts = models.PositiveIntegerField(default=1)
+	run_after = models.DateTimeField(default=timezone.now)
+	created_at = models.DateTimeField(default=timezone.now, editable=False)
+	started_at = models.DateTimeField(null=True, blank=True)
+	finished_at = models.DateTimeField(null=True, blank=True)
+	duration_ms = models.FloatField(null=True, blank=True)
+	last_error = models.TextField(blank=True)
+
+	objects = JobManager()
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['status', 'run_after', 'id'], name='blog_job_status_run_after_idx'),
+			models.Index(fields=['key', 'status'], name='blog_job_key_status_idx'),
+		]
+
+	def __str__(self):
+		return f'{self.name} #{self.pk} ({self.status})'
+
+
+class CommentEvent(models.Model):
+	"""
+	Журнал изменений комментариев для потока событий поста (blog.events). Строки пишутся в одной
+	транзакции с изменением и удаляются по истечении COMMENT_EVENTS_RETENTION; ссылка на пост
+	без ограничения в БД, чтобы удаление поста не перебирало его журнал.
+	"""
+	CREATED = 'created'
+	UPDATED = 'updated'
+	DELETED = 'deleted'
+	TYPE_CHOICES = (
+		(CREATED, 'Создан'),
+		(UPDATED, 'Изменен'),
+		(DELETED, 'Удален'),
+	)
+
+	post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+	comment_id = models.BigIntegerField()
+	type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+	data = models.JSONField(default=dict)
+	created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['post', 'id'], name='blog_commentevent_post_idx'),
+			models.Index(fields=['created_at'], name='blog_commentevent_created_idx'),
+		]
+
+	def __str__(self):
+		return f'comment.{self.type} #{self.comment_id}'
+
+
+class Tombstone(models.Model):
+	"""
+	Запись об удалении поста или комментария для синхронизации изменений (blog.sync).
+	Для комментария ``post`` - его пост, для поста - сам пост.
+	"""
+	POST = 'post'
+	COMMENT = 'comment'
+	KIND_CHOICES = (
+		(POST, 'Пост'),
+		(COMMENT, 'Комментарий'),
+	)
+
+	kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+	object_id = models.BigIntegerField()
+	post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+	deleted_at = models.DateTimeField(default=timezone.now, editable=False)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['deleted_at', 'id'], name='blog_tombstone_deleted_idx'),
+			models.Index(fields=['post', 'deleted_at', 'id'], name='blog_tombstone_post_idx'),
+		]
+
+	def __str__(self):
+		return f'{self.kind} #{self.object_id}'
@@ -0,0 +1,153 @@
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['reverse', 'position'])
+
+
+def _reverse_ordering(ordering):
+	return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+class KeysetPagination(CursorPagination):
+	"""
+	Курсорная пагинация по всем полям сортировки (keyset / seek method).
+
+	В отличие от CursorPagination позиция курсора хранит значения всех полей
+	сортировки, а не только первого, поэтому страница выбирается условием
+	``(a, b, id) > (x, y, z)`` без OFFSET и стоит O(page_size) на любой глубине.
+	К сортировке всегда добавляется ``id``, чтобы позиция была уникальной.
+	"""
+	ordering = ('id',)
+	page_size_query_param = 'page_size'
+	max_page_size = 1000
+	tiebreaker = 'id'
+
+	def get_ordering(self, request, queryset, view):
+		ordering = tuple(super().get_ordering(request, queryset, view))
+		if not any(field.lstrip('-') in (self.tiebreaker, 'pk') for field in ordering):
+			ordering += (self.tiebreaker,)
+		return ordering
+
+	def paginate_queryset(self, queryset, request, view=None):
+		queryset = self.get_page_queryset(queryset, request, view)
+		if queryset is None:
+			return None
+		return self.set_page(list(queryset))
+
+	def get_page_queryset(self, queryset, request, view=None):
+		"""
+		Queryset страницы (page_size + 1 строк) без выполнения запроса, чтобы его можно было
+		прочитать и синхронно, и через асинхронный ORM. Результат передается в ``set_page``.
+		"""
+		self.page_size = self.get_page_size(request)
+		if not self.page_size:
+			return None
+
+		self.base_url = request.build_absolute_uri()
+		self.ordering = self.get_ordering(request, queryset, view)
+		self.cursor = self.decode_cursor(request)
+
+		reverse = self.cursor is not None and self.cursor.reverse
+		if reverse:
+			queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+		else:
+			queryset = queryset.order_by(*self.ordering)
+
+		if self.cursor is not None:
+			try:
+				queryset = queryset.filter(self.get_keyset_filter(self.cursor))
+			except (ValueError, ValidationError):
+				raise NotFound(self.invalid_cursor_message)
+
+		return queryset[:self.page_size + 1]
+
+	def set_page(self, results):
+		self.page = results[:self.page_size]
+		has_more = len(results) > len(self.page)
+
+		if self.cursor is not None and self.cursor.reverse:
+			self.page.reverse()
+			self.has_next = True
+			self.has_previous = has_more
+		else:
+			self.has_next = has_more
+			self.has_previous = self.cursor is not None
+
+		if self.template is not None:
+			self.display_page_controls = True
+
+		return self.page
+
+	def get_keyset_filter(self, cursor):
+		"""
+		Раскрывает сравнение кортежей в ``a >= x AND (a > x OR (a = x AND b > y) OR ...)``
+		с учетом направления сортировки каждого поля. Первое условие - начало диапазона
+		по составному индексу: без него планировщик не может начать чтение с позиции курсора.
+		"""
+		condition = Q()
+		equal = {}
+		for order, value in zip(self.ordering, cursor.position):
+			field = order.lstrip('-')
+			lookup = 'lt' if order.startswith('-') != cursor.reverse else 'gt'
+			condition |= Q(**equal, **{f'{field}__{lookup}': value})
+			equal[field] = value
+		order, value = self.ordering[0], cursor.position[0]
+		lookup = 'lte' if order.startswith('-') != cursor.reverse else 'gte'
+		return Q(**{f'{order.lstrip("-")}__{lookup}': value}) & condition
+
+	def get_next_link(self):
+		if not self.has_next or not self.page:
+			return None
+		position = self._get_position_from_instance(self.page[-1], self.ordering)
+		return self.encode_cursor(Cursor(reverse=False, position=position))
+
+	def get_previous_link(self):
+		if not self.has_previous or not self.page:
+			return None
+		position = self._get_position_from_instance(self.page[0], self.ordering)
+		return self.encode_cursor(Cursor(reverse=True, position=position))
+
+	def decode_cursor(self, request):
+		encoded = request.query_params.get(self.cursor_query_param)
+		if encoded is None:
+			return None
+
+		try:
+			querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+			tokens = parse.parse_qs(querystring, keep_blank_values=True)
+			reverse = bool(int(tokens.get('r', ['0'])[0]))
+			position = tokens['p']
+		except (TypeError, ValueError, KeyError, UnicodeError):
+			raise NotFound(self.invalid_cursor_message)
+
+		if len(position) != len(self.ordering):
+			raise NotFound(self.invalid_cursor_message)
+
+		return Cursor(reverse=reverse, position=position)
+
+	def encode_cursor(self, cursor):
+		tokens = {'p': cursor.position}
+		if cursor.reverse:
+			tokens['r'] = '1'
+
+		querystring = parse.urlencode(tokens, doseq=True)
+		encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+		return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+	def _get_position_from_instance(self, instance, ordering):
+		position = []
+		for order in ordering:
+			field_name = order.lstrip('-')
+			if isinstance(instance, dict):
+				attr = instance[field_name]
+			else:
+				attr = getattr(instance, field_name)
+			position.append(attr.isoformat() if hasattr(attr, 'isoformat') else str(attr))
+		return position
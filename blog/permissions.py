@@ -12,7 +12,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 	def has_object_permission(self, request, view, obj):
 		if request.method in permissions.SAFE_METHODS:
 			return True
-		return obj.user == request.user
+		return obj.user_id == request.user.id
 
 
 class IsCommentOrPostOwnerOrReadOnly(permissions.BasePermission):
@@ -24,4 +24,4 @@ class IsCommentOrPostOwnerOrReadOnly(permissions.BasePermission):
 		)
 
 	def has_object_permission(self, request, view, obj):
-		return obj.user == request.user or obj.post.user == request.user
+		return obj.user_id == request.user.id or obj.post.user_id == request.user.id
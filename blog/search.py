@@ -0,0 +1,118 @@
+from functools import reduce
+from operator import or_
+
+import coreapi
+import coreschema
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+# Словари без стемминга: тексты смешанные (русский и английский), а индекс Postgres
+# строится по тому же выражению, что и запрос, поэтому смена конфигурации требует миграции.
+SEARCH_CONFIG = 'simple'
+
+# Индексируемые поля по таблице. Индексы создают миграции (0006) со своей замороженной копией
+# полей и конфигурации: их смена здесь требует новой миграции.
+SEARCH_FIELDS = {
+	'blog_post': ('title', 'body'),
+	'blog_comment': ('body',),
+}
+
+
+def _search_fields(model):
+	return SEARCH_FIELDS[model._meta.db_table]
+
+
+def _fts_table(model):
+	return f'{model._meta.db_table}_fts'
+
+
+def _search_vector(model):
+	from django.contrib.postgres.search import SearchVector
+
+	return SearchVector(*_search_fields(model), config=SEARCH_CONFIG)
+
+
+def _fts5_query(query):
+	# Каждое слово - отдельная фраза в кавычках: ввод пользователя не разбирается как синтаксис FTS5.
+	return ' '.join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+def search(queryset, query):
+	"""
+	Оставляет в queryset записи, подходящие под поисковую строку, и добавляет релевантность
+	``search_rank`` (чем больше, тем выше).
+	"""
+	model = queryset.model
+	vendor = connections[queryset.db].vendor
+
+	if vendor == 'postgresql':
+		from django.contrib.postgres.search import SearchQuery, SearchRank
+
+		search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+		return (
+			queryset
+			.alias(search_document=_search_vector(model))
+			.filter(search_document=search_query)
+			.annotate(search_rank=SearchRank(_search_vector(model), search_query))
+		)
+
+	if vendor == 'sqlite':
+		table = model._meta.db_table
+		fts = _fts_table(model)
+		match = _fts5_query(query)
+		# bm25 считает статистику по всем совпадениям, поэтому коррелированный MATCH на каждую
+		# строку квадратичен. Подзапрос с LIMIT -1 не раскрывается планировщиком: SQLite
+		# материализует его один раз на запрос и ищет релевантность строки по автоиндексу.
+		return (
+			queryset
+			.filter(id__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (match,)))
+			.annotate(search_rank=RawSQL(
+				f'SELECT search_rank FROM ('
+				f'SELECT rowid AS search_id, -rank AS search_rank FROM {fts} WHERE {fts} MATCH %s LIMIT -1'
+				f') WHERE search_id = {table}.id',
+				(match,),
+				output_field=FloatField(),
+			))
+		)
+
+	condition = reduce(or_, (Q(**{f'{field}__icontains': query}) for field in _search_fields(model)))
+	return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+	"""
+	``?search=`` по полнотекстовому индексу модели с ранжированием по релевантности.
+	"""
+	search_param = 'search'
+
+	def get_search_term(self, request):
+		return request.query_params.get(self.search_param, '').strip()
+
+	def filter_queryset(self, request, queryset, view):
+		term = self.get_search_term(request)
+		if not term:
+			return queryset
+		return search(queryset, term)
+
+	def get_schema_fields(self, view):
+		return [
+			coreapi.Field(
+				name=self.search_param,
+				required=False,
+				location='query',
+				schema=coreschema.String(title='Search', description='Полнотекстовый поиск, результаты по релевантности.'),
+			)
+		]
+
+
+class SearchOrderingFilter(OrderingFilter):
+	"""
+	OrderingFilter, который при поиске без ``?ordering=`` сортирует по релевантности.
+	"""
+
+	def get_default_ordering(self, view):
+		if FullTextSearchFilter().get_search_term(view.request):
+			return ('-search_rank',)
+		return super().get_default_ordering(view)
@@ -1,17 +1,240 @@
-from rest_framework import serializers
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
+from test_comments.timing import TimedDataMixin
+from .bulk import append_comments
 from .models import Post, Comment
 
 
-class PostSerializer(serializers.ModelSerializer):
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+	pass
+
+
+class ExpandableMixin:
+	"""
+	Дополняет ответ полями из ``context['expand']``. Автор берется из аннотации ``user_username``,
+	а счетчики хранятся в самих моделях, поэтому запросов на каждый объект нет.
+	"""
+	expandable_counts = ()
+
+	def to_representation(self, instance):
+		data = super().to_representation(instance)
+		expand = self.context.get('expand', ())
+		if 'user' in expand:
+			data['user'] = {'id': instance.user_id, 'username': instance.user_username}
+		for name in self.expandable_counts:
+			if name in expand:
+				data[name] = getattr(instance, name)
+		return data
+
+
+class PostSerializer(TimedDataMixin, ExpandableMixin, serializers.ModelSerializer):
+	expandable_counts = ('comment_count',)
+
 	class Meta:
 		model = Post
-		fields = ('id', 'user', 'title', 'body', 'created_at',)
+		fields = ('id', 'user', 'title', 'body', 'created_at', 'updated_at',)
 		read_only_fields = ('id', 'user',)
+		list_serializer_class = TimedListSerializer
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedDataMixin, ExpandableMixin, serializers.ModelSerializer):
+	expandable_counts = ('reply_count', 'descendant_count',)
+
 	class Meta:
 		model = Comment
-		fields = ('id', 'user', 'body', 'created_at', 'post', 'parent', 'lft', 'rght', 'tree_id', 'level',)
+		fields = ('id', 'user', 'body', 'created_at', 'updated_at', 'post', 'parent', 'lft', 'rght', 'tree_id', 'level',)
 		read_only_fields = ('user', 'post', 'parent', 'lft', 'rght', 'tree_id', 'level',)
+		list_serializer_class = TimedListSerializer
+
+
+class RowSerializer:
+	"""
+	Сериализатор только для чтения поверх кортежей ``values_list`` вместо моделей: строки
+	превращаются в словари одним циклом без полей DRF, а результат совпадает с ``model_serializer``
+	побайтно, включая ``?expand=``. Queryset строк готовит ``get_row_queryset``; запись по-прежнему
+	проверяет ``model_serializer``.
+	"""
+	model_serializer = None
+	# Колонки values_list в порядке Meta.fields ``model_serializer``.
+	columns = ()
+	datetime_fields = ('created_at', 'updated_at',)
+
+	def __init__(self, instance=None, many=False, context=None, **kwargs):
+		self.instance = instance
+		self.many = many
+		self.context = context or {}
+
+	@classmethod
+	def get_columns(cls, expand=()):
+		columns = cls.columns
+		if 'user' in expand:
+			columns += ('user_username',)
+		return columns + tuple(name for name in cls.model_serializer.expandable_counts if name in expand)
+
+	@classmethod
+	def get_row_queryset(cls, queryset, expand=(), extra=()):
+		"""
+		Строки с колонками сериализатора и полями ``extra`` (например, сортировки для позиции
+		курсора) - именованные кортежи, поэтому пагинация читает поля по имени, как у моделей.
+		"""
+		columns = cls.get_columns(expand)
+		columns += tuple(name for name in dict.fromkeys(extra) if name not in columns)
+		return queryset.values_list(*columns, named=True)
+
+	@property
+	def data(self):
+		rows = self.instance if self.many else [self.instance]
+		data = self.to_representation(rows)
+		return data if self.many else data[0]
+
+	def to_representation(self, rows):
+		keys = self.model_serializer.Meta.fields
+		expand = self.context.get('expand', ())
+		columns = self.get_columns(expand)
+		datetime_fields = [name for name in self.datetime_fields if name in keys]
+		counts = [(name, columns.index(name)) for name in self.model_serializer.expandable_counts if name in expand]
+		username = columns.index('user_username') if 'user' in expand else None
+		format_datetime = get_datetime_formatter()
+
+		data = []
+		for row in rows:
+			item = dict(zip(keys, row))
+			for name in datetime_fields:
+				item[name] = format_datetime(item[name])
+			if username is not None:
+				item['user'] = {'id': item['user'], 'username': row[username]}
+			for name, index in counts:
+				item[name] = row[index]
+			data.append(item)
+		return data
+
+
+def get_datetime_formatter():
+	"""
+	То же, что ``DateTimeField().to_representation``, но часовой пояс определяется один раз на ответ.
+	"""
+	field = serializers.DateTimeField()
+	field_timezone = field.default_timezone()
+	if field_timezone is None or str(getattr(field, 'format', api_settings.DATETIME_FORMAT)).lower() != ISO_8601:
+		return field.to_representation
+
+	def to_representation(value):
+		if not value:
+			return None
+		if timezone.is_naive(value):
+			return field.to_representation(value)
+		value = value.astimezone(field_timezone).isoformat()
+		return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+	return to_representation
+
+
+class PostRowSerializer(TimedDataMixin, RowSerializer):
+	model_serializer = PostSerializer
+	columns = ('id', 'user_id', 'title', 'body', 'created_at', 'updated_at',)
+
+
+class CommentRowSerializer(TimedDataMixin, RowSerializer):
+	model_serializer = CommentSerializer
+	columns = ('id', 'user_id', 'body', 'created_at', 'updated_at', 'post_id', 'parent_id', 'lft', 'rght', 'tree_id', 'level',)
+
+
+class BatchPostSerializer(PostSerializer):
+	ref = serializers.CharField(required=False, max_length=64, help_text='Ссылка на пост для post_ref комментариев пакета')
+
+	class Meta(PostSerializer.Meta):
+		fields = ('ref', 'title', 'body',)
+
+
+BATCH_COMMENT_TARGETS = ('post', 'post_ref', 'parent', 'parent_ref')
+
+
+class BatchCommentSerializer(CommentSerializer):
+	ref = serializers.CharField(required=False, max_length=64, help_text='Ссылка на комментарий для parent_ref')
+	post = serializers.IntegerField(required=False, min_value=1, help_text='Существующий пост')
+	post_ref = serializers.CharField(required=False, help_text='ref поста из этого же пакета')
+	parent = serializers.IntegerField(required=False, min_value=1, help_text='Существующий комментарий')
+	parent_ref = serializers.CharField(required=False, help_text='ref более раннего комментария пакета')
+
+	class Meta(CommentSerializer.Meta):
+		fields = ('ref', 'body',) + BATCH_COMMENT_TARGETS
+		read_only_fields = ()
+
+	def validate(self, attrs):
+		if sum(name in attrs for name in BATCH_COMMENT_TARGETS) != 1:
+			raise serializers.ValidationError('Укажите ровно одно из полей post, post_ref, parent, parent_ref.')
+		return attrs
+
+
+class BatchSerializer(serializers.Serializer):
+	"""
+	Пакет новых постов и комментариев. Ссылки ``post_ref`` и ``parent_ref`` проверяются по ``ref``
+	элементов пакета, а существование постов и родителей - одним запросом на модель.
+	Ошибки возвращаются списком в порядке элементов, пустой словарь - элемент без ошибок.
+	"""
+	posts = BatchPostSerializer(many=True, required=False, max_length=settings.BATCH_MAX_ITEMS)
+	comments = BatchCommentSerializer(many=True, required=False, max_length=settings.BATCH_MAX_ITEMS)
+
+	def validate(self, attrs):
+		posts = attrs.setdefault('posts', [])
+		comments = attrs.setdefault('comments', [])
+		errors = {'posts': [{} for _ in posts], 'comments': [{} for _ in comments]}
+
+		post_refs = set()
+		for item, item_errors in zip(posts, errors['posts']):
+			if 'ref' in item:
+				if item['ref'] in post_refs:
+					item_errors['ref'] = ['Повторяющийся ref.']
+				post_refs.add(item['ref'])
+
+		post_ids = {item['post'] for item in comments if 'post' in item}
+		post_ids = set(Post.objects.filter(id__in=post_ids).order_by().values_list('id', flat=True)) if post_ids else set()
+		parent_ids = {item['parent'] for item in comments if 'parent' in item}
+		parent_ids = set(Comment.objects.filter(id__in=parent_ids).order_by().values_list('id', flat=True)) if parent_ids else set()
+
+		comment_refs = set()
+		for item, item_errors in zip(comments, errors['comments']):
+			if 'post' in item and item['post'] not in post_ids:
+				item_errors['post'] = ['Пост не найден.']
+			if 'post_ref' in item and item['post_ref'] not in post_refs:
+				item_errors['post_ref'] = ['Нет поста с таким ref в пакете.']
+			if 'parent' in item and item['parent'] not in parent_ids:
+				item_errors['parent'] = ['Комментарий не найден.']
+			if 'parent_ref' in item and item['parent_ref'] not in comment_refs:
+				item_errors['parent_ref'] = ['Нет более раннего комментария с таким ref в пакете.']
+			if 'ref' in item:
+				if item['ref'] in comment_refs:
+					item_errors['ref'] = ['Повторяющийся ref.']
+				comment_refs.add(item['ref'])
+
+		if any(errors['posts']) or any(errors['comments']):
+			raise serializers.ValidationError(errors)
+		return attrs
+
+	def create(self, validated_data):
+		user = validated_data['user']
+		with transaction.atomic():
+			posts = Post.objects.bulk_create(
+				Post(user=user, title=item['title'], body=item['body']) for item in validated_data['posts']
+			)
+			post_ids = {item['ref']: post.id for item, post in zip(validated_data['posts'], posts) if 'ref' in item}
+
+			comment_indexes = {}
+			records = []
+			for index, item in enumerate(validated_data['comments']):
+				records.append({
+					'id': index,
+					'parent': comment_indexes[item['parent_ref']] if 'parent_ref' in item else None,
+					'parent_id': item.get('parent'),
+					'post': post_ids[item['post_ref']] if 'post_ref' in item else item.get('post'),
+					'user': user.id,
+					'body': item['body'],
+				})
+				if 'ref' in item:
+					comment_indexes[item['ref']] = index
+			comments = append_comments(records) if records else []
+		return {'posts': posts, 'comments': comments}
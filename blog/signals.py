@@ -0,0 +1,44 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .cache import bump_post_version
+from .events import publish
+from .models import Post, Comment, CommentEvent, Job, Tombstone
+
+
+def _deletes_post(origin):
+	# Комментарии удаляемого поста пересчитывать незачем: пост и все его деревья удаляются вместе с ними.
+	if isinstance(origin, QuerySet):
+		return origin.model is Post
+	return isinstance(origin, Post)
+
+
+@receiver(post_delete, sender=Post, dispatch_uid='blog_post_deleted')
+def post_deleted(sender, instance, **kwargs):
+	"""
+	Надгробие поста для синхронизации при любом удалении, в том числе каскадном от пользователя.
+	Комментарии удаляются вместе с постом, их удаление покрывает надгробие поста.
+	"""
+	Tombstone.objects.create(kind=Tombstone.POST, object_id=instance.pk, post_id=instance.pk)
+	bump_post_version(instance.pk)
+
+
+@receiver(post_delete, sender=Comment, dispatch_uid='blog_comment_deleted')
+def comment_deleted(sender, instance, origin=None, **kwargs):
+	"""
+	Счетчики, надгробие, событие ``comment.deleted`` и перенумерация дерева при любом удалении
+	комментария: ``Comment.delete``, ``QuerySet.delete()`` и каскад от пользователя. Сигнал
+	приходит после DELETE всех собранных строк и после SET_NULL у их детей, поэтому цепочка
+	предков по ``parent_id`` уже не проходит через удаленные комментарии, и вложенные удаленные
+	комментарии не вычитаются дважды. Все записи делаются в транзакции удаления.
+	"""
+	if _deletes_post(origin):
+		return
+	# Потомки остаются (SET_NULL), поэтому от предков отсоединяется все поддерево,
+	# а из счетчика поста вычитается только сам комментарий.
+	Comment._tree_manager.update_counters(instance.post_id, instance.parent_id, -1, -1 - instance.descendant_count)
+	Tombstone.objects.create(kind=Tombstone.COMMENT, object_id=instance.pk, post_id=instance.post_id)
+	publish(CommentEvent.DELETED, instance.post_id, instance.pk, {'id': instance.pk, 'parent': instance.parent_id})
+	Job.objects.enqueue('comments.rebuild_tree', tree_id=instance.tree_id)
+	bump_post_version(instance.post_id)
@@ -0,0 +1,153 @@
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from urllib import parse
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions, status
+
+from .models import Post, Comment, Tombstone
+from .serializers import CommentRowSerializer, PostRowSerializer
+
+Position = namedtuple('Position', ['time', 'id'])
+
+# Источник изменений: модель, поле времени изменения, поле поста для ``?post=`` и сериализатор
+# строк. Каждый источник читается по своему индексу (время, id) или (пост, время, id).
+SYNC_SOURCES = {
+	'posts': (Post, 'updated_at', 'pk', PostRowSerializer),
+	'comments': (Comment, 'updated_at', 'post_id', CommentRowSerializer),
+	'deleted': (Tombstone, 'deleted_at', 'post_id', None),
+}
+
+
+class SyncTokenExpired(exceptions.APIException):
+	status_code = status.HTTP_410_GONE
+	default_detail = 'Токен синхронизации устарел: удаления за этот период уже не хранятся, загрузите данные заново.'
+	default_code = 'sync_token_expired'
+
+
+def encode_token(positions, post_id=None):
+	"""
+	Токен - позиции всех источников и фильтр по посту в base64, как курсор KeysetPagination.
+	"""
+	tokens = {
+		name: [position.time.isoformat(), str(position.id)]
+		for name, position in positions.items()
+		if position is not None
+	}
+	if post_id is not None:
+		tokens['post'] = str(post_id)
+	querystring = parse.urlencode(tokens, doseq=True)
+	return b64encode(querystring.encode('ascii')).decode('ascii')
+
+
+def decode_token(value):
+	"""
+	Позиции источников и фильтр по посту из токена. Источник без позиции читается с начала,
+	кроме удалений: их позиция есть в любом выданном токене.
+	"""
+	try:
+		querystring = b64decode(value.encode('ascii'), validate=True).decode('ascii')
+		tokens = parse.parse_qs(querystring, strict_parsing=True)
+		positions = {}
+		for name in SYNC_SOURCES:
+			if name in tokens:
+				time, pk = tokens[name]
+				time = parse_datetime(time)
+				if time is None or timezone.is_naive(time):
+					raise ValueError(f'Invalid position: {tokens[name]!r}')
+				positions[name] = Position(time, int(pk))
+			elif name == 'deleted':
+				raise ValueError('Missing deleted position')
+			else:
+				positions[name] = None
+		post_id = int(tokens['post'][0]) if 'post' in tokens else None
+	except (TypeError, ValueError, UnicodeError):
+		raise ValueError(f'Invalid sync token: {value!r}')
+	return positions, post_id
+
+
+def initial_positions(now=None):
+	"""
+	Позиции первой синхронизации: посты и комментарии читаются целиком, а удаления - только
+	начиная с окна SYNC_WINDOW: удаленного раньше у клиента еще нет.
+	"""
+	positions = dict.fromkeys(SYNC_SOURCES)
+	positions['deleted'] = get_horizon(now)
+	return positions
+
+
+def get_horizon(now=None):
+	"""
+	Позиция, до которой изменения считаются записанными. Время строки ставится до коммита ее
+	транзакции, поэтому изменение может стать видимым позже более новых; чтение после
+	``now - SYNC_WINDOW`` повторяется при следующей синхронизации, чтобы его не пропустить.
+	"""
+	now = now or timezone.now()
+	return Position(now - timezone.timedelta(seconds=settings.SYNC_WINDOW), 0)
+
+
+def get_changes_queryset(name, position, post_id, limit):
+	"""
+	Изменения источника после ``position`` в порядке индекса (время, id), ``limit + 1`` строк.
+	"""
+	model, time_field, post_field, row_serializer = SYNC_SOURCES[name]
+	queryset = model.objects.order_by(time_field, 'id')
+	if row_serializer is not None:
+		queryset = row_serializer.get_row_queryset(queryset)
+	else:
+		queryset = queryset.only('id', 'kind', 'object_id', time_field)
+	if post_id is not None:
+		queryset = queryset.filter(**{post_field: post_id})
+	if position is not None:
+		# Условие ``>=`` задает начало диапазона по индексу (время, id), как в KeysetPagination.
+		queryset = queryset.filter(
+			Q(**{f'{time_field}__gte': position.time}),
+			Q(**{f'{time_field}__gt': position.time}) | Q(**{time_field: position.time, 'id__gt': position.id}),
+		)
+	return queryset[:limit + 1]
+
+
+def get_next_position(name, position, rows, more, horizon):
+	"""
+	Следующая страница начинается после последней строки. После последней страницы позиция
+	не заходит дальше горизонта: последние SYNC_WINDOW секунд следующая синхронизация
+	перечитает, клиент применяет изменения по id идемпотентно.
+	"""
+	time_field = SYNC_SOURCES[name][1]
+	if rows:
+		position = Position(getattr(rows[-1], time_field), rows[-1].id)
+	if more:
+		return position
+	return horizon if position is None else min(position, horizon)
+
+
+def get_changes(positions, post_id=None, limit=500, now=None):
+	"""
+	Читает до ``limit`` изменений каждого источника - по запросу на источник - и возвращает
+	строки, позиции следующей синхронизации и признак того, что изменения еще остались.
+	"""
+	now = now or timezone.now()
+	horizon = get_horizon(now)
+	retention = now - timezone.timedelta(seconds=settings.SYNC_TOMBSTONE_RETENTION)
+	if positions['deleted'].time < retention:
+		raise SyncTokenExpired()
+
+	changes = {}
+	next_positions = {}
+	has_more = False
+	for name, position in positions.items():
+		rows = list(get_changes_queryset(name, position, post_id, limit))
+		more = len(rows) > limit
+		del rows[limit:]
+		changes[name] = rows
+		next_positions[name] = get_next_position(name, position, rows, more, horizon)
+		has_more |= more
+	return changes, next_positions, has_more
+
+
+def prune_tombstones():
+	deadline = timezone.now() - timezone.timedelta(seconds=settings.SYNC_TOMBSTONE_RETENTION)
+	return Tombstone.objects.filter(deleted_at__lt=deadline).delete()[0]
@@ -1,21 +1,56 @@
+import asyncio
+import json
 import random
-
+import tempfile
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F, Max, Q
 from django.urls import reverse
+from django.utils import timezone
 from model_bakery import baker
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
-from django.test import override_settings
-
-from .models import Post, Comment
+from django.test import AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, events, jobs
+from .bulk import CommentImportError, import_comments, renumber_tree
+from .cache import get_response_cache
+from .hierarchy import path_step
+from .models import TREE_ID_LOCK, Post, Comment, CommentEvent, Job, Tombstone
+from .serializers import CommentRowSerializer, CommentSerializer, PostRowSerializer, PostSerializer
+from .sync import prune_tombstones
+from .throttling import CommentUserRateThrottle, get_throttle_cache, record_tree_lock_wait, tree_writer
+from .views import CommentViewSet, PostViewSet
 
 client = APIClient()
 User = get_user_model()
 
 
+class QueryCountMixin:
+	def assertRequestQueries(self, num, method, url, data=None):
+		"""
+		Выполняет запрос и проверяет точное число SQL-запросов, чтобы N+1 ломал тесты.
+		"""
+		with self.assertNumQueries(num):
+			response = getattr(self.client, method)(url, data=data)
+		return response
+
+
 @override_settings(MPTT_ALLOW_TESTING_GENERATORS=True)
-class PostTest(APITestCase):
+class PostTest(QueryCountMixin, APITestCase):
 	def setUp(self) -> None:
 
 		for _ in range(random.randint(2, 10)):
@@ -41,9 +76,168 @@ class PostTest(APITestCase):
 		response = self.client.get(url)
 
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
-		self.assertEqual(self.posts.count(), len(response.data))
+		self.assertEqual(self.posts.count(), len(response.data['results']))
 		self.assertEqual(url, '/api/v1/posts/')
 
+	def test_post_list_queries(self):
+		for post in self.posts:
+			baker.make(Comment, post=post, _quantity=2)
+
+		self.assertRequestQueries(1, 'get', reverse('post-list'))
+		response = self.assertRequestQueries(1, 'get', reverse('post-list'), {'expand': 'user,comment_count'})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		post = next(post for post in response.data['results'] if post['id'] == self.post_user1.id)
+		self.assertEqual(post['user'], {'id': self.user1.id, 'username': self.user1.username})
+		self.assertEqual(post['comment_count'], 2)
+
+	def test_post_retrieve_queries(self):
+		url = reverse('post-detail', args=(self.post_user1.id,))
+		response = self.assertRequestQueries(1, 'get', url, {'expand': 'comment_count'})
+
+		self.assertEqual(response.data['user'], self.user1.id)
+		self.assertEqual(response.data['comment_count'], 0)
+
+		response = self.client.get(url, {'expand': 'body'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_post_update_delete_queries(self):
+		self.client.force_authenticate(self.user1)
+		url = reverse('post-detail', args=(self.post_user1.id,))
+
+		self.assertRequestQueries(2, 'patch', url, self.data)
+		self.assertRequestQueries(4, 'delete', url)
+
+	def test_post_retrieve_cache(self):
+		url = reverse('post-detail', args=(self.post_user1.id,))
+		response = self.assertRequestQueries(1, 'get', url)
+		etag = response['ETag']
+
+		cached = self.assertRequestQueries(0, 'get', url)
+		self.assertEqual(cached.data, response.data)
+		self.assertEqual(cached['ETag'], etag)
+
+		with self.assertNumQueries(0):
+			response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+		self.client.force_authenticate(self.user1)
+		self.client.patch(url, self.data)
+		self.client.force_authenticate(None)
+
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['title'], self.data['title'])
+		self.assertNotEqual(response['ETag'], etag)
+
+		# Представления с другими байтами получают свои ETag.
+		etag = response['ETag']
+		for accept in ('application/vnd.columns+json', 'application/json; indent=4'):
+			response = self.client.get(url, HTTP_ACCEPT=accept, HTTP_IF_NONE_MATCH=etag)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			self.assertNotEqual(response['ETag'], etag)
+			self.assertEqual(self.client.get(url, HTTP_ACCEPT=accept, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+		baker.make(Comment, post=self.post_user1)
+		response = self.client.get(url, {'expand': 'comment_count'})
+		self.assertEqual(response.data['comment_count'], 1)
+
+	def test_post_list_filters(self):
+		url = reverse('post-list')
+		started = timezone.now()
+		for index, post in enumerate(self.posts.order_by('id')):
+			Post.objects.filter(id=post.id).update(created_at=started + timezone.timedelta(days=index))
+		since = started + timezone.timedelta(days=1)
+
+		response = self.client.get(url, {'user': self.user1.id, 'created_at__gte': since.isoformat()})
+		expected = set(Post.objects.filter(user=self.user1, created_at__gte=since).values_list('id', flat=True))
+		self.assertEqual({post['id'] for post in response.data['results']}, expected)
+
+		response = self.assertRequestQueries(1, 'get', url, {'user__in': f'{self.user1.id},{self.user2.id}'})
+		expected = set(Post.objects.filter(user__in=(self.user1, self.user2)).values_list('id', flat=True))
+		self.assertEqual({post['id'] for post in response.data['results']}, expected)
+
+		self.assertEqual(self.client.get(url, {'user': 0}).data['results'], [])
+		self.assertEqual(self.client.get(url, {'user': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(self.client.get(url, {'created_at__lt': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_post_list_cursor_pagination(self):
+		url = reverse('post-list')
+		expected = list(Post.objects.order_by('title', 'created_at', 'id').values_list('id', flat=True))
+
+		ids = []
+		response = self.client.get(url, {'page_size': 2})
+		while True:
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			self.assertLessEqual(len(response.data['results']), 2)
+			ids += [post['id'] for post in response.data['results']]
+			if response.data['next'] is None:
+				break
+			response = self.client.get(response.data['next'])
+		self.assertEqual(ids, expected)
+
+		ids = [post['id'] for post in response.data['results']]
+		while response.data['previous'] is not None:
+			response = self.client.get(response.data['previous'])
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			ids = [post['id'] for post in response.data['results']] + ids
+		self.assertEqual(ids, expected)
+
+	def test_post_list_cursor_range_start(self):
+		# Страница за курсором начинается условием по первому полю сортировки, а не только OR-цепочкой.
+		url = reverse('post-list')
+		for ordering, condition in (('title', '"blog_post"."title" >='), ('-comment_count', '"blog_post"."comment_count" <=')):
+			response = self.client.get(url, {'ordering': ordering, 'page_size': 2})
+			with CaptureQueriesContext(connection) as context:
+				response = self.client.get(response.data['next'])
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			self.assertIn(condition, context.captured_queries[0]['sql'])
+
+	def test_post_list_ordering_by_comment_count(self):
+		for count, post in enumerate(self.posts):
+			baker.make(Comment, post=post, _quantity=count % 3 + 1)
+
+		response = self.assertRequestQueries(1, 'get', reverse('post-list'), {'ordering': '-comment_count'})
+		expected = list(Post.objects.order_by('-comment_count', 'id').values_list('id', flat=True))
+		self.assertEqual([post['id'] for post in response.data['results']], expected)
+
+	def test_post_search(self):
+		both = baker.make(Post, user=self.user1, title='django mptt', body='django django')
+		title = baker.make(Post, user=self.user1, title='django', body='nested comments with other frameworks')
+		baker.make(Post, user=self.user1, title='flask', body='other')
+		url = reverse('post-list')
+
+		response = self.client.get(url, {'search': 'django'})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([post['id'] for post in response.data['results']], [both.id, title.id])
+
+		ids = []
+		response = self.client.get(url, {'search': 'django', 'page_size': 1})
+		while True:
+			ids += [post['id'] for post in response.data['results']]
+			if response.data['next'] is None:
+				break
+			response = self.client.get(response.data['next'])
+		self.assertEqual(ids, [both.id, title.id])
+
+		response = self.client.get(url, {'search': 'django', 'ordering': '-created_at'})
+		self.assertEqual([post['id'] for post in response.data['results']], [title.id, both.id])
+
+		self.client.force_authenticate(self.user1)
+		self.client.patch(reverse('post-detail', args=(title.id,)), {'title': 'flask'})
+		response = self.client.get(url, {'search': 'django mptt'})
+		self.assertEqual([post['id'] for post in response.data['results']], [both.id])
+
+		for term in ('"', 'django OR', 'NEAR(a b', '*'):
+			response = self.client.get(url, {'search': term})
+			self.assertEqual(response.status_code, status.HTTP_200_OK, term)
+
+	def test_post_list_invalid_cursor(self):
+		url = reverse('post-list')
+		response = self.client.get(url, {'cursor': 'invalid'})
+
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 	def test_post_create(self):
 		self.client.force_authenticate(self.user1)
 
@@ -129,9 +323,12 @@ class PostTest(APITestCase):
 		self.assertEqual(self.posts_count, Post.objects.count())
 
 
-class CommentTest(APITestCase):
+class CommentTest(QueryCountMixin, APITestCase):
 	@override_settings(MPTT_ALLOW_TESTING_GENERATORS=True)
 	def setUp(self) -> None:
+		# Счетчики ограничений частоты переживают откат транзакции теста, а id пользователей повторяются.
+		get_throttle_cache().clear()
+		self.addCleanup(get_throttle_cache().clear)
 
 		for _ in range(random.randint(2, 10)):
 			baker.make(User)
@@ -187,13 +384,113 @@ class CommentTest(APITestCase):
 		url = reverse('comment-list')
 		response = self.client.get(url)
 
-		comments_order_response = [comment['id'] for comment in response.data]
+		comments_order_response = [comment['id'] for comment in response.data['results']]
 		comments_order_queryset = [comment.id for comment in Comment.objects.order_by('tree_id', 'lft')]
 
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
 		self.assertEqual(url, '/api/v1/comments/')
 		self.assertEqual(comments_order_response, comments_order_queryset)
 
+	def test_comments_list_queries(self):
+		self.assertRequestQueries(1, 'get', reverse('comment-list'))
+		response = self.assertRequestQueries(1, 'get', reverse('comment-list'), {'expand': 'user,reply_count'})
+
+		comment = next(comment for comment in response.data['results'] if comment['id'] == self.comment.id)
+		self.assertEqual(comment['user'], {'id': self.comment.user.id, 'username': self.comment.user.username})
+		self.assertEqual(comment['reply_count'], self.comment.children_comment.count())
+
+	def test_comments_endpoint_queries(self):
+		self.client.force_authenticate(self.user1)
+
+		url = reverse('comment-detail', args=(self.comment.id,))
+		response = self.assertRequestQueries(1, 'get', url, {'expand': 'user,reply_count'})
+		self.assertEqual(response.data['reply_count'], self.comment.children_comment.count())
+
+		self.assertRequestQueries(2, 'get', reverse('comment-post-tree', args=(self.post.id,)))
+		self.assertRequestQueries(3, 'patch', reverse('comment-detail', args=(self.comment_user1.id,)), self.data)
+		self.assertRequestQueries(5, 'post', reverse('comment-post-create', args=(self.post.id,)), self.data)
+		self.assertRequestQueries(7, 'post', reverse('comment-child-create', args=(self.comment_user1.id,)), self.data)
+		self.assertRequestQueries(8, 'delete', reverse('comment-detail', args=(self.comment_post_user1.id,)))
+
+	def test_comments_list_cache(self):
+		url = reverse('comment-list')
+		tree_url = reverse('comment-post-tree', args=(self.post.id,))
+		response = self.client.get(url, {'post': self.post.id})
+		tree = self.client.get(tree_url)
+
+		self.assertRequestQueries(0, 'get', url, {'post': self.post.id})
+		self.assertRequestQueries(0, 'get', tree_url)
+		self.assertRequestQueries(1, 'get', url, {'post': self.post.id, 'expand': 'user'})
+		self.assertRequestQueries(1, 'get', url)
+
+		self.client.force_authenticate(self.user1)
+		self.client.post(reverse('comment-post-create', args=(self.post.id,)), self.data)
+
+		self.assertEqual(len(self.client.get(url, {'post': self.post.id}).data['results']), len(response.data['results']) + 1)
+		self.assertEqual(self.client.get(tree_url).data['count'], tree.data['count'] + 1)
+
+	def test_comments_search(self):
+		match = Comment.objects.create(user=self.user1, post=self.post, body='needle in a haystack')
+		Comment.objects.create(user=self.user1, parent=match, body='needle needle')
+		other = baker.make(Post, user=self.user1)
+		Comment.objects.create(user=self.user1, post=other, body='needle elsewhere')
+		url = reverse('comment-list')
+
+		response = self.client.get(url, {'search': 'needle', 'post': self.post.id})
+		self.assertEqual(len(response.data['results']), 2)
+		self.assertEqual(response.data['results'][0]['body'], 'needle needle')
+
+		self.assertEqual(len(self.client.get(url, {'search': 'needle'}).data['results']), 3)
+		self.assertEqual(len(self.client.get(url, {'search': 'haystack needle'}).data['results']), 1)
+
+		match.delete()
+		self.assertEqual(len(self.client.get(url, {'search': 'haystack'}).data['results']), 0)
+
+	def test_comments_list_filters(self):
+		url = reverse('comment-list')
+		started = timezone.now()
+		for index, comment in enumerate(self.comments.order_by('id')):
+			Comment.objects.filter(id=comment.id).update(created_at=started + timezone.timedelta(hours=index))
+		since = started + timezone.timedelta(hours=2)
+		until = started + timezone.timedelta(hours=6)
+		posts = (self.post.id, self.post_user1.id)
+
+		response = self.assertRequestQueries(1, 'get', url, {
+			'post__in': ','.join(map(str, posts)),
+			'created_at__gte': since.isoformat(),
+			'created_at__lt': until.isoformat(),
+		})
+		expected = Comment.objects.filter(post__in=posts, created_at__gte=since, created_at__lt=until)
+		self.assertEqual(
+			[comment['id'] for comment in response.data['results']],
+			list(expected.order_by('tree_id', 'lft').values_list('id', flat=True)),
+		)
+
+		response = self.client.get(url, {'user': self.user2.id, 'ordering': '-created_at'})
+		expected = Comment.objects.filter(user=self.user2).order_by('-created_at', '-id')
+		self.assertEqual([comment['id'] for comment in response.data['results']], list(expected.values_list('id', flat=True)))
+
+		response = self.client.get(url, {'user__in': f'{self.user1.id},{self.user2.id}', 'parent': self.comment.id})
+		expected = Comment.objects.filter(user__in=(self.user1, self.user2), parent=self.comment)
+		self.assertEqual({comment['id'] for comment in response.data['results']}, set(expected.values_list('id', flat=True)))
+
+		self.assertEqual(self.client.get(url, {'post__in': '1,x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_comments_list_cursor_pagination(self):
+		url = reverse('comment-list')
+		expected = list(Comment.objects.order_by('created_at', 'id').values_list('id', flat=True))
+
+		ids = []
+		response = self.client.get(url, {'ordering': 'created_at', 'page_size': 3})
+		while True:
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			ids += [comment['id'] for comment in response.data['results']]
+			if response.data['next'] is None:
+				break
+			response = self.client.get(response.data['next'])
+
+		self.assertEqual(ids, expected)
+
 	def test_comments_post_create(self):
 		self.client.force_authenticate(self.user1)
 		url = reverse('comment-post-create', args=(self.post.id,))
@@ -301,3 +598,1249 @@ class CommentTest(APITestCase):
 
 		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 		self.assertEqual(self.comments_count, Comment.objects.count())
+
+	def test_comments_post_tree(self):
+		Comment.objects.rebuild()
+		post = self.comment.post
+		url = reverse('comment-post-tree', args=(post.id,))
+		response = self.client.get(url)
+
+		def walk(nodes, level):
+			for node in nodes:
+				yield node, level
+				yield from walk(node['children'], level + 1)
+
+		nodes = list(walk(response.data['results'], 0))
+		comments = Comment.objects.filter(post=post).order_by('tree_id', 'lft')
+
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(url, f'/api/v1/posts/{post.id}/comments/tree/')
+		self.assertEqual(response.data['count'], comments.count())
+		self.assertFalse(response.data['truncated'])
+		self.assertEqual([node['id'] for node, _ in nodes], [comment.id for comment in comments])
+		self.assertEqual([level for _, level in nodes], [comment.level for comment in comments])
+		self.assertNotIn('lft', nodes[0][0])
+
+	def test_comments_post_tree_limits(self):
+		Comment.objects.rebuild()
+		post = self.comment.post
+		url = reverse('comment-post-tree', args=(post.id,))
+
+		response = self.client.get(url, {'max_depth': 0})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['count'], Comment.objects.filter(post=post, level=0).count())
+		self.assertTrue(all(not node['children'] for node in response.data['results']))
+
+		response = self.client.get(url, {'max_nodes': 1})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['count'], 1)
+		self.assertEqual(response.data['truncated'], Comment.objects.filter(post=post).count() > 1)
+
+		response = self.client.get(url, {'max_nodes': 'all'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_comments_post_tree_not_found(self):
+		url = reverse('comment-post-tree', args=(Post.objects.order_by('-id').first().id + 1,))
+		response = self.client.get(url)
+
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_comments_descendants(self):
+		root = Comment.objects.create(user=self.user1, post=self.post, body='root')
+		chain = [root]
+		for depth in range(4):
+			chain.append(Comment.objects.create(user=self.user1, parent=chain[-1], body=f'reply {depth}'))
+		sibling = Comment.objects.create(user=self.user2, parent=chain[1], body='sibling')
+		Comment.objects.create(user=self.user2, post=self.post, body='other thread')
+		url = reverse('comment-descendants', args=(root.id,))
+
+		response = self.assertRequestQueries(1, 'get', url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(url, f'/api/v1/comments/{root.id}/descendants/')
+		self.assertEqual((response.data['count'], response.data['truncated']), (5, False))
+		replies = response.data['results']
+		self.assertEqual([node['id'] for node in replies], [chain[1].id])
+		self.assertEqual([node['id'] for node in replies[0]['children']], [chain[2].id, sibling.id])
+
+		response = self.client.get(url, {'flat': 'true', 'max_depth': 2})
+		self.assertEqual(
+			[(node['id'], node['parent']) for node in response.data['results']],
+			[(chain[1].id, root.id), (chain[2].id, chain[1].id), (sibling.id, chain[1].id)],
+		)
+
+		response = self.client.get(url, {'flat': 'true', 'limit': 2})
+		self.assertEqual([node['id'] for node in response.data['results']], [chain[1].id, chain[2].id])
+		self.assertTrue(response.data['truncated'])
+
+		chain[2].delete()
+		response = self.client.get(url, {'flat': 'true'})
+		self.assertEqual([node['id'] for node in response.data['results']], [chain[1].id, sibling.id])
+
+		# Отсоединенные ответы удаленного комментария до перенумерации лежат в диапазоне корня
+		# и не должны укорачивать страницу или скрывать, что потомки еще есть.
+		response = self.client.get(url, {'flat': 'true', 'limit': 2})
+		self.assertEqual([node['id'] for node in response.data['results']], [chain[1].id, sibling.id])
+		self.assertFalse(response.data['truncated'])
+		response = self.client.get(url, {'flat': 'true', 'limit': 1})
+		self.assertEqual([node['id'] for node in response.data['results']], [chain[1].id])
+		self.assertTrue(response.data['truncated'])
+
+		response = self.client.get(reverse('comment-descendants', args=(Comment.objects.order_by('-id').first().id + 1,)))
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_comments_ancestors(self):
+		chain = [Comment.objects.create(user=self.user1, post=self.post, body='root')]
+		for depth in range(3):
+			chain.append(Comment.objects.create(user=self.user1, parent=chain[-1], body=f'reply {depth}'))
+		url = reverse('comment-ancestors', args=(chain[-1].id,))
+
+		response = self.assertRequestQueries(1, 'get', url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(url, f'/api/v1/comments/{chain[-1].id}/ancestors/')
+		self.assertEqual([node['id'] for node in response.data['results']], [comment.id for comment in chain[:-1]])
+		self.assertEqual(response.data['results'][1]['parent'], chain[0].id)
+
+		chain[1].delete()
+		response = self.client.get(url)
+		self.assertEqual([node['id'] for node in response.data['results']], [chain[2].id])
+		self.assertEqual(self.client.get(reverse('comment-ancestors', args=(chain[2].id,))).data['results'], [])
+		self.assertEqual(self.client.get(reverse('comment-ancestors', args=(chain[1].id,))).status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_comments_export(self):
+		self.client.force_authenticate(baker.make(User, is_staff=True))
+		post = self.comment.post
+
+		url = reverse('comment-export')
+		response = self.client.get(url, {'post': post.id})
+		lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(url, '/api/v1/comments/export/')
+		self.assertTrue(response.streaming)
+		self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+		self.assertEqual(
+			[line['id'] for line in lines],
+			[comment.id for comment in Comment.objects.filter(post=post).order_by('tree_id', 'lft')]
+		)
+		self.assertEqual(set(lines[0]), set(self.client.get(reverse('comment-detail', args=(lines[0]['id'],))).data))
+
+	def test_comments_export_since(self):
+		self.client.force_authenticate(baker.make(User, is_staff=True))
+		since = Comment.objects.order_by('created_at')[1].created_at
+
+		response = self.client.get(reverse('comment-export'), {'since': since.isoformat()})
+		lines = b''.join(response.streaming_content).decode().splitlines()
+
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(lines), Comment.objects.filter(created_at__gte=since).count())
+
+		response = self.client.get(reverse('comment-export'), {'since': 'yesterday'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_comments_export_not_staff(self):
+		self.client.force_authenticate(self.user1)
+		response = self.client.get(reverse('comment-export'))
+
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+	def test_comments_export_command(self):
+		out = StringIO()
+		call_command('export_comments', post=self.comment.post.id, chunk_size=2, stdout=out)
+		lines = [json.loads(line) for line in out.getvalue().splitlines()]
+
+		self.assertEqual(len(lines), Comment.objects.filter(post=self.comment.post).count())
+		self.assertIn(self.comment.id, [line['id'] for line in lines])
+
+	def test_comments_import(self):
+		post = self.post
+		records = [
+			{'id': 'a', 'parent': None, 'post': post.id, 'user': self.user1.id, 'body': 'a', 'created_at': '2020-01-01T00:00:00Z'},
+			{'id': 'b', 'parent': 'a', 'user': self.user2.id, 'body': 'b', 'created_at': '2020-01-01T00:02:00Z'},
+			{'id': 'c', 'parent': 'a', 'user': self.user2.id, 'body': 'c', 'created_at': '2020-01-01T00:01:00Z'},
+			{'id': 'd', 'parent': 'c', 'user': self.user1.id, 'body': 'd', 'created_at': '2020-01-01T00:03:00Z'},
+			{'id': 'e', 'parent': None, 'post': post.id, 'user': self.user1.id, 'body': 'e'},
+		]
+		url = reverse('comment-list')
+		cached = self.client.get(url, {'post': post.id})
+		result = import_comments(records, batch_size=2)
+
+		self.assertEqual((result.comments, result.trees), (5, 2))
+		# Импорт сбрасывает кэш ответов поста.
+		response = self.client.get(url, {'post': post.id}, HTTP_IF_NONE_MATCH=cached['ETag'])
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(response['ETag'], cached['ETag'])
+		self.assertEqual(self.comments_count + 5, Comment.objects.count())
+
+		imported = Comment.objects.filter(body__in='abcde').order_by('tree_id', 'lft')
+		self.assertEqual([comment.body for comment in imported], ['a', 'c', 'd', 'b', 'e'])
+		self.assertTrue(all(comment.post_id == post.id for comment in imported))
+		self.assertEqual(imported.get(body='d').parent, imported.get(body='c'))
+		self.assertEqual(imported.get(body='a').created_at.isoformat(), '2020-01-01T00:00:00+00:00')
+
+		mptt_values = list(imported.values_list('id', 'tree_id', 'lft', 'rght', 'level'))
+		for tree_id in {row[1] for row in mptt_values}:
+			Comment.objects.partial_rebuild(tree_id)
+		self.assertEqual(mptt_values, list(imported.values_list('id', 'tree_id', 'lft', 'rght', 'level')))
+		self.assertCountersValid()
+
+	def test_comments_tree_id_lock(self):
+		# В PostgreSQL максимум tree_id читается под advisory-блокировкой; в SQLite ее заменяет пустая функция.
+		connection.ensure_connection()
+		connection.connection.create_function('pg_advisory_xact_lock', 1, lambda key: None)
+		with mock.patch.object(connection, 'vendor', 'postgresql'), CaptureQueriesContext(connection) as queries:
+			tree_id = Comment.objects._get_next_tree_id()
+		self.assertEqual(tree_id, Comment.objects.aggregate(Max('tree_id'))['tree_id__max'] + 1)
+		self.assertIn('pg_advisory_xact_lock', queries[0]['sql'])
+		self.assertIn('MAX("blog_comment"."tree_id")', queries[1]['sql'])
+
+		# Новые деревья из API и импорта получают номер только через этот метод.
+		self.client.force_authenticate(self.user1)
+		records = [{'id': 1, 'parent': None, 'post': self.post.id, 'user': self.user1.id, 'body': 'a'}]
+		get_next_tree_id = Comment._tree_manager._get_next_tree_id
+		with mock.patch.object(Comment._tree_manager, '_get_next_tree_id', wraps=get_next_tree_id) as allocate:
+			response = self.client.post(reverse('comment-post-create', args=(self.post.id,)), self.data)
+			import_comments(records)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(allocate.call_count, 2)
+		self.assertEqual(Comment.objects.filter(tree_id__gte=tree_id).values('tree_id').distinct().count(), 2)
+
+	def test_comments_tree_lock(self):
+		root = Comment.objects.create(user=self.user1, post=self.post, body='root')
+		reply = Comment.objects.create(user=self.user1, parent=root, body='reply')
+		tree_id = root.tree_id
+		# До перенумерации у дерева без удаленного корня нет строки с lft = 1: блокируется номер дерева.
+		root.delete()
+		locks = []
+		connection.ensure_connection()
+		connection.connection.create_function('pg_advisory_xact_lock', 2, lambda space, key: locks.append((space, key)))
+		with mock.patch.object(connection, 'vendor', 'postgresql'):
+			node = Comment(user=self.user1, parent_id=reply.id, body='node')
+			Comment.objects.append_node(node)
+		self.assertEqual(locks, [(TREE_ID_LOCK, tree_id)])
+		self.assertEqual((node.tree_id, node.lft, node.level), (tree_id, reply.rght, 2))
+
+		# Перенумерация ждет ту же блокировку, хотя корня дерева уже нет.
+		locks.clear()
+		with mock.patch.object(connection, 'vendor', 'postgresql'):
+			renumber_tree(tree_id)
+		self.assertEqual(locks, [(TREE_ID_LOCK, tree_id)])
+
+		# Перенумерация перенесла комментарий в новое дерево, пока блокировка ожидалась.
+		lock_trees = mock.Mock(side_effect=lambda trees: trees == {tree_id} and Comment.objects.filter(id=reply.id).update(tree_id=tree_id + 100))
+		with mock.patch.object(connection, 'vendor', 'postgresql'), mock.patch.object(Comment.objects, 'lock_trees', lock_trees):
+			rows = Comment.objects.lock_comment_trees([reply.id], ('id', 'tree_id'))
+		self.assertEqual(rows, [(reply.id, tree_id + 100)])
+		self.assertEqual([call.args[0] for call in lock_trees.call_args_list], [{tree_id}, {tree_id + 100}])
+
+	def test_comments_import_invalid(self):
+		records = [
+			{'id': 1, 'parent': 2, 'post': self.post.id, 'user': self.user1.id, 'body': 'a'},
+			{'id': 2, 'parent': 1, 'post': self.post.id, 'user': self.user1.id, 'body': 'b'},
+		]
+		with self.assertRaises(CommentImportError):
+			import_comments(records)
+		with self.assertRaises(CommentImportError):
+			import_comments([{'id': 1, 'parent': 3, 'user': self.user1.id, 'body': 'a'}])
+		# Ответ на существующий комментарий стал бы корнем нового дерева со ссылкой в чужое.
+		with self.assertRaises(CommentImportError):
+			import_comments([{'id': 1, 'parent_id': self.comment.id, 'post': self.post.id, 'user': self.user1.id, 'body': 'a'}])
+		self.assertEqual(self.comments_count, Comment.objects.count())
+
+	def test_comments_import_command(self):
+		export = StringIO()
+		call_command('export_comments', post=self.post.id, stdout=export)
+		count = Comment.objects.filter(post=self.post).count()
+
+		with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as input_file:
+			input_file.write(export.getvalue())
+			input_file.flush()
+			out = StringIO()
+			call_command('import_comments', input_file.name, stdout=out)
+
+		self.assertIn(f'Imported {count} comments', out.getvalue())
+		self.assertEqual(2 * count, Comment.objects.filter(post=self.post).count())
+
+	def assertCountersValid(self):
+		for post in Post.objects.all():
+			self.assertEqual(post.comment_count, post.comment.count())
+		for comment in Comment.objects.all():
+			self.assertEqual(comment.reply_count, comment.children_comment.count())
+			descendants, parents = 0, [comment.id]
+			while parents:
+				parents = list(Comment.objects.filter(parent__in=parents).values_list('id', flat=True))
+				descendants += len(parents)
+			self.assertEqual(comment.descendant_count, descendants)
+
+	def test_comments_counters(self):
+		self.client.force_authenticate(self.user1)
+		post = baker.make(Post, user=self.user1)
+		root = self.client.post(reverse('comment-post-create', args=(post.id,)), self.data).data
+		child = self.client.post(reverse('comment-child-create', args=(root['id'],)), self.data).data
+		self.client.post(reverse('comment-child-create', args=(child['id'],)), self.data)
+		self.client.post(reverse('comment-child-create', args=(root['id'],)), self.data)
+
+		post.refresh_from_db()
+		self.assertEqual(post.comment_count, 4)
+		response = self.client.get(reverse('comment-detail', args=(root['id'],)), {'expand': 'reply_count,descendant_count'})
+		self.assertEqual((response.data['reply_count'], response.data['descendant_count']), (2, 3))
+		self.assertCountersValid()
+
+		# Ответ на удаленный комментарий становится корнем и уносит свое поддерево.
+		self.client.delete(reverse('comment-detail', args=(child['id'],)))
+		self.assertEqual(Post.objects.get(id=post.id).comment_count, 3)
+		self.assertEqual(Comment.objects.get(id=root['id']).descendant_count, 1)
+		self.assertCountersValid()
+
+	def test_comments_counters_cascade(self):
+		post = baker.make(Post, user=self.user2)
+		root = Comment.objects.create(user=self.user2, post=post, body='root')
+		child = Comment.objects.create(user=self.user1, parent=root, body='child')
+		reply = Comment.objects.create(user=self.user1, parent=child, body='reply')
+		Comment.objects.create(user=self.user2, parent=reply, body='reply to reply')
+		Comment.objects.create(user=self.user2, parent=child, body='other reply')
+		own_post = baker.make(Post, user=self.user1)
+		Comment.objects.create(user=self.user2, post=own_post, body='on own post')
+
+		# Каскад от пользователя не вызывает Comment.delete, счетчики правит сигнал.
+		self.user1.delete()
+		self.assertEqual(Post.objects.get(id=post.id).comment_count, 3)
+		self.assertEqual(Comment.objects.get(id=root.id).descendant_count, 0)
+		self.assertCountersValid()
+
+		Comment.objects.filter(id__in=Comment.objects.filter(post=self.post).values('id')[:2]).delete()
+		self.assertCountersValid()
+
+	def test_comments_counters_migration(self):
+		migration = import_module('blog.migrations.0005_comment_counters')
+		Post.objects.update(comment_count=0)
+		Comment.objects.update(reply_count=0, descendant_count=0)
+
+		migration.fill_counters(django_apps, mock.Mock(connection=connection))
+		self.assertCountersValid()
+
+	def test_comments_repair_counters(self):
+		Post.objects.update(comment_count=1000)
+		Comment.objects.update(reply_count=0, descendant_count=3)
+
+		out = StringIO()
+		call_command('repair_comment_counters', stdout=out)
+		self.assertIn(f'Repaired {Post.objects.count()} posts and {Comment.objects.count()} comments', out.getvalue())
+		self.assertCountersValid()
+
+		out = StringIO()
+		call_command('repair_comment_counters', stdout=out)
+		self.assertIn('Repaired 0 posts and 0 comments', out.getvalue())
+
+	def test_comments_child_create_keeps_tree_valid(self):
+		Comment.objects.rebuild()
+		self.client.force_authenticate(self.user1)
+
+		for mode in ('append', 'ordered'):
+			with override_settings(COMMENT_INSERTION_MODE=mode):
+				for _ in range(5):
+					parent = Comment.objects.order_by('?').first()
+					url = reverse('comment-child-create', args=(parent.id,))
+					response = self.client.post(url, data=self.data)
+					self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+					self.assertEqual(response.data['post'], parent.post_id)
+					self.assertEqual(response.data['level'], parent.level + 1)
+					self.assertEqual(response.data['lft'], parent.rght)
+
+				url = reverse('comment-post-create', args=(self.post.id,))
+				response = self.client.post(url, data=self.data)
+				self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+				self.assertEqual(response.data['tree_id'], Comment.objects.aggregate(Max('tree_id'))['tree_id__max'])
+
+		mptt_values = list(Comment.objects.order_by('id').values_list('id', 'tree_id', 'lft', 'rght', 'level'))
+		Comment.objects.rebuild()
+		self.assertEqual(mptt_values, list(Comment.objects.order_by('id').values_list('id', 'tree_id', 'lft', 'rght', 'level')))
+
+
+	def test_batch_create(self):
+		Comment.objects.rebuild()
+		self.client.force_authenticate(self.user1)
+		parents = list(Comment.objects.order_by('?')[:2])
+		url = reverse('batch')
+		data = {
+			'posts': [{'ref': 'draft', 'title': 'title', 'body': 'body'}, {'title': 'second', 'body': 'body'}],
+			'comments': [
+				{'ref': 'a', 'post_ref': 'draft', 'body': 'a'},
+				{'ref': 'b', 'parent_ref': 'a', 'body': 'b'},
+				{'ref': 'c', 'parent': parents[0].id, 'body': 'c'},
+				{'parent_ref': 'c', 'body': 'd'},
+				{'parent': parents[1].id, 'body': 'e'},
+				{'parent_ref': 'b', 'body': 'f'},
+				{'parent': parents[0].id, 'body': 'g'},
+				{'post': self.post.id, 'body': 'h'},
+			],
+		}
+
+		response = self.client.post(url, data, format='json')
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(url, '/api/v1/batch/')
+		posts, comments = response.data['posts'], response.data['comments']
+		self.assertEqual([post['title'] for post in posts], ['title', 'second'])
+		self.assertEqual([comment['body'] for comment in comments], list('abcdefgh'))
+
+		created = {comment['body']: Comment.objects.get(id=comment['id']) for comment in comments}
+		self.assertEqual(created['a'].post_id, posts[0]['id'])
+		self.assertEqual(created['b'].parent, created['a'])
+		self.assertEqual(created['f'].parent, created['b'])
+		self.assertEqual((created['c'].parent, created['c'].post), (parents[0], parents[0].post))
+		self.assertEqual(created['d'].parent, created['c'])
+		self.assertEqual(created['e'].parent, parents[1])
+		self.assertEqual(created['h'].post, self.post)
+		parents[0].refresh_from_db()
+		self.assertEqual(list(parents[0].get_children())[-2:], [created['c'], created['g']])
+		self.assertEqual(Post.objects.get(id=posts[1]['id']).user, self.user1)
+
+		mptt_values = list(Comment.objects.order_by('id').values_list('id', 'tree_id', 'lft', 'rght', 'level'))
+		Comment.objects.rebuild()
+		self.assertEqual(mptt_values, list(Comment.objects.order_by('id').values_list('id', 'tree_id', 'lft', 'rght', 'level')))
+		self.assertCountersValid()
+
+	def test_batch_create_errors(self):
+		self.client.force_authenticate(self.user1)
+		url = reverse('batch')
+		missing_post = Post.objects.order_by('-id').first().id + 1
+		data = {
+			'posts': [{'ref': 'p', 'title': 'title', 'body': 'body'}, {'ref': 'p', 'title': '', 'body': 'body'}],
+			'comments': [{'post': self.post.id, 'body': 'ok'}],
+		}
+
+		response = self.client.post(url, data, format='json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(response.data['posts'][0], {})
+		self.assertIn('title', response.data['posts'][1])
+
+		data['posts'][1]['title'] = 'title'
+		data['comments'] = [
+			{'post': self.post.id, 'body': 'ok'},
+			{'post': missing_post, 'body': 'missing post'},
+			{'parent_ref': 'later', 'body': 'forward reference'},
+			{'ref': 'later', 'post_ref': 'p', 'parent': self.comment.id, 'body': 'two targets'},
+		]
+		response = self.client.post(url, data, format='json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(response.data['comments'][3], {'non_field_errors': [
+			'Укажите ровно одно из полей post, post_ref, parent, parent_ref.',
+		]})
+
+		del data['comments'][3]['parent']
+		with self.assertNumQueries(1):
+			response = self.client.post(url, data, format='json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(response.data['posts'], [{}, {'ref': ['Повторяющийся ref.']}])
+		self.assertEqual([sorted(errors) for errors in response.data['comments']], [[], ['post'], ['parent_ref'], []])
+		self.assertEqual(self.comments_count, Comment.objects.count())
+
+		data = {'comments': [{'post': self.post.id, 'body': 'ok'}] * (settings.BATCH_MAX_ITEMS + 1)}
+		self.assertEqual(self.client.post(url, data, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+		self.client.force_authenticate(None)
+		self.assertEqual(self.client.post(url, {}, format='json').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+	def assertTreesValid(self):
+		rows = Comment.objects.values_list('id', 'parent_id', 'tree_id', 'lft', 'rght', 'level')
+		nodes = {row[0]: row for row in rows}
+		numbers = {}
+		for pk, parent_id, tree_id, lft, rght, level in rows:
+			numbers.setdefault(tree_id, []).extend((lft, rght))
+			if parent_id is None:
+				self.assertEqual((lft, level), (1, 0))
+			else:
+				_, _, parent_tree_id, parent_lft, parent_rght, parent_level = nodes[parent_id]
+				self.assertEqual((tree_id, level), (parent_tree_id, parent_level + 1))
+				self.assertTrue(parent_lft < lft < rght < parent_rght)
+		for values in numbers.values():
+			self.assertEqual(sorted(values), list(range(1, len(values) + 1)))
+
+	def test_comments_delete_rebuilds_tree_in_background(self):
+		Comment.objects.rebuild()
+		root = Comment.objects.create(user=self.user1, post=self.post, body='root')
+		deleted = Comment.objects.create(user=self.user1, parent=root, body='deleted')
+		orphans = [Comment.objects.create(user=self.user1, parent=deleted, body=f'orphan {index}') for index in range(2)]
+		Comment.objects.create(user=self.user1, parent=orphans[0], body='grandchild')
+		Comment.objects.create(user=self.user1, parent=root, body='sibling')
+		self.client.force_authenticate(self.user1)
+
+		response = self.client.delete(reverse('comment-detail', args=(deleted.id,)))
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		job = Job.objects.get()
+		self.assertEqual((job.name, job.kwargs, job.status), ('comments.rebuild_tree', {'tree_id': root.tree_id}, Job.PENDING))
+
+		with self.assertLogs('blog.jobs') as logs:
+			self.assertEqual(jobs.run_pending(), 1)
+		self.assertEqual(json.loads(logs.records[0].getMessage())['result'], {'changed': 5})
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+		self.assertTreesValid()
+		self.assertCountersValid()
+
+		orphans = [Comment.objects.get(id=orphan.id) for orphan in orphans]
+		self.assertEqual([(orphan.parent_id, orphan.level) for orphan in orphans], [(None, 0), (None, 0)])
+		self.assertEqual(len({root.tree_id, orphans[0].tree_id, orphans[1].tree_id}), 3)
+		self.assertEqual(Comment.objects.get(id=root.id).get_descendant_count(), 1)
+		self.assertEqual(jobs.run_pending(), 0)
+
+	def assertPathsValid(self):
+		rows = Comment.objects.values_list('id', 'parent_id', 'path')
+		paths = {pk: path for pk, _, path in rows}
+		for pk, parent_id, path in rows:
+			self.assertEqual(path, paths.get(parent_id, '') + path_step(pk))
+
+	def get_thread(self, root):
+		get_response_cache().clear()
+		return (
+			self.client.get(reverse('comment-post-tree', args=(root.post_id,))).data,
+			self.client.get(reverse('comment-descendants', args=(root.id,))).data,
+			[comment['id'] for comment in self.client.get(reverse('comment-list'), {'post': root.post_id}).data['results']],
+		)
+
+	def test_comments_path_hierarchy(self):
+		Comment.objects.rebuild()
+		self.client.force_authenticate(self.user1)
+		root = Comment.objects.create(user=self.user1, post=self.post, body='root')
+		Comment.objects.create(user=self.user1, parent=root, body='first reply')
+		for index in range(12):
+			parent = Comment.objects.filter(post=self.post).order_by('?').first()
+			Comment.objects.create(user=self.user1, parent=parent, body=f'reply {index}')
+
+		out = StringIO()
+		call_command('convert_comment_hierarchy', to='path', stdout=out)
+		self.assertIn(f'updated {Comment.objects.count()} comments', out.getvalue())
+		self.assertPathsValid()
+		mptt_thread = self.get_thread(root)
+
+		with override_settings(COMMENT_HIERARCHY='path'):
+			self.assertEqual(self.get_thread(root), mptt_thread)
+
+			parent = Comment.objects.filter(tree_id=root.tree_id, level=1).first()
+			numbers = list(Comment.objects.order_by('id').values_list('id', 'lft', 'rght'))
+			url = reverse('comment-child-create', args=(parent.id,))
+			with self.assertNumQueries(9):
+				response = self.client.post(url, data=self.data)
+			self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+			self.assertEqual((response.data['post'], response.data['level']), (parent.post_id, parent.level + 1))
+			# Ответ не сдвигает lft/rght других комментариев.
+			self.assertEqual(numbers, list(Comment.objects.exclude(id=response.data['id']).order_by('id').values_list('id', 'lft', 'rght')))
+			self.assertEqual(Comment.objects.get(id=response.data['id']).path, parent.path + path_step(response.data['id']))
+			self.assertPathsValid()
+			self.client.post(url, data=self.data)
+			self.client.post(reverse('comment-post-create', args=(self.post.id,)), data=self.data)
+			self.assertEqual(Job.objects.filter(name='comments.rebuild_tree').count(), 1)
+
+			path_thread = self.get_thread(root)
+			self.client.get(reverse('comment-list'), {'post': self.post.id, 'page_size': 100})
+			# Новые ответы видны в поддереве родителя до перенумерации lft/rght.
+			descendants = self.client.get(reverse('comment-descendants', args=(parent.id,)), {'flat': 1}).data['results']
+			self.assertEqual([node['id'] for node in descendants][-2:], [response.data['id'], response.data['id'] + 1])
+			with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timezone.timedelta(seconds=60)), self.assertLogs('blog.jobs'):
+				self.assertEqual(jobs.run_pending(), 1)
+			self.assertTreesValid()
+			self.assertPathsValid()
+			# Временные lft/rght из кэша ответов сбрасываются вместе с перенумерацией.
+			comments = self.client.get(reverse('comment-list'), {'post': self.post.id, 'page_size': 100}).data['results']
+			self.assertEqual(
+				sorted((comment['id'], comment['lft'], comment['rght']) for comment in comments),
+				list(Comment.objects.filter(post=self.post).order_by('id').values_list('id', 'lft', 'rght')),
+			)
+			self.assertEqual(self.get_thread(root), path_thread)
+
+			# Удаление переносит потомков в новые деревья вместе с путями.
+			self.client.delete(reverse('comment-detail', args=(parent.id,)))
+			with self.assertLogs('blog.jobs'):
+				self.assertEqual(jobs.run_pending(), 1)
+			self.assertTreesValid()
+			self.assertPathsValid()
+			path_thread = self.get_thread(root)
+
+		out = StringIO()
+		call_command('convert_comment_hierarchy', to='mptt', stdout=out)
+		self.assertIn('updated 0 comments', out.getvalue())
+		self.assertEqual(self.get_thread(root), path_thread)
+
+	def test_comments_path_hierarchy_batch(self):
+		Comment.objects.rebuild()
+		call_command('convert_comment_hierarchy', to='path', stdout=StringIO())
+		self.client.force_authenticate(self.user1)
+		parent = Comment.objects.order_by('?').first()
+		data = {'comments': [
+			{'ref': 'a', 'post': self.post.id, 'body': 'a'},
+			{'parent_ref': 'a', 'body': 'b'},
+			{'ref': 'c', 'parent': parent.id, 'body': 'c'},
+			{'parent_ref': 'c', 'body': 'd'},
+		]}
+
+		with override_settings(COMMENT_HIERARCHY='path'):
+			response = self.client.post(reverse('batch'), data, format='json')
+			self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+			self.assertPathsValid()
+			self.assertEqual(Job.objects.get().kwargs, {'tree_id': parent.tree_id})
+			import_comments([
+				{'id': 1, 'parent': None, 'post': self.post.id, 'user': self.user1.id, 'body': 'imported'},
+				{'id': 2, 'parent': 1, 'user': self.user1.id, 'body': 'imported reply'},
+			])
+			self.assertPathsValid()
+			url = reverse('comment-post-tree', args=(parent.post_id,))
+			cached = self.client.get(url)
+			self.assertGreater(renumber_tree(parent.tree_id), 0)
+			self.assertTreesValid()
+			self.assertCountersValid()
+			# Перенумерация меняет lft/rght в ответах, поэтому кэш поста сбрасывается.
+			self.assertNotEqual(self.client.get(url)['ETag'], cached['ETag'])
+
+	def test_bench_hierarchy(self):
+		out = StringIO()
+		call_command('bench_hierarchy', nodes=50, ops=20, stdout=out)
+
+		self.assertIn('path ', out.getvalue())
+		self.assertIn('queries/write', out.getvalue())
+		self.assertFalse(Post.objects.filter(title='bench_hierarchy').exists())
+
+	def test_bench_renderers(self):
+		out = StringIO()
+		call_command('bench_renderers', comments=20, repeat=1, stdout=out)
+
+		self.assertIn('orjson', out.getvalue())
+		self.assertIn('gzip', out.getvalue())
+		self.assertFalse(Post.objects.filter(title='bench_renderers').exists())
+
+
+class JobQueueTest(APITestCase):
+	def setUp(self):
+		self.calls = []
+
+		def flaky(fail_times):
+			self.calls.append(fail_times)
+			if self.calls.count(fail_times) <= fail_times:
+				raise RuntimeError('flaky')
+
+		for patcher in (mock.patch.dict(jobs.HANDLERS, {'test.flaky': flaky}), mock.patch.object(jobs.logger, 'disabled', True)):
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_enqueue_deduplicates_pending_jobs(self):
+		first = Job.objects.enqueue('test.flaky', fail_times=0)
+		self.assertIsNone(Job.objects.enqueue('test.flaky', fail_times=0))
+		self.assertIsNotNone(Job.objects.enqueue('test.flaky', fail_times=1))
+
+		jobs.run_pending()
+		self.assertEqual(Job.objects.get(id=first.id).status, Job.DONE)
+		self.assertIsNotNone(Job.objects.enqueue('test.flaky', fail_times=0))
+
+	@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=60)
+	def test_retries(self):
+		job = Job.objects.enqueue('test.flaky', fail_times=5)
+
+		self.assertEqual(jobs.run_pending(), 1)
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+		self.assertIn('RuntimeError: flaky', job.last_error)
+		self.assertGreater(job.run_after, timezone.now() + timezone.timedelta(seconds=50))
+		self.assertEqual(jobs.run_pending(), 0)
+
+		Job.objects.filter(id=job.id).update(run_after=timezone.now())
+		self.assertEqual(jobs.run_pending(), 1)
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+		self.assertEqual(len(self.calls), 2)
+
+		job = Job.objects.enqueue('test.unknown')
+		jobs.run_pending()
+		job.refresh_from_db()
+		self.assertIn("Unknown job 'test.unknown'", job.last_error)
+
+	@override_settings(JOB_TIMEOUT=60)
+	def test_requeue_stale(self):
+		job = Job.objects.enqueue('test.flaky', fail_times=0)
+		Job.objects.filter(id=job.id).update(status=Job.RUNNING, started_at=timezone.now() - timezone.timedelta(seconds=120))
+		self.assertEqual(jobs.run_pending(), 0)
+
+		self.assertEqual(jobs.requeue_stale(), 1)
+		self.assertEqual(jobs.run_pending(), 1)
+		self.assertEqual(Job.objects.get(id=job.id).status, Job.DONE)
+
+	@override_settings(JOB_TIMEOUT=60, JOB_MAX_ATTEMPTS=2)
+	def test_requeue_stale_exhausted(self):
+		job = Job.objects.enqueue('test.flaky', fail_times=0)
+		started_at = timezone.now() - timezone.timedelta(seconds=120)
+		Job.objects.filter(id=job.id).update(status=Job.RUNNING, started_at=started_at, attempts=1)
+		self.assertEqual(jobs.requeue_stale(), 1)
+
+		# Воркер упал и на последней попытке: задача больше не перезапускается.
+		Job.objects.filter(id=job.id).update(status=Job.RUNNING, started_at=started_at, attempts=2)
+		self.assertEqual(jobs.requeue_stale(), 0)
+		job.refresh_from_db()
+		self.assertEqual(job.status, Job.FAILED)
+		self.assertIn('Timed out', job.last_error)
+
+	def test_queue_stats(self):
+		Job.objects.enqueue('test.flaky', fail_times=0)
+		Job.objects.enqueue('test.flaky', fail_times=1)
+		Job.objects.enqueue('test.flaky', fail_times=2, delay=3600)
+		jobs.run_pending()
+
+		stats = jobs.queue_stats()
+		self.assertEqual(stats['statuses'], {Job.PENDING: 2, Job.RUNNING: 0, Job.DONE: 1, Job.FAILED: 0})
+		self.assertEqual(stats['due'], 0)
+		self.assertEqual(stats['jobs']['test.flaky'][Job.DONE], 1)
+		self.assertEqual(set(stats['jobs']['test.flaky']['duration_ms']), {'mean', 'p50', 'p95', 'max'})
+
+	def test_commands(self):
+		out = StringIO()
+		call_command('enqueue_job', 'comments.repair_counters', stdout=out)
+		call_command('enqueue_job', 'comments.repair_counters', stdout=out)
+		self.assertIn('already pending', out.getvalue())
+		with self.assertRaises(CommandError):
+			call_command('enqueue_job', 'test.missing')
+
+		call_command('run_jobs', burst=True, stdout=out)
+		self.assertIn('Processed 1 jobs', out.getvalue())
+
+		out = StringIO()
+		call_command('job_stats', stdout=out)
+		self.assertEqual(json.loads(out.getvalue())['jobs']['comments.repair_counters'][Job.DONE], 1)
+
+
+def rest_framework_settings(**options):
+	return {**settings.REST_FRAMEWORK, **options}
+
+
+class CommentThrottlingTest(APITestCase):
+	def setUp(self):
+		# Счетчики ограничений живут в кэше THROTTLE_CACHE_ALIAS, а id пользователей и деревьев повторяются между тестами.
+		get_throttle_cache().clear()
+		self.addCleanup(get_throttle_cache().clear)
+		self.user1, self.user2 = baker.make(User, _quantity=2)
+		self.post = baker.make(Post, user=self.user1)
+		self.root = Comment.objects.create(user=self.user1, post=self.post, body='root')
+		self.other_root = Comment.objects.create(user=self.user1, post=self.post, body='other root')
+
+	def reply(self, user, comment):
+		self.client.force_authenticate(user)
+		return self.client.post(reverse('comment-child-create', args=(comment.id,)), {'body': 'reply'})
+
+	@override_settings(REST_FRAMEWORK=rest_framework_settings(DEFAULT_THROTTLE_RATES={'comment_user': '2/min'}))
+	def test_user_rate(self):
+		self.assertEqual(self.reply(self.user1, self.root).status_code, status.HTTP_201_CREATED)
+		self.client.force_authenticate(self.user1)
+		response = self.client.post(reverse('comment-post-create', args=(self.post.id,)), {'body': 'body'})
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+		response = self.reply(self.user1, self.other_root)
+		self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertGreater(int(response['Retry-After']), 0)
+		self.assertEqual(self.reply(self.user2, self.root).status_code, status.HTTP_201_CREATED)
+
+	@override_settings(REST_FRAMEWORK=rest_framework_settings(DEFAULT_THROTTLE_RATES={'comment_tree': '2/min'}))
+	def test_tree_rate(self):
+		self.assertEqual(self.reply(self.user1, self.root).status_code, status.HTTP_201_CREATED)
+		reply = Comment.objects.get(parent=self.root)
+		self.assertEqual(self.reply(self.user2, reply).status_code, status.HTTP_201_CREATED)
+
+		response = self.reply(self.user2, self.root)
+		self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertIn('Retry-After', response)
+		self.assertEqual(self.reply(self.user2, self.other_root).status_code, status.HTTP_201_CREATED)
+
+	def test_sliding_window(self):
+		with override_settings(REST_FRAMEWORK=rest_framework_settings(DEFAULT_THROTTLE_RATES={'comment_user': '10/min'})):
+			throttle = CommentUserRateThrottle()
+		request = mock.Mock(user=self.user1)
+		view = mock.Mock(spec=['kwargs'], kwargs={})
+		now = 600.0
+
+		def allow():
+			with mock.patch.object(throttle, 'timer', return_value=now):
+				return throttle.allow_request(request, view)
+
+		self.assertEqual(sum(allow() for _ in range(15)), 10)
+		self.assertAlmostEqual(throttle.wait(), 60)
+
+		# Через четверть следующего окна предыдущее весит 3/4: 7.5 из 10, свободно еще два запроса.
+		now += 75
+		self.assertEqual(sum(allow() for _ in range(5)), 3)
+		self.assertAlmostEqual(throttle.wait(), 60 * (1 - 7 / 10) - 15)
+
+	def test_shedding_after_lock_wait(self):
+		record_tree_lock_wait(self.root.tree_id, 10)
+
+		response = self.reply(self.user1, self.root)
+		self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		self.assertGreater(int(response['Retry-After']), 0)
+		self.assertEqual(self.reply(self.user1, self.other_root).status_code, status.HTTP_201_CREATED)
+		self.assertFalse(Comment.objects.filter(parent=self.root).exists())
+
+	@override_settings(REST_FRAMEWORK=rest_framework_settings(COMMENT_WRITE_SHEDDING={'LOCK_WAIT': -1}))
+	def test_lock_wait_measured(self):
+		self.assertEqual(self.reply(self.user1, self.root).status_code, status.HTTP_201_CREATED)
+		self.assertEqual(self.reply(self.user1, self.root).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+	@override_settings(REST_FRAMEWORK=rest_framework_settings(COMMENT_WRITE_SHEDDING={'MAX_TREE_WRITERS': 1, 'RETRY_AFTER': 3}))
+	def test_shedding_on_queue_depth(self):
+		with tree_writer(self.root.tree_id):
+			response = self.reply(self.user1, self.root)
+		self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		self.assertEqual(response['Retry-After'], '3')
+
+		self.assertEqual(self.reply(self.user1, self.root).status_code, status.HTTP_201_CREATED)
+
+	def batch(self, user, comments):
+		self.client.force_authenticate(user)
+		return self.client.post(reverse('batch'), {'comments': comments}, format='json')
+
+	@override_settings(REST_FRAMEWORK=rest_framework_settings(DEFAULT_THROTTLE_RATES={'comment_user': '3/min'}))
+	def test_batch_user_rate(self):
+		comments = [{'parent': self.root.id, 'body': 'reply'} for _ in range(4)]
+		response = self.batch(self.user1, comments)
+		self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertFalse(Comment.objects.filter(parent=self.root).exists())
+
+		self.assertEqual(self.batch(self.user1, comments[:3]).status_code, status.HTTP_201_CREATED)
+		self.assertEqual(self.reply(self.user1, self.root).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+	@override_settings(REST_FRAMEWORK=rest_framework_settings(DEFAULT_THROTTLE_RATES={'comment_tree': '2/min'}))
+	def test_batch_tree_rate(self):
+		comments = [
+			{'ref': 'reply', 'parent': self.root.id, 'body': 'reply'},
+			{'parent_ref': 'reply', 'body': 'reply'},
+			{'parent': self.other_root.id, 'body': 'reply'},
+			{'post': self.post.id, 'body': 'root'},
+			{'post': self.post.id, 'body': 'root'},
+			{'post': self.post.id, 'body': 'root'},
+		]
+		self.assertEqual(self.batch(self.user1, comments).status_code, status.HTTP_201_CREATED)
+		self.assertEqual(self.reply(self.user2, self.root).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertEqual(self.reply(self.user2, self.other_root).status_code, status.HTTP_201_CREATED)
+
+		response = self.batch(self.user2, [{'parent': self.other_root.id, 'body': 'reply'} for _ in range(2)])
+		self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+	def test_batch_shedding(self):
+		record_tree_lock_wait(self.root.tree_id, 10)
+
+		response = self.batch(self.user1, [
+			{'parent': self.other_root.id, 'body': 'reply'},
+			{'parent': self.root.id, 'body': 'reply'},
+		])
+		self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		self.assertFalse(Comment.objects.filter(parent__in=(self.root, self.other_root)).exists())
+		response = self.batch(self.user1, [{'parent': self.other_root.id, 'body': 'reply'}])
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class AsyncReadViewsTest(APITestCase):
+	def setUp(self):
+		self.user = baker.make(User)
+		self.posts = baker.make(Post, user=self.user, _quantity=3)
+		self.post = self.posts[0]
+		for _ in range(3):
+			root = Comment.objects.create(user=self.user, post=self.post, body='root')
+			Comment.objects.create(user=self.user, parent=root, body='reply')
+		self.factory = AsyncRequestFactory()
+
+	async def assertSameResponse(self, view, url, data=None, **kwargs):
+		expected = await sync_to_async(self.client.get)(url, data)
+		await sync_to_async(get_response_cache().clear)()
+
+		response = await view(self.factory.get(url, data), **kwargs)
+		self.assertEqual(response.status_code, expected.status_code)
+		self.assertEqual(json.loads(response.content), json.loads(expected.content))
+		return response
+
+	async def test_async_views_match_sync(self):
+		post_url = reverse('post-detail', args=(self.post.id,))
+		await self.assertSameResponse(async_views.post_list, reverse('post-list'), {'expand': 'user,comment_count'})
+		await self.assertSameResponse(async_views.post_list, reverse('post-list'), {'ordering': '-comment_count', 'page_size': 1})
+		await self.assertSameResponse(async_views.post_detail, post_url, {'expand': 'comment_count'}, pk=str(self.post.id))
+		await self.assertSameResponse(async_views.post_detail, reverse('post-detail', args=(0,)), pk='0')
+		await self.assertSameResponse(async_views.comment_list, reverse('comment-list'), {'post': self.post.id, 'page_size': 2})
+		await self.assertSameResponse(async_views.comment_list, reverse('comment-list'), {'expand': 'reply_count'})
+		await self.assertSameResponse(
+			async_views.comment_post_tree, reverse('comment-post-tree', args=(self.post.id,)), post_id=self.post.id,
+		)
+
+	async def test_async_views_cache(self):
+		url = reverse('post-detail', args=(self.post.id,))
+		response = await async_views.post_detail(self.factory.get(url), pk=str(self.post.id))
+		etag = response['ETag']
+
+		response = await async_views.post_detail(self.factory.get(url, if_none_match=etag), pk=str(self.post.id))
+		self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+	async def test_async_views_authentication(self):
+		url = reverse('post-list')
+		token = await Token.objects.acreate(user=self.user)
+		access = str(AccessToken.for_user(self.user))
+
+		for authorization, expected in (
+			(f'Token {token.key}', status.HTTP_200_OK),
+			(f'Bearer {access}', status.HTTP_200_OK),
+			('Token invalid', status.HTTP_401_UNAUTHORIZED),
+			('Bearer invalid', status.HTTP_401_UNAUTHORIZED),
+		):
+			response = await async_views.post_list(self.factory.get(url, authorization=authorization))
+			self.assertEqual(response.status_code, expected, authorization)
+
+	async def test_async_views_cache_off_event_loop(self):
+		# Общий кэш (Redis) ходит в сеть, поэтому синхронные методы кэша не вызываются в цикле событий.
+		calls = []
+
+		def off_loop(method):
+			def wrapper(cache, *args, **kwargs):
+				try:
+					asyncio.get_running_loop()
+				except RuntimeError:
+					calls.append(method.__name__)
+					return method(cache, *args, **kwargs)
+				raise AssertionError(f'{method.__name__} in event loop')
+			return wrapper
+
+		url = reverse('post-detail', args=(self.post.id,))
+		token = await Token.objects.acreate(user=self.user)
+		access = str(AccessToken.for_user(self.user))
+		with mock.patch.multiple(
+			LocMemCache, **{name: off_loop(getattr(LocMemCache, name)) for name in ('get', 'set', 'add', 'set_many')},
+		):
+			for authorization in (f'Token {token.key}', f'Token {token.key}', f'Bearer {access}', f'Bearer {access}'):
+				response = await async_views.post_detail(
+					self.factory.get(url, authorization=authorization), pk=str(self.post.id),
+				)
+				self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertIn('get', calls)
+
+	async def test_async_views_delegate_writes(self):
+		request = self.factory.post(reverse('post-list'), {'title': 'title', 'body': 'body'}, content_type='application/json')
+		response = await async_views.post_list(request)
+
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class EventStream:
+	"""
+	Клиент потока событий поверх ASGI-приложения ``events_application``.
+	"""
+
+	def __init__(self, post_id, method='GET', headers=()):
+		self.receive_queue = asyncio.Queue()
+		self.messages = asyncio.Queue()
+		self.buffer = b''
+		scope = {
+			'type': 'http',
+			'method': method,
+			'path': f'/api/v1/posts/{post_id}/comments/events/',
+			'query_string': b'',
+			'headers': list(headers),
+		}
+		self.task = asyncio.ensure_future(events.events_application(None)(scope, self.receive_queue.get, self.messages.put))
+
+	async def start(self):
+		message = await asyncio.wait_for(self.messages.get(), 5)
+		return message['status'], dict(message['headers'])
+
+	async def next_event(self):
+		"""
+		Следующее событие (id, тип, данные) без retry и keepalive; None - сервер закрыл поток.
+		"""
+		while True:
+			while b'\n\n' not in self.buffer:
+				message = await asyncio.wait_for(self.messages.get(), 5)
+				self.buffer += message['body']
+				if not message.get('more_body'):
+					return None
+			block, self.buffer = self.buffer.split(b'\n\n', 1)
+			fields = dict(line.split(': ', 1) for line in block.decode().splitlines() if not line.startswith(':'))
+			if 'event' in fields:
+				return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+	async def close(self):
+		await self.receive_queue.put({'type': 'http.disconnect'})
+		await asyncio.wait_for(self.task, 5)
+		if events.broker.poller is not None:
+			await asyncio.wait_for(events.broker.poller, 5)
+
+
+@override_settings(COMMENT_EVENTS_POLL_INTERVAL=0.01, COMMENT_EVENTS_WINDOW=0)
+class CommentEventsTest(APITestCase):
+	def setUp(self):
+		self.user = baker.make(User)
+		self.post, self.other_post = baker.make(Post, user=self.user, _quantity=2)
+		self.comment = Comment.objects.create(user=self.user, post=self.post, body='root')
+		self.client.force_authenticate(self.user)
+		self.data = {'body': 'body'}
+
+	def test_events_published(self):
+		reply = self.client.post(reverse('comment-child-create', args=(self.comment.id,)), self.data).data
+		self.client.patch(reverse('comment-detail', args=(reply['id'],)), {'body': 'edited'})
+		self.client.delete(reverse('comment-detail', args=(reply['id'],)))
+		batch = self.client.post(reverse('batch'), {'comments': [{'post': self.other_post.id, 'body': 'batch'}]}, format='json')
+
+		self.assertEqual(
+			list(CommentEvent.objects.order_by('id').values_list('post_id', 'comment_id', 'type')),
+			[
+				(self.post.id, reply['id'], CommentEvent.CREATED),
+				(self.post.id, reply['id'], CommentEvent.UPDATED),
+				(self.post.id, reply['id'], CommentEvent.DELETED),
+				(self.other_post.id, batch.data['comments'][0]['id'], CommentEvent.CREATED),
+			],
+		)
+		created, updated, deleted, _ = CommentEvent.objects.order_by('id')
+		self.assertEqual(created.data, reply)
+		self.assertEqual(updated.data['body'], 'edited')
+		self.assertEqual(deleted.data, {'id': reply['id'], 'parent': self.comment.id})
+
+		CommentEvent.objects.filter(id=created.id).update(created_at=timezone.now() - timezone.timedelta(days=2))
+		self.assertEqual(events.prune_events(), 1)
+
+	async def test_event_stream(self):
+		stream = EventStream(self.post.id)
+		status_code, headers = await stream.start()
+		self.assertEqual((status_code, headers[b'content-type']), (200, b'text/event-stream; charset=utf-8'))
+
+		reply = (await sync_to_async(self.client.post)(reverse('comment-child-create', args=(self.comment.id,)), self.data)).data
+		event_id, event_type, data = await stream.next_event()
+		self.assertEqual((event_type, data), ('comment.created', reply))
+
+		await sync_to_async(self.client.post)(reverse('comment-post-create', args=(self.other_post.id,)), self.data)
+		await sync_to_async(self.client.patch)(reverse('comment-detail', args=(reply['id'],)), {'body': 'edited'})
+		next_id, event_type, data = await stream.next_event()
+		self.assertEqual((event_type, data['body']), ('comment.updated', 'edited'))
+		self.assertGreater(next_id, event_id)
+
+		self.assertEqual(events.broker.count, 1)
+		await stream.close()
+		self.assertEqual(events.broker.count, 0)
+
+	async def test_event_stream_resume(self):
+		url = reverse('comment-post-create', args=(self.post.id,))
+		created = [(await sync_to_async(self.client.post)(url, self.data)).data for _ in range(3)]
+		first_id = await CommentEvent.objects.filter(comment_id=created[0]['id']).values_list('id', flat=True).aget()
+
+		stream = EventStream(self.post.id, headers=[(b'last-event-id', str(first_id).encode())])
+		await stream.start()
+		self.assertEqual([(await stream.next_event())[2]['id'] for _ in range(2)], [created[1]['id'], created[2]['id']])
+		await stream.close()
+
+		with override_settings(COMMENT_EVENTS_REPLAY_LIMIT=1):
+			stream = EventStream(self.post.id, headers=[(b'last-event-id', str(first_id).encode())])
+			await stream.start()
+			self.assertEqual((await stream.next_event())[1:], ('reset', {'post': self.post.id}))
+			await stream.close()
+
+	@override_settings(COMMENT_EVENTS_WINDOW=60)
+	async def test_event_stream_commit_order(self):
+		async def commit(event_id, comment_id):
+			await CommentEvent.objects.acreate(id=event_id, post=self.post, comment_id=comment_id, type=CommentEvent.CREATED, data={'id': comment_id})
+			events.broker.notify()
+
+		stream = EventStream(self.post.id)
+		await stream.start()
+		first_id = events.broker.last_id + 1
+		# Id выдаются до коммита: событие first_id становится видимым после first_id + 1.
+		await commit(first_id + 1, 2)
+		self.assertEqual(await stream.next_event(), (first_id + 1, 'comment.created', {'id': 2}))
+		await commit(first_id, 1)
+		self.assertEqual(await stream.next_event(), (first_id, 'comment.created', {'id': 1}))
+		await commit(first_id + 2, 3)
+		self.assertEqual(await stream.next_event(), (first_id + 2, 'comment.created', {'id': 3}))
+		self.assertEqual(events.broker.gaps, {})
+		await stream.close()
+
+		# Повтор после first_id + 1 включает и события окна с меньшими id.
+		stream = EventStream(self.post.id, headers=[(b'last-event-id', str(first_id + 1).encode())])
+		await stream.start()
+		self.assertEqual([(await stream.next_event())[0] for _ in range(3)], [first_id, first_id + 1, first_id + 2])
+		await stream.close()
+
+	@override_settings(COMMENT_EVENTS_QUEUE_SIZE=1)
+	async def test_event_stream_overflow(self):
+		stream = EventStream(self.post.id)
+		await stream.start()
+		sent_id = events.broker.last_id
+		events.broker.dispatch([(sent_id + 1, self.post.id, 'created', {'id': 1}), (sent_id + 2, self.post.id, 'created', {'id': 2})])
+
+		# Отстающий подписчик получает то, что успело попасть в очередь, и отключается.
+		self.assertEqual(await stream.next_event(), (sent_id + 1, 'comment.created', {'id': 1}))
+		self.assertIsNone(await stream.next_event())
+		self.assertEqual(events.broker.count, 0)
+		await stream.close()
+
+	async def test_event_stream_errors(self):
+		stream = EventStream(0)
+		self.assertEqual((await stream.start())[0], 404)
+		stream = EventStream(self.post.id, method='POST')
+		self.assertEqual((await stream.start())[0], 405)
+		with override_settings(COMMENT_EVENTS_MAX_SUBSCRIBERS=0):
+			stream = EventStream(self.post.id)
+			status_code, headers = await stream.start()
+			self.assertEqual((status_code, headers[b'retry-after']), (503, b'3'))
+
+		django_application = mock.AsyncMock()
+		scope = {'type': 'http', 'method': 'GET', 'path': '/api/v1/posts/', 'headers': []}
+		await events.events_application(django_application)(scope, None, None)
+		django_application.assert_awaited_once_with(scope, None, None)
+
+
+@override_settings(SYNC_WINDOW=0)
+class SyncTest(QueryCountMixin, APITestCase):
+	def setUp(self):
+		self.user = baker.make(User)
+		self.post, self.other_post = baker.make(Post, user=self.user, _quantity=2)
+		self.comments = [Comment.objects.create(user=self.user, post=self.post, body=f'comment {index}') for index in range(3)]
+		self.other_comment = Comment.objects.create(user=self.user, post=self.other_post, body='other')
+		self.url = reverse('sync')
+
+	def sync(self, **params):
+		response = self.assertRequestQueries(3, 'get', self.url, params)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return response.data
+
+	def test_sync_changes(self):
+		data = self.sync()
+		self.assertEqual([post['id'] for post in data['posts']], [self.post.id, self.other_post.id])
+		self.assertEqual([comment['id'] for comment in data['comments']], [comment.id for comment in self.comments + [self.other_comment]])
+		self.assertEqual(data['deleted'], {'posts': [], 'comments': []})
+		self.assertFalse(data['has_more'])
+
+		self.client.force_authenticate(self.user)
+		edited, deleted, _ = self.comments
+		self.client.patch(reverse('comment-detail', args=(edited.id,)), {'body': 'edited'})
+		self.client.delete(reverse('comment-detail', args=(deleted.id,)))
+		reply = self.client.post(reverse('comment-child-create', args=(edited.id,)), {'body': 'reply'}).data
+		self.client.delete(reverse('post-detail', args=(self.other_post.id,)))
+		self.client.force_authenticate(None)
+
+		data = self.sync(since=data['next'])
+		self.assertEqual(data['posts'], [])
+		self.assertEqual([(comment['id'], comment['body']) for comment in data['comments']], [(edited.id, 'edited'), (reply['id'], 'reply')])
+		self.assertEqual(data['deleted'], {'posts': [self.other_post.id], 'comments': [deleted.id]})
+
+		data = self.sync(since=data['next'])
+		self.assertEqual((data['posts'], data['comments'], data['deleted']), ([], [], {'posts': [], 'comments': []}))
+
+	def test_sync_pages(self):
+		ids = []
+		data = {'next': None, 'has_more': True}
+		while data['has_more']:
+			data = self.sync(page_size=2, **({'since': data['next']} if data['next'] else {}))
+			ids += [comment['id'] for comment in data['comments']]
+		self.assertEqual(ids, [comment.id for comment in self.comments + [self.other_comment]])
+
+	@override_settings(SYNC_WINDOW=60)
+	def test_sync_window(self):
+		# Изменения последних SYNC_WINDOW секунд приходят повторно, пока не станут старше окна.
+		data = self.sync(post=self.post.id)
+		self.assertEqual(len(data['comments']), 3)
+		self.assertEqual(len(self.sync(since=data['next'])['comments']), 3)
+		with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timezone.timedelta(minutes=2)):
+			self.assertEqual(self.sync(since=self.sync(since=data['next'])['next'])['comments'], [])
+
+	def test_sync_post(self):
+		data = self.sync(post=self.post.id)
+		self.assertEqual([post['id'] for post in data['posts']], [self.post.id])
+		self.assertEqual([comment['id'] for comment in data['comments']], [comment.id for comment in self.comments])
+
+		deleted_id = self.comments[0].id
+		self.other_comment.delete()
+		self.comments[0].delete()
+		self.assertEqual(self.sync(since=data['next'])['deleted'], {'posts': [], 'comments': [deleted_id]})
+
+		response = self.client.get(self.url, {'since': data['next'], 'post': self.other_post.id})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_sync_cascade_delete(self):
+		author = baker.make(User)
+		own_post = baker.make(Post, user=author)
+		reply = Comment.objects.create(user=author, parent=self.comments[0], body='reply')
+		nested = Comment.objects.create(user=self.user, parent=reply, body='nested')
+		data = self.sync()
+
+		# Пользователь удаляется каскадом (как через djoser), без Post.delete и Comment.delete.
+		author.delete()
+		data = self.sync(since=data['next'])
+		self.assertEqual(data['deleted'], {'posts': [own_post.id], 'comments': [reply.id]})
+		self.assertEqual([(comment['id'], comment['parent']) for comment in data['comments']], [(nested.id, None)])
+		self.assertEqual(
+			list(CommentEvent.objects.values_list('comment_id', 'type', 'data')),
+			[(reply.id, CommentEvent.DELETED, {'id': reply.id, 'parent': self.comments[0].id})],
+		)
+		self.assertEqual(Job.objects.get().kwargs, {'tree_id': reply.tree_id})
+		self.assertEqual(Comment.objects.get(id=self.comments[0].id).reply_count, 0)
+
+	def test_sync_invalid_token(self):
+		for since in ('x', 'cG9zdHM9eA==', ''):
+			response = self.client.get(self.url, {'since': since})
+			self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+		since = self.sync()['next']
+		with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timezone.timedelta(days=31)):
+			response = self.client.get(self.url, {'since': since})
+		self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+		Tombstone.objects.create(kind=Tombstone.POST, object_id=0, post_id=0, deleted_at=timezone.now() - timezone.timedelta(days=31))
+		self.assertEqual(prune_tombstones(), 1)
+
+
+class RowSerializerTest(APITestCase):
+	def setUp(self):
+		self.user = baker.make(User, username='автор')
+		self.posts = baker.make(Post, user=self.user, _quantity=3)
+		self.post = self.posts[0]
+		for index in range(3):
+			root = Comment.objects.create(user=self.user, post=self.post, body=f'корень {index} ')
+			Comment.objects.create(user=self.user, parent=root, body='ответ "reply"')
+		Comment.objects.filter(id=root.id).update(created_at=timezone.now().replace(microsecond=0))
+
+	def assertSameContent(self, url, data=None):
+		"""
+		Ответ со строками values_list совпадает побайтно с ответом ModelSerializer.
+		"""
+		response = self.client.get(url, data)
+		get_response_cache().clear()
+		with mock.patch.object(PostViewSet, 'row_serializer_class', None), \
+				mock.patch.object(CommentViewSet, 'row_serializer_class', None):
+			expected = self.client.get(url, data)
+		get_response_cache().clear()
+		self.assertEqual(response.status_code, expected.status_code)
+		self.assertEqual(response.content, expected.content)
+		return response
+
+	def test_rows_match_model_serializers(self):
+		for expand in ((), ('user',), ('user', 'reply_count', 'descendant_count'), ('descendant_count',)):
+			queryset = Comment.objects.annotate(user_username=F('user__username')).order_by('id')
+			context = {'expand': expand}
+			self.assertEqual(
+				CommentRowSerializer(CommentRowSerializer.get_row_queryset(queryset, expand), many=True, context=context).data,
+				CommentSerializer(queryset, many=True, context=context).data,
+			)
+		queryset = Post.objects.annotate(user_username=F('user__username')).order_by('id')
+		context = {'expand': ('user', 'comment_count')}
+		row = PostRowSerializer.get_row_queryset(queryset, context['expand'], ('title', 'id')).first()
+		self.assertEqual(PostRowSerializer(row, context=context).data, PostSerializer(queryset.first(), context=context).data)
+
+	def test_views_match_model_serializers(self):
+		comment = Comment.objects.filter(parent__isnull=False).first()
+		self.assertSameContent(reverse('post-list'))
+		self.assertSameContent(reverse('post-list'), {'expand': 'user,comment_count', 'ordering': '-comment_count', 'page_size': 1})
+		self.assertSameContent(reverse('post-detail', args=(self.post.id,)), {'expand': 'user'})
+		self.assertSameContent(reverse('post-detail', args=(0,)))
+		self.assertSameContent(reverse('comment-list'), {'expand': 'user,reply_count,descendant_count'})
+		self.assertSameContent(reverse('comment-list'), {'search': 'корень', 'page_size': 2})
+		self.assertSameContent(reverse('comment-list'), {'ordering': '-created_at', 'format': 'columns'})
+		self.assertSameContent(reverse('comment-detail', args=(comment.id,)), {'expand': 'reply_count'})
+
+		response = self.assertSameContent(reverse('comment-list'), {'post': self.post.id, 'page_size': 4})
+		self.assertSameContent(response.data['next'])
+		self.assertEqual(len(self.client.get(response.data['next']).data['results']), 2)
+
+		html = self.client.get(reverse('comment-detail', args=(comment.id,)), HTTP_ACCEPT='text/html')
+		self.assertEqual(html.status_code, status.HTTP_200_OK)
+
+	def test_bench_serializers(self):
+		out = StringIO()
+		call_command('bench_serializers', rows=30, repeat=1, stdout=out)
+
+		self.assertIn('speedup', out.getvalue())
+		self.assertFalse(Post.objects.filter(title='bench_serializers').exists())
@@ -0,0 +1,258 @@
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+# Значения по умолчанию для REST_FRAMEWORK['COMMENT_WRITE_SHEDDING'].
+SHEDDING_DEFAULTS = {
+	# Ожидание блокировки дерева дольше LOCK_WAIT секунд переводит дерево в режим перегрузки на COOLDOWN секунд.
+	'LOCK_WAIT': 0.5,
+	'COOLDOWN': 10,
+	# Одновременных записей в одно дерево (ждущих блокировки или вставляющих), после которых новые отклоняются.
+	'MAX_TREE_WRITERS': 8,
+	# Retry-After при отказе из-за очереди записей.
+	'RETRY_AFTER': 1,
+	# Время жизни счетчика записей: ограничивает ошибку после падения процесса посреди записи.
+	'WRITERS_TIMEOUT': 60,
+}
+
+
+def get_throttle_cache():
+	# Счетчики должны быть общими для всех процессов, см. THROTTLE_CACHE_BACKEND.
+	return caches[settings.THROTTLE_CACHE_ALIAS]
+
+
+def get_shedding_settings():
+	return {**SHEDDING_DEFAULTS, **settings.REST_FRAMEWORK.get('COMMENT_WRITE_SHEDDING', {})}
+
+
+def _overloaded_key(tree_id):
+	return f'overload:tree:{tree_id}'
+
+
+def _writers_key(tree_id):
+	return f'overload:tree:{tree_id}:writers'
+
+
+class Overloaded(exceptions.APIException):
+	"""
+	503 с Retry-After: обработчик исключений DRF добавляет заголовок по атрибуту ``wait``.
+	"""
+	status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+	default_detail = 'Обсуждение перегружено, повторите запрос позже.'
+	default_code = 'overloaded'
+
+	def __init__(self, wait, detail=None):
+		super().__init__(detail)
+		self.wait = max(1, round(wait))
+
+
+def record_tree_lock_wait(tree_id, seconds):
+	"""
+	Сообщает время ожидания блокировки корня дерева. При превышении LOCK_WAIT дерево
+	помечается перегруженным; в остальных случаях кэш не трогается.
+	"""
+	options = get_shedding_settings()
+	if tree_id is not None and seconds > options['LOCK_WAIT']:
+		get_throttle_cache().set(_overloaded_key(tree_id), time.time() + options['COOLDOWN'], options['COOLDOWN'])
+
+
+@contextmanager
+def tree_writer(tree_id):
+	"""
+	Учитывает запись в дерево ``tree_id`` (None - новое дерево, не учитывается) в общем
+	счетчике очереди на время блока. Счетчик живет WRITERS_TIMEOUT секунд с первой записи:
+	если процесс упал, не уменьшив его, ошибка пропадает вместе с ключом.
+	"""
+	if tree_id is None:
+		yield
+		return
+	cache = get_throttle_cache()
+	key = _writers_key(tree_id)
+	cache.add(key, 0, get_shedding_settings()['WRITERS_TIMEOUT'])
+	try:
+		cache.incr(key)
+	except ValueError:
+		pass
+	try:
+		yield
+	finally:
+		try:
+			cache.decr(key)
+		except ValueError:
+			pass
+
+
+@contextmanager
+def tree_writers(tree_ids):
+	"""
+	``tree_writer`` для записи сразу в несколько деревьев.
+	"""
+	with ExitStack() as stack:
+		for tree_id in tree_ids:
+			stack.enter_context(tree_writer(tree_id))
+		yield
+
+
+def get_reply_parent(view):
+	"""
+	Комментарий, на который отвечает запрос (``comment_id`` в URL), или None. Запоминается
+	на представлении: ограничители узнают по нему дерево, а представление берет родителя
+	без повторного запроса.
+	"""
+	if not hasattr(view, '_reply_parent'):
+		comment_id = view.kwargs.get('comment_id')
+		view._reply_parent = None if comment_id is None else view.queryset.filter(pk=comment_id).first()
+	return view._reply_parent
+
+
+def get_tree_id(view):
+	"""
+	Дерево, в которое пишет запрос; для нового комментария к посту - None.
+	"""
+	parent = get_reply_parent(view)
+	return None if parent is None else parent.tree_id
+
+
+def get_tree_writes(view):
+	"""
+	Сколько комментариев запрос создает в каждом дереве: ``{tree_id: число}``, None - новые деревья.
+	Представление с несколькими комментариями в запросе задает метод ``get_tree_writes``,
+	остальные создают один комментарий в дереве ``get_tree_id``. Запоминается на представлении.
+	"""
+	if not hasattr(view, '_tree_writes'):
+		get_writes = getattr(view, 'get_tree_writes', None)
+		view._tree_writes = get_writes() if get_writes is not None else Counter({get_tree_id(view): 1})
+	return view._tree_writes
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+	"""
+	Скользящее окно по двум счетчикам фиксированных окон: к текущему окну добавляется доля
+	предыдущего, пропорциональная еще не прошедшей его части. В отличие от SimpleRateThrottle
+	(список отметок времени на ключ, перезаписываемый целиком) в кэше два числа, а проверка -
+	один ``get_many`` и атомарный ``incr``.
+
+	Частота берется из REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'][scope] при каждом запросе;
+	без нее ограничения нет. Запрос может расходовать несколько единиц лимита в нескольких
+	счетчиках (``get_cache_costs``): он проходит, только если помещается в каждый из них.
+	"""
+
+	def __init__(self):
+		self.rate = self.get_rate()
+		self.num_requests, self.duration = self.parse_rate(self.rate)
+
+	@property
+	def cache(self):
+		return get_throttle_cache()
+
+	def get_rate(self):
+		return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+	def get_cache_costs(self, request, view):
+		"""
+		Ключи счетчиков и сколько единиц запрос расходует в каждом; по умолчанию одна единица по ``get_cache_key``.
+		"""
+		key = self.get_cache_key(request, view)
+		return {} if key is None else {key: 1}
+
+	def allow_request(self, request, view):
+		if self.rate is None:
+			return True
+		costs = self.get_cache_costs(request, view)
+		if not costs:
+			return True
+
+		now = self.timer()
+		window = int(now // self.duration)
+		self.elapsed = now - window * self.duration
+		counts = self.cache.get_many([f'{key}:{index}' for key in costs for index in (window, window - 1)])
+		for key, cost in costs.items():
+			self.current = counts.get(f'{key}:{window}', 0)
+			self.previous = counts.get(f'{key}:{window - 1}', 0)
+			self.cost = cost
+			# Как для одного запроса: после первых cost - 1 единиц оценка должна остаться ниже лимита.
+			if self.previous * (1 - self.elapsed / self.duration) + self.current + cost - 1 >= self.num_requests:
+				return False
+
+		for key, cost in costs.items():
+			current_key = f'{key}:{window}'
+			try:
+				self.cache.incr(current_key, cost)
+			except ValueError:
+				# Первый запрос окна; add не затрет счетчик, созданный параллельным запросом.
+				if not self.cache.add(current_key, cost, self.duration * 2):
+					self.cache.incr(current_key, cost)
+		return True
+
+	def wait(self):
+		"""
+		Через сколько секунд оценка опустится настолько, что запрос поместится, если новых запросов
+		не будет. None - запрос больше лимита и не пройдет никогда.
+		"""
+		limit = self.num_requests - self.cost + 1
+		if limit <= 0:
+			return None
+		if self.current >= limit:
+			# Текущее окно станет предыдущим, и его доля должна уменьшиться до лимита.
+			return self.duration - self.elapsed + self.duration * (1 - limit / self.current)
+		return max(0, self.duration * (1 - (limit - self.current) / self.previous) - self.elapsed)
+
+
+class CommentUserRateThrottle(SlidingWindowRateThrottle):
+	"""
+	Частота создания комментариев одним пользователем (scope ``comment_user``).
+	"""
+	scope = 'comment_user'
+
+	def get_cache_key(self, request, view):
+		ident = request.user.pk if request.user.is_authenticated else self.get_ident(request)
+		return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+	def get_cache_costs(self, request, view):
+		count = sum(get_tree_writes(view).values())
+		return {self.get_cache_key(request, view): count} if count else {}
+
+
+class CommentTreeRateThrottle(SlidingWindowRateThrottle):
+	"""
+	Частота ответов в одно дерево комментариев от всех пользователей (scope ``comment_tree``):
+	каждая вставка сдвигает lft/rght дерева и держит блокировку его корня.
+	"""
+	scope = 'comment_tree'
+
+	def get_cache_costs(self, request, view):
+		return {
+			self.cache_format % {'scope': self.scope, 'ident': tree_id}: count
+			for tree_id, count in get_tree_writes(view).items()
+			if tree_id is not None and count
+		}
+
+
+class CommentWriteSheddingThrottle(BaseThrottle):
+	"""
+	Отклоняет ответы в дерево с 503 и Retry-After, пока оно перегружено: недавнее ожидание
+	блокировки превысило LOCK_WAIT или в дереве уже MAX_TREE_WRITERS одновременных записей.
+	Пакет отклоняется, если перегружено любое из деревьев, в которые он пишет.
+	Настройки - REST_FRAMEWORK['COMMENT_WRITE_SHEDDING'].
+	"""
+
+	def allow_request(self, request, view):
+		tree_ids = [tree_id for tree_id in get_tree_writes(view) if tree_id is not None]
+		if not tree_ids:
+			return True
+
+		options = get_shedding_settings()
+		state = get_throttle_cache().get_many([key for tree_id in tree_ids for key in (_overloaded_key(tree_id), _writers_key(tree_id))])
+		for tree_id in tree_ids:
+			overloaded_until = state.get(_overloaded_key(tree_id))
+			if overloaded_until is not None and overloaded_until > time.time():
+				raise Overloaded(overloaded_until - time.time())
+			if state.get(_writers_key(tree_id), 0) >= options['MAX_TREE_WRITERS']:
+				raise Overloaded(options['RETRY_AFTER'])
+		return True
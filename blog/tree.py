@@ -0,0 +1,64 @@
+from rest_framework import serializers
+
+TREE_FIELDS = ('id', 'user_id', 'body', 'created_at', 'parent_id')
+
+_created_at_field = serializers.DateTimeField()
+
+
+def build_comment_tree(rows):
+	"""
+	Собирает вложенное дерево комментариев за один линейный проход.
+
+	``rows`` - кортежи в порядке ``TREE_FIELDS``, отсортированные по (tree_id, lft),
+	поэтому родитель всегда встречается раньше своих потомков. Комментарий, родитель
+	которого не попал в выборку, становится корнем.
+	"""
+	roots = []
+	nodes = {}
+	for pk, user_id, body, created_at, parent_id in rows:
+		parent = nodes.get(parent_id)
+		node = {
+			'id': pk,
+			'user': user_id,
+			'body': body,
+			'created_at': _created_at_field.to_representation(created_at),
+			'children': [],
+		}
+		nodes[pk] = node
+		if parent is None:
+			roots.append(node)
+		else:
+			parent['children'].append(node)
+	return roots
+
+
+def build_comment_list(rows):
+	"""
+	Плоский список комментариев из кортежей ``TREE_FIELDS`` в исходном порядке, со ссылкой на родителя.
+	"""
+	return [
+		{
+			'id': pk,
+			'user': user_id,
+			'body': body,
+			'created_at': _created_at_field.to_representation(created_at),
+			'parent': parent_id,
+		}
+		for pk, user_id, body, created_at, parent_id in rows
+	]
+
+
+def select_subtree(rows, root_id):
+	"""
+	Оставляет из выборки по диапазону lft/rght только строки, связанные с ``root_id`` цепочкой
+	``parent_id``. После удаления с SET_NULL потомки удаленного комментария сохраняют
+	старые lft/rght и могут попасть в чужой диапазон.
+	"""
+	ids = {root_id}
+	subtree = []
+	for row in rows:
+		pk, *_, parent_id = row
+		if parent_id in ids:
+			ids.add(pk)
+			subtree.append(row)
+	return subtree
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -6,10 +7,25 @@ from rest_framework.routers import DefaultRouter
 urlpatterns = [
 	path('posts/<int:post_id>/comments/', views.CommentViewSet.as_view({'post': 'create_post_comment'}),
 	     name='comment-post-create'),
+	path('posts/<int:post_id>/comments/tree/', views.CommentViewSet.as_view({'get': 'post_comment_tree'}),
+	     name='comment-post-tree'),
 	path('comments/<int:comment_id>/comments/', views.CommentViewSet.as_view({'post': 'create_child_comment'}),
 	     name='comment-child-create'),
+	path('batch/', views.BatchView.as_view(), name='batch'),
+	path('sync/', views.SyncView.as_view(), name='sync'),
 ]
 
+if settings.ASYNC_READ_VIEWS:
+	from . import async_views
+
+	# Чтение через асинхронный ORM; запись по тем же адресам передается синхронным ViewSet.
+	urlpatterns = [
+		path('posts/', async_views.post_list, name='post-list'),
+		path('posts/<pk>/', async_views.post_detail, name='post-detail'),
+		path('comments/', async_views.comment_list, name='comment-list'),
+		path('posts/<int:post_id>/comments/tree/', async_views.comment_post_tree, name='comment-post-tree'),
+	] + urlpatterns
+
 router = DefaultRouter()
 
 router.register("posts", views.PostViewSet)
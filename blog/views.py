@@ -1,20 +1,125 @@
+from collections import Counter
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets, status
+from rest_framework import generics, viewsets, status, permissions
 from rest_framework.decorators import action
-from rest_framework.exceptions import NotFound
-from rest_framework.filters import OrderingFilter
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .models import Post, Comment
+from test_comments.timing import TimedAuthenticationMixin, timed
+from .cache import cached_response
+from .events import publish, publish_many
+from .export import get_export_queryset, iter_ndjson, parse_export_datetime
+from .filters import PostFilter, CommentFilter
+from .hierarchy import subtree_filter, tree_ordering
+from .models import Post, Comment, CommentEvent, Tombstone
 from .permissions import IsOwnerOrReadOnly, IsCommentOrPostOwnerOrReadOnly
-from .serializers import PostSerializer, CommentSerializer
+from .search import FullTextSearchFilter, SearchOrderingFilter
+from .serializers import (
+	BatchSerializer,
+	CommentRowSerializer,
+	CommentSerializer,
+	PostRowSerializer,
+	PostSerializer,
+)
+from .sync import decode_token, encode_token, get_changes, initial_positions
+from .throttling import (
+	CommentTreeRateThrottle,
+	CommentUserRateThrottle,
+	CommentWriteSheddingThrottle,
+	get_reply_parent,
+	get_tree_id,
+	get_tree_writes,
+	tree_writer,
+	tree_writers,
+)
+from .tree import TREE_FIELDS, build_comment_list, build_comment_tree, select_subtree
 
 User = get_user_model()
 
 
-class PostViewSet(viewsets.ModelViewSet):
+def get_limit_param(request, name, maximum):
+	value = request.query_params.get(name)
+	if value is None:
+		return maximum
+	try:
+		value = int(value)
+	except ValueError:
+		raise ValidationError({name: 'Ожидается целое число.'})
+	if value < 0:
+		raise ValidationError({name: 'Ожидается неотрицательное число.'})
+	return min(value, maximum)
+
+
+class ExpandMixin:
+	"""
+	Разбирает ``?expand=a,b`` для чтения и добавляет в queryset аннотации из ``expand_annotations``.
+	"""
+	expand_annotations = {}
+
+	def get_expand(self):
+		if not hasattr(self, '_expand'):
+			self._expand = ()
+			if self.request.method in permissions.SAFE_METHODS:
+				names = [name for name in self.request.query_params.get('expand', '').split(',') if name]
+				unknown = set(names) - set(self.expand_annotations)
+				if unknown:
+					raise ValidationError({'expand': f'Недопустимые значения: {", ".join(sorted(unknown))}.'})
+				self._expand = tuple(names)
+		return self._expand
+
+	def get_queryset(self):
+		queryset = super().get_queryset()
+		for name in self.get_expand():
+			queryset = queryset.annotate(**self.expand_annotations[name])
+		return queryset
+
+	def get_serializer_context(self):
+		context = super().get_serializer_context()
+		context['expand'] = self.get_expand()
+		return context
+
+
+class RowReadMixin:
+	"""
+	list и retrieve читают кортежи ``values_list`` и сериализуют их ``row_serializer_class``
+	(см. blog.serializers.RowSerializer) без моделей и полей DRF на каждую строку. Запись и схема
+	API используют ``serializer_class``. Нужен ExpandMixin.
+	"""
+	row_serializer_class = None
+
+	def reads_rows(self):
+		return (
+			self.row_serializer_class is not None
+			and self.action in ('list', 'retrieve')
+			and not getattr(self, 'swagger_fake_view', False)
+		)
+
+	def get_serializer_class(self):
+		if self.reads_rows():
+			return self.row_serializer_class
+		return super().get_serializer_class()
+
+	def filter_queryset(self, queryset):
+		queryset = super().filter_queryset(queryset)
+		if not self.reads_rows():
+			return queryset
+		# Позиция курсора берется из полей сортировки строки, поэтому они тоже читаются.
+		ordering = ()
+		if self.action == 'list' and self.paginator is not None:
+			ordering = [field.lstrip('-') for field in self.paginator.get_ordering(self.request, queryset, self)]
+		return self.row_serializer_class.get_row_queryset(queryset, self.get_expand(), ordering)
+
+
+class PostViewSet(TimedAuthenticationMixin, ExpandMixin, RowReadMixin, viewsets.ModelViewSet):
 	"""
     list: Список постов. Доступен всем пользователям
     create: Создание поста. Доступно авторизованным пользователям.
@@ -22,20 +127,34 @@ class PostViewSet(viewsets.ModelViewSet):
     update: Изменение поста. Доступно владельцу поста.
     partial_update: Частичное изменение поста. Доступно владельцу поста.
     delete: Удаление поста. Доступно владельцу поста.
+
+    Параметр ?expand=user,comment_count добавляет в список и просмотр автора и число комментариев.
+    Сортировка ?ordering=-comment_count использует хранимый счетчик.
+    Фильтры: ?user=, ?user__in=1,2 и период ?created_at__gte=, ?created_at__lt= и т.д.
+    Параметр ?search= ищет по заголовку и тексту, по умолчанию результаты идут по релевантности.
+    Просмотр кэшируется до изменения поста или его комментариев и поддерживает ETag.
     """
 	serializer_class = PostSerializer
+	row_serializer_class = PostRowSerializer
 	queryset = Post.objects.all()
 	permission_classes = [IsOwnerOrReadOnly, ]
-	filter_backends = (DjangoFilterBackend, OrderingFilter,)
-	filterset_fields = ('user', 'created_at',)
-	ordering_fields = ('title', 'created_at',)
-	ordering = ('title',)
+	filter_backends = (DjangoFilterBackend, FullTextSearchFilter, SearchOrderingFilter,)
+	filterset_class = PostFilter
+	ordering_fields = ('title', 'created_at', 'comment_count',)
+	ordering = ('title', 'created_at',)
+	expand_annotations = {
+		'user': {'user_username': F('user__username')},
+		'comment_count': {},
+	}
 
 	def perform_create(self, serializer):
 		serializer.save(user=self.request.user)
 
+	def retrieve(self, request, *args, **kwargs):
+		return cached_response(request, self.kwargs['pk'], partial(super().retrieve, request, *args, **kwargs))
 
-class CommentViewSet(viewsets.ModelViewSet):
+
+class CommentViewSet(TimedAuthenticationMixin, ExpandMixin, RowReadMixin, viewsets.ModelViewSet):
 	"""
 	list: Список комментариев. Доступен всем пользователям
 	create: Создание комментария. Доступно авторизованным пользователям.
@@ -43,46 +162,330 @@ class CommentViewSet(viewsets.ModelViewSet):
 	update: Изменение комментария. Доступно владельцу комментария.
 	partial_update: Частичное изменение комментария. Доступно владельцу комментария.
 	delete: Удаление поста. Доступно владельцу комментария или поста.
+	post_comment_tree: Дерево комментариев поста. Доступно всем пользователям.
+	descendants: Ответы на комментарий на всю глубину (?max_depth=, ?limit=), вложенные или ?flat=true списком.
+	ancestors: Путь от корня обсуждения до родителя комментария.
+	export: Потоковая выгрузка комментариев поста или периода в NDJSON. Доступна администраторам.
+
+	Параметр ?expand=user,reply_count,descendant_count добавляет в список и просмотр автора,
+	число ответов и число всех потомков. По этим счетчикам доступна сортировка ?ordering=.
+	Фильтры: ?user=, ?post=, ?parent=, ?user__in=, ?post__in= и период ?created_at__gte=, ?created_at__lt= и т.д.
+	Параметр ?search= ищет по тексту, по умолчанию результаты идут по релевантности.
+	Список с ?post=<id> и дерево кэшируются до изменения поста или его комментариев и поддерживают ETag.
+	Создание комментариев ограничено по пользователю и по дереву (429), а ответы в перегруженное
+	дерево отклоняются с 503; оба ответа содержат Retry-After.
+	Создание, изменение и удаление публикуются в поток событий поста /api/v1/posts/<id>/comments/events/
+	(Server-Sent Events, только под ASGI, см. blog.events).
 	"""
 
 	serializer_class = CommentSerializer
+	row_serializer_class = CommentRowSerializer
 	queryset = Comment.objects.all()
 	permission_classes = [IsOwnerOrReadOnly, ]
-	filter_backends = (DjangoFilterBackend, OrderingFilter,)
-	filterset_fields = ('user', 'post', 'created_at', 'parent')
-	ordering_fields = ('created_at',)
-	ordering = ('tree_id', 'lft')
+	filter_backends = (DjangoFilterBackend, FullTextSearchFilter, SearchOrderingFilter,)
+	filterset_class = CommentFilter
+	ordering_fields = ('created_at', 'reply_count', 'descendant_count',)
+	expand_annotations = {
+		'user': {'user_username': F('user__username')},
+		'reply_count': {},
+		'descendant_count': {},
+	}
+
+	@property
+	def ordering(self):
+		# Порядок дерева зависит от COMMENT_HIERARCHY: (tree_id, lft) или (tree_id, path).
+		return tree_ordering()
+
+	def get_queryset(self):
+		queryset = super().get_queryset()
+		if self.action == 'destroy':
+			# Проверке прав нужен только владелец поста, а MPTT и счетчикам - поля дерева.
+			queryset = queryset.select_related('post').only(
+				'id', 'user_id', 'parent_id', 'tree_id', 'lft', 'rght', 'level', 'descendant_count',
+				'post__id', 'post__user_id',
+			)
+		return queryset
 
 	def get_permissions(self):
 		if self.action == 'destroy':
 			self.permission_classes = [IsCommentOrPostOwnerOrReadOnly]
+		elif self.action == 'export':
+			self.permission_classes = [permissions.IsAdminUser]
 		return super().get_permissions()
 
+	def get_throttles(self):
+		if self.action in ('create_post_comment', 'create_child_comment'):
+			# DRF опрашивает все ограничители, поэтому отказ по перегрузке идет первым и не расходует лимиты.
+			self.throttle_classes = [CommentWriteSheddingThrottle, CommentUserRateThrottle, CommentTreeRateThrottle]
+		return super().get_throttles()
+
+	def list(self, request, *args, **kwargs):
+		return cached_response(request, request.query_params.get('post'), partial(super().list, request, *args, **kwargs))
+
 	def create(self, request, *args, **kwargs):
 		raise NotFound()
 
-	@action(["post"], detail=False)
+	def perform_update(self, serializer):
+		with transaction.atomic(savepoint=False):
+			serializer.save()
+			publish(CommentEvent.UPDATED, serializer.instance.post_id, serializer.instance.id, serializer.data)
+
 	def create_post_comment(self, request, *args, **kwargs):
 		post = get_object_or_404(Post, id=self.kwargs['post_id'])
 
 		serializer = self.get_serializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
-		serializer.save(
-			user=self.request.user,
-			post=post,
-		)
+		with transaction.atomic(savepoint=False):
+			serializer.save(
+				user=self.request.user,
+				post=post,
+			)
+			publish(CommentEvent.CREATED, serializer.instance.post_id, serializer.instance.id, serializer.data)
 		headers = self.get_success_headers(serializer.data)
 		return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-	@action(["post"], detail=False)
 	def create_child_comment(self, request, *args, **kwargs):
-		parent = get_object_or_404(Comment, id=self.kwargs['comment_id'])
+		parent = get_reply_parent(self)
+		if parent is None:
+			raise Http404
 
 		serializer = self.get_serializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
-		serializer.save(
-			user=self.request.user,
-			parent=parent
-		)
+		with tree_writer(get_tree_id(self)), transaction.atomic(savepoint=False):
+			serializer.save(
+				user=self.request.user,
+				parent=parent
+			)
+			publish(CommentEvent.CREATED, serializer.instance.post_id, serializer.instance.id, serializer.data)
 		headers = self.get_success_headers(serializer.data)
 		return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+	def post_comment_tree(self, request, *args, **kwargs):
+		return cached_response(request, self.kwargs['post_id'], partial(self.get_post_comment_tree, request))
+
+	def get_post_comment_tree(self, request):
+		post = get_object_or_404(Post.objects.only('id'), id=self.kwargs['post_id'])
+		queryset = self.get_tree_queryset(request, post.id)
+		return self.get_tree_response(request, list(queryset))
+
+	def get_tree_queryset(self, request, post_id):
+		max_depth = get_limit_param(request, 'max_depth', settings.COMMENT_TREE_MAX_DEPTH)
+		max_nodes = get_limit_param(request, 'max_nodes', settings.COMMENT_TREE_MAX_NODES)
+		return (
+			Comment.objects
+			.filter(post_id=post_id, level__lte=max_depth)
+			.order_by(*tree_ordering())
+			.values_list(*TREE_FIELDS)[:max_nodes + 1]
+		)
+
+	def get_tree_response(self, request, rows):
+		max_nodes = get_limit_param(request, 'max_nodes', settings.COMMENT_TREE_MAX_NODES)
+		truncated = len(rows) > max_nodes
+		if truncated:
+			rows.pop()
+
+		with timed('serialize'):
+			results = build_comment_tree(rows)
+		return Response({
+			'count': len(rows),
+			'truncated': truncated,
+			'results': results,
+		})
+
+	@action(["get"], detail=True)
+	def descendants(self, request, *args, **kwargs):
+		comment_id = self.get_comment_id()
+		max_depth = get_limit_param(request, 'max_depth', settings.COMMENT_TREE_MAX_DEPTH)
+		limit = get_limit_param(request, 'limit', settings.COMMENT_TREE_MAX_NODES)
+		flat = request.query_params.get('flat', '').lower() in ('1', 'true')
+
+		# Сам комментарий и его поддерево одним запросом по индексу (tree_id, lft) или (path):
+		# границы диапазона и глубина берутся подзапросами к строке комментария.
+		comment = Comment.objects.filter(pk=comment_id)
+		queryset = (
+			Comment.objects
+			.filter(
+				level__lte=Subquery(comment.values('level')) + max_depth,
+				**subtree_filter(comment_id, comment),
+			)
+			.order_by(*tree_ordering())
+			.values_list(*TREE_FIELDS)
+		)
+		# Сам комментарий, limit потомков и еще один для truncated. Отсоединенные (SET_NULL) строки
+		# из диапазона select_subtree отбрасывает, поэтому, пока их не перенумеровала фоновая задача,
+		# выборка дочитывается следующими пачками до limit + 1 потомков или до конца диапазона.
+		batch_size = limit + 2
+		rows = list(queryset[:batch_size])
+		if not any(row[0] == comment_id for row in rows):
+			raise NotFound()
+
+		subtree = select_subtree(rows, comment_id)
+		while len(subtree) <= limit and len(rows) % batch_size == 0:
+			batch = list(queryset[len(rows):len(rows) + batch_size])
+			if not batch:
+				break
+			rows += batch
+			subtree = select_subtree(rows, comment_id)
+		rows = subtree
+		truncated = len(rows) > limit
+		del rows[limit:]
+		with timed('serialize'):
+			results = build_comment_list(rows) if flat else build_comment_tree(rows)
+		return Response({
+			'count': len(rows),
+			'truncated': truncated,
+			'results': results,
+		})
+
+	@action(["get"], detail=True)
+	def ancestors(self, request, *args, **kwargs):
+		comment_id = self.get_comment_id()
+		rows = list(Comment.objects.with_ancestors(comment_id).order_by('level').values_list(*TREE_FIELDS))
+		if not rows or rows[-1][0] != comment_id:
+			raise NotFound()
+		return Response({'results': build_comment_list(rows[:-1])})
+
+	def get_comment_id(self):
+		try:
+			return int(self.kwargs['pk'])
+		except ValueError:
+			raise NotFound()
+
+	@action(["get"], detail=False)
+	def export(self, request, *args, **kwargs):
+		params = {}
+		if 'post' in request.query_params:
+			params['post'] = get_object_or_404(Post.objects.only('id'), id=request.query_params['post'])
+		for name in ('since', 'until'):
+			if name in request.query_params:
+				try:
+					params[name] = parse_export_datetime(request.query_params[name])
+				except ValueError:
+					raise ValidationError({name: 'Ожидается дата и время в формате ISO 8601.'})
+
+		response = StreamingHttpResponse(
+			iter_ndjson(get_export_queryset(**params)),
+			content_type='application/x-ndjson; charset=utf-8',
+		)
+		response['Content-Disposition'] = 'attachment; filename="comments.ndjson"'
+		return response
+
+
+class BatchView(TimedAuthenticationMixin, generics.GenericAPIView):
+	"""
+	post: Пакетное создание постов и комментариев одной транзакцией. Доступно авторизованным пользователям.
+
+	Комментарий указывает ровно одно из: ``post`` или ``parent`` (существующие), ``post_ref`` (пост
+	этого же пакета) или ``parent_ref`` (более ранний комментарий пакета). Если хоть один элемент
+	не прошел проверку, ничего не создается, а ошибки возвращаются по элементам в исходном порядке.
+	Созданные посты и комментарии возвращаются в том же порядке. Каждый комментарий расходует
+	лимиты частоты, как отдельный запрос, а ответы в перегруженное дерево отклоняют весь пакет.
+	"""
+	serializer_class = BatchSerializer
+	permission_classes = [permissions.IsAuthenticated, ]
+	# DRF опрашивает все ограничители, поэтому отказ по перегрузке идет первым и не расходует лимиты.
+	throttle_classes = [CommentWriteSheddingThrottle, CommentUserRateThrottle, CommentTreeRateThrottle]
+
+	def get_tree_writes(self):
+		"""
+		Число комментариев пакета по деревьям до проверки данных: ответы на существующие комментарии
+		и цепочки ``parent_ref`` от них попадают в деревья родителей, остальные начинают новые деревья.
+		Некорректные элементы и пакеты больше BATCH_MAX_ITEMS пропускаются, их отклонит BatchSerializer.
+		"""
+		data = self.request.data
+		items = data.get('comments') if isinstance(data, dict) else None
+		if not isinstance(items, list) or len(items) > settings.BATCH_MAX_ITEMS:
+			return Counter()
+		comments = [item for item in items if isinstance(item, dict)]
+
+		def parent_id(item):
+			try:
+				value = int(item['parent'])
+			except (KeyError, TypeError, ValueError):
+				return None
+			return value if 0 < value < 2 ** 63 else None
+
+		parent_ids = {parent_id(item) for item in comments} - {None}
+		parent_trees = dict(Comment.objects.filter(id__in=parent_ids).values_list('id', 'tree_id')) if parent_ids else {}
+
+		writes = Counter()
+		ref_trees = {}
+		for item in comments:
+			tree_id = None
+			if 'parent' in item:
+				tree_id = parent_trees.get(parent_id(item))
+			elif 'parent_ref' in item:
+				tree_id = ref_trees.get(str(item['parent_ref']))
+			if isinstance(item.get('ref'), (str, int)):
+				ref_trees[str(item['ref'])] = tree_id
+			writes[tree_id] += 1
+		return writes
+
+	def post(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		context = self.get_serializer_context()
+		tree_ids = [tree_id for tree_id in get_tree_writes(self) if tree_id is not None]
+		with tree_writers(tree_ids), transaction.atomic(savepoint=False):
+			created = serializer.save(user=request.user)
+			comments = CommentSerializer(created['comments'], many=True, context=context).data
+			publish_many([
+				CommentEvent(post_id=comment.post_id, comment_id=comment.pk, type=CommentEvent.CREATED, data=data)
+				for comment, data in zip(created['comments'], comments)
+			])
+		return Response({
+			'posts': PostSerializer(created['posts'], many=True, context=context).data,
+			'comments': comments,
+		}, status=status.HTTP_201_CREATED)
+
+
+class SyncView(TimedAuthenticationMixin, APIView):
+	"""
+	get: Посты и комментарии, созданные, измененные или удаленные после токена ``since``.
+
+	Первый запрос без ``since`` возвращает все посты и комментарии (с ``post`` - один пост и его
+	комментарии), следующие - только изменения после токена ``next`` предыдущего ответа. Пока
+	``has_more`` истинно, следующую страницу нужно запросить сразу. В ``deleted`` - id удаленных
+	постов и комментариев; комментарии удаленного поста отдельно не перечисляются. Изменения за
+	последние несколько секунд могут прийти повторно, применять их нужно по id.
+	"""
+	permission_classes = [permissions.AllowAny, ]
+
+	def get(self, request, *args, **kwargs):
+		post_id = None
+		if 'post' in request.query_params:
+			try:
+				post_id = int(request.query_params['post'])
+			except ValueError:
+				raise ValidationError({'post': 'Ожидается целое число.'})
+
+		since = request.query_params.get('since')
+		if since is None:
+			positions = initial_positions()
+		else:
+			try:
+				positions, token_post_id = decode_token(since)
+			except ValueError:
+				raise ValidationError({'since': 'Некорректный токен синхронизации.'})
+			if 'post' in request.query_params and post_id != token_post_id:
+				raise ValidationError({'post': 'Не совпадает с постом токена синхронизации.'})
+			post_id = token_post_id
+
+		limit = settings.SYNC_PAGE_SIZE
+		if 'page_size' in request.query_params:
+			limit = max(get_limit_param(request, 'page_size', settings.SYNC_MAX_PAGE_SIZE), 1)
+		changes, positions, has_more = get_changes(positions, post_id, limit)
+
+		context = {'request': request, 'view': self}
+		with timed('serialize'):
+			deleted = {'posts': [], 'comments': []}
+			for tombstone in changes['deleted']:
+				deleted['posts' if tombstone.kind == Tombstone.POST else 'comments'].append(tombstone.object_id)
+			data = {
+				'posts': PostRowSerializer(changes['posts'], many=True, context=context).data,
+				'comments': CommentRowSerializer(changes['comments'], many=True, context=context).data,
+				'deleted': deleted,
+				'next': encode_token(positions, post_id),
+				'has_more': has_more,
+			}
+		return Response(data)
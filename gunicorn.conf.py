@@ -0,0 +1,70 @@
+"""
+Gunicorn configuration, picked up automatically from the project directory.
+
+WSGI (sync views, persistent connections):
+    gunicorn test_comments.wsgi
+
+ASGI (async read views), see ASYNC_READ_VIEWS:
+    WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker ASYNC_READ_VIEWS=True gunicorn test_comments.asgi
+
+Values come from test_comments/settings.py, which reads them from the environment and .env.
+"""
+import logging
+
+from test_comments import settings
+
+logger = logging.getLogger('gunicorn.error')
+
+bind = settings.WEB_BIND
+worker_class = settings.WEB_WORKER_CLASS
+workers = settings.WEB_WORKERS
+threads = settings.WEB_THREADS
+timeout = settings.WEB_TIMEOUT
+graceful_timeout = settings.WEB_TIMEOUT
+keepalive = 5
+
+# Restart workers periodically to cap memory growth; jitter keeps them from restarting together.
+max_requests = 5000
+max_requests_jitter = 500
+
+accesslog = '-'
+
+# Every thread of a worker holds at most one database connection, so the connection pool
+# of the whole server is workers * threads. Trim it to DB_MAX_CONNECTIONS instead of letting
+# Postgres refuse connections under load.
+if workers * threads > settings.DB_MAX_CONNECTIONS:
+	threads = max(1, settings.DB_MAX_CONNECTIONS // workers)
+	workers = min(workers, settings.DB_MAX_CONNECTIONS // threads)
+	logger.warning(
+		'Reduced to %s workers x %s threads to stay within DB_MAX_CONNECTIONS=%s',
+		workers, threads, settings.DB_MAX_CONNECTIONS,
+	)
+
+if workers > 1 and settings.THROTTLE_CACHE_BACKEND.endswith('LocMemCache'):
+	logger.warning('Rate limits and load shedding are per worker; set THROTTLE_CACHE_BACKEND to a shared cache')
+
+if workers > 1 and settings.RESPONSE_CACHE_BACKEND.endswith('LocMemCache'):
+	logger.warning(
+		'Writes invalidate cached responses only in the worker that handled them, others serve stale data '
+		'for up to RESPONSE_CACHE_TIMEOUT; set RESPONSE_CACHE_BACKEND to a shared cache'
+	)
+
+if workers > 1 and settings.AUTH_CACHE_BACKEND.endswith('LocMemCache'):
+	logger.warning(
+		'Logout, token deletion and password changes reach only the worker that handled them, others accept '
+		'the old credentials for up to AUTH_CACHE_TIMEOUT; set AUTH_CACHE_BACKEND to a shared cache'
+	)
+
+if 'uvicorn' in worker_class and settings.DATABASES['default'].get('CONN_MAX_AGE'):
+	logger.warning('Persistent connections are not reused under ASGI; set DB_CONN_MAX_AGE=0')
+
+
+def post_worker_init(worker):
+	# Build the OpenAPI schema before the first request instead of during it.
+	from test_comments.yasg import get_schema_document
+
+	try:
+		for schema_format in ('json', 'yaml'):
+			get_schema_document(schema_format)
+	except Exception:
+		logger.exception('Could not precompute the OpenAPI schema')
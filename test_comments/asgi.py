@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_comments.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Поток событий комментариев обслуживается в цикле событий в обход Django, см. blog.events.
+from blog.events import events_application  # noqa: E402
+
+application = events_application(django_application)
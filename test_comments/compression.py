@@ -0,0 +1,125 @@
+import asyncio
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/([\w.-]+\+)?(json|x-ndjson|yaml|javascript|xml))')
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def parse_accept_encoding(header):
+	"""
+	Кодировки из Accept-Encoding с их весом q, например ``{'gzip': 1.0, 'br': 0.5}``.
+	"""
+	encodings = {}
+	for item in header.split(','):
+		coding, _, params = item.strip().partition(';')
+		coding = coding.strip().lower()
+		if not coding:
+			continue
+		quality = 1.0
+		match = re.search(r'\bq=([0-9.]+)', params)
+		if match is not None:
+			try:
+				quality = float(match[1])
+			except ValueError:
+				quality = 0.0
+		encodings[coding] = quality
+	return encodings
+
+
+def choose_encoding(header):
+	"""
+	Кодировка ответа: brotli (если установлен) или gzip с наибольшим весом; None - без сжатия.
+	При равном весе предпочитается brotli: он сжимает JSON плотнее при сравнимой скорости.
+	"""
+	encodings = parse_accept_encoding(header)
+	available = ('br', 'gzip') if brotli is not None else ('gzip',)
+	candidates = [
+		(encodings.get(coding, encodings.get('*', 0.0)), -index, coding)
+		for index, coding in enumerate(available)
+	]
+	quality, _, coding = max(candidates)
+	return coding if quality > 0 else None
+
+
+def compress(content, encoding):
+	if encoding == 'br':
+		return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+	return gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def compress_stream(stream, encoding):
+	if encoding == 'br':
+		compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+		for chunk in stream:
+			yield compressor.process(chunk) + compressor.flush()
+		yield compressor.finish()
+	else:
+		yield from compress_sequence(stream)
+
+
+class CompressionMiddleware:
+	"""
+	Сжимает ответы на GET и HEAD в brotli или gzip по Accept-Encoding, если тело текстовое и не
+	меньше COMPRESSION_MIN_SIZE байт; потоковые ответы (NDJSON) сжимаются по частям. Ответы на
+	изменяющие запросы не сжимаются: в них бывают токены, а сжатие рядом с данными из запроса
+	открывает атаку BREACH. Уже сжатые ответы (схема OpenAPI) не трогаются.
+
+	Как и MiddlewareMixin, работает и в синхронном, и в асинхронном стеке без переключения потоков.
+	"""
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		if asyncio.iscoroutinefunction(self.get_response):
+			self._is_coroutine = asyncio.coroutines._is_coroutine
+
+	def __call__(self, request):
+		if asyncio.iscoroutinefunction(self):
+			return self.__acall__(request)
+		return self.process_response(request, self.get_response(request))
+
+	async def __acall__(self, request):
+		return self.process_response(request, await self.get_response(request))
+
+	def process_response(self, request, response):
+		if request.method not in SAFE_METHODS or response.has_header('Content-Encoding'):
+			return response
+		if not COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+			return response
+		# Сжатие зависит от заголовка запроса, даже если этот ответ остался несжатым.
+		patch_vary_headers(response, ('Accept-Encoding',))
+		if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+			return response
+
+		encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+		if encoding is None:
+			return response
+
+		if response.streaming:
+			response.streaming_content = compress_stream(response.streaming_content, encoding)
+			del response['Content-Length']
+		else:
+			compressed = compress(response.content, encoding)
+			if len(compressed) >= len(response.content):
+				return response
+			response.content = compressed
+			response['Content-Length'] = str(len(compressed))
+
+		# Сжатое тело не совпадает побайтно с несжатым, поэтому ETag становится слабым (RFC 9110).
+		etag = response.get('ETag')
+		if etag and etag.startswith('"'):
+			response['ETag'] = 'W/' + etag
+		response['Content-Encoding'] = encoding
+		return response
@@ -0,0 +1,15 @@
+from django.test.runner import DiscoverRunner
+
+# Тесты с этими тегами запускаются только явно: ``python manage.py test --tag budget``.
+OPT_IN_TAGS = {'budget'}
+
+
+class TestRunner(DiscoverRunner):
+	"""
+	DiscoverRunner, который без ``--tag`` пропускает долгие замеры из OPT_IN_TAGS.
+	"""
+
+	def __init__(self, tags=None, exclude_tags=None, **kwargs):
+		if not tags:
+			exclude_tags = set(exclude_tags or ()) | OPT_IN_TAGS
+		super().__init__(tags=tags, exclude_tags=exclude_tags, **kwargs)
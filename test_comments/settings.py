@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os
+import warnings
 import dj_database_url
 from pathlib import Path
 from dotenv import load_dotenv
@@ -53,7 +54,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+	'test_comments.compression.CompressionMiddleware',
 	'django.middleware.security.SecurityMiddleware',
+	'whitenoise.middleware.WhiteNoiseMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
 	'django.middleware.common.CommonMiddleware',
 	'django.middleware.csrf.CsrfViewMiddleware',
@@ -62,6 +65,50 @@ MIDDLEWARE = [
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Response compression
+# GET responses of at least COMPRESSION_MIN_SIZE bytes are compressed with brotli (when the Brotli package is
+# installed) or gzip, as negotiated by Accept-Encoding. Dynamic responses favour fast levels over the best ratio
+
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+
+# Request timing
+# Opt-in Server-Timing header and structured log line with DB, auth and serializer time
+
+REQUEST_TIMING = os.getenv('REQUEST_TIMING') == 'True'
+
+REQUEST_TIMING_SLOWEST = int(os.getenv('REQUEST_TIMING_SLOWEST', 20))
+
+REQUEST_TIMING_SQL_LIMIT = int(os.getenv('REQUEST_TIMING_SQL_LIMIT', 100))
+
+if REQUEST_TIMING:
+	MIDDLEWARE.insert(0, 'test_comments.timing.RequestTimingMiddleware')
+
+LOGGING = {
+	'version': 1,
+	'disable_existing_loggers': False,
+	'handlers': {
+		'console': {
+			'class': 'logging.StreamHandler',
+		},
+	},
+	'loggers': {
+		'test_comments.timing': {
+			'handlers': ['console'],
+			'level': 'INFO',
+			'propagate': False,
+		},
+		'blog.jobs': {
+			'handlers': ['console'],
+			'level': 'INFO',
+			'propagate': False,
+		},
+	},
+}
+
 ROOT_URLCONF = 'test_comments.urls'
 
 TEMPLATES = [
@@ -82,13 +129,35 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'test_comments.wsgi.application'
 
+# Application server
+# Worker model read by gunicorn.conf.py. Each worker thread keeps at most one persistent connection,
+# so WEB_WORKERS * WEB_THREADS is capped at DB_MAX_CONNECTIONS (keep it below Postgres max_connections)
+
+WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:8000')
+
+WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', 'gthread')
+
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2 * (os.cpu_count() or 1) + 1))
+
+WEB_THREADS = int(os.getenv('WEB_THREADS', 4))
+
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 30))
+
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 80))
+
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+# ASGI workers run every sync database call in a fresh thread, so persistent connections are never reused
+# there and only pile up; DB_CONN_MAX_AGE defaults to 0 for uvicorn workers and to 600 seconds otherwise
+
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 0 if 'uvicorn' in WEB_WORKER_CLASS else 600))
 
 DATABASES = {
-	'default': dj_database_url.config()
+	'default': dj_database_url.config(conn_max_age=DB_CONN_MAX_AGE)
 }
 
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -123,6 +192,13 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Collected by `manage.py collectstatic` (done in the Docker image) and served by WhiteNoise under gunicorn,
+# where nothing else serves /static/ for the Swagger UI
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# runserver and tests serve static files from the apps without collectstatic
+warnings.filterwarnings('ignore', message='No directory at', module='whitenoise.base')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -130,6 +206,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
+# Tests
+# Performance budgets (tag 'budget') run only on request: `python manage.py test --tag budget`
+TEST_RUNNER = 'test_comments.runner.TestRunner'
+
 REST_FRAMEWORK = {
 	'DEFAULT_PERMISSION_CLASSES': (
 		'rest_framework.permissions.AllowAny',
@@ -137,10 +217,197 @@ REST_FRAMEWORK = {
 	'DEFAULT_AUTHENTICATION_CLASSES': (
 		# 'rest_framework.authentication.SessionAuthentication',
 		# 'rest_framework.authentication.BasicAuthentication'
-		'rest_framework.authentication.TokenAuthentication',
-		'rest_framework_simplejwt.authentication.JWTAuthentication',
+		'accounts.authentication.CachedTokenAuthentication',
+		'accounts.authentication.CachedJWTAuthentication',
 	),
 	'DEFAULT_FILTER_BACKENDS': (
 		'django_filters.rest_framework.DjangoFilterBackend',
 	),
+	# orjson-backed JSON by default; ?format=columns sends lists as {"columns": [...], "rows": [[...]]}
+	'DEFAULT_RENDERER_CLASSES': (
+		'test_comments.renderers.FastJSONRenderer',
+		'test_comments.renderers.ColumnarJSONRenderer',
+		'rest_framework.renderers.BrowsableAPIRenderer',
+	),
+	'DEFAULT_PAGINATION_CLASS': 'blog.pagination.KeysetPagination',
+	'PAGE_SIZE': 100,
+	# Comment creation limits (sliding window, default cache): per user and per comment tree
+	'DEFAULT_THROTTLE_RATES': {
+		'comment_user': os.getenv('COMMENT_USER_THROTTLE_RATE', '30/min'),
+		'comment_tree': os.getenv('COMMENT_TREE_THROTTLE_RATE', '120/min'),
+	},
+	# Replies to a tree are rejected with 503 for COOLDOWN seconds after a tree lock wait longer than
+	# LOCK_WAIT seconds, and while MAX_TREE_WRITERS writes to the tree are already in progress
+	'COMMENT_WRITE_SHEDDING': {
+		'LOCK_WAIT': float(os.getenv('COMMENT_LOCK_WAIT_THRESHOLD', 0.5)),
+		'COOLDOWN': int(os.getenv('COMMENT_OVERLOAD_COOLDOWN', 10)),
+		'MAX_TREE_WRITERS': int(os.getenv('COMMENT_MAX_TREE_WRITERS', 8)),
+		'RETRY_AFTER': 1,
+	},
+}
+
+# API schema
+# The OpenAPI document behind /swagger/, /swagger.json and /swagger.yaml is generated once per process
+# (gunicorn workers do it on boot) and served with ETag and gzip. With OPENAPI_SCHEMA_DIR set it is read
+# from the files written there by `manage.py build_schema` at build time instead
+
+OPENAPI_SCHEMA_DIR = os.getenv('OPENAPI_SCHEMA_DIR')
+
+SWAGGER_SETTINGS = {
+	'SPEC_URL': 'schema-json',
+}
+
+DJOSER = {
+	'PASSWORD_RESET_CONFIRM_URL': 'password/reset/confirm/{uid}/{token}',
+	'USERNAME_RESET_CONFIRM_URL': 'username/reset/confirm/{uid}/{token}',
+	'ACTIVATION_URL': 'activate/{uid}/{token}',
+}
+
+# Comment tree
+# Upper bounds for depth and node count of /api/v1/posts/<id>/comments/tree/
+
+COMMENT_TREE_MAX_DEPTH = int(os.getenv('COMMENT_TREE_MAX_DEPTH', 50))
+
+COMMENT_TREE_MAX_NODES = int(os.getenv('COMMENT_TREE_MAX_NODES', 25000))
+
+# Batch writes
+# Upper bound for the number of posts and, separately, comments in one /api/v1/batch/ request
+
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+
+# Background jobs
+# Database-backed queue for deferred tree maintenance, processed by `manage.py run_jobs`.
+# Failed jobs are retried JOB_MAX_ATTEMPTS times with exponential backoff from JOB_RETRY_DELAY seconds;
+# jobs left running longer than JOB_TIMEOUT seconds (crashed worker) are requeued
+
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 10))
+
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 600))
+
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', 7 * 24 * 3600))
+
+# Comment events
+# /api/v1/posts/<id>/comments/events/ streams comment created/updated/deleted events as Server-Sent Events (ASGI only).
+# Each process polls the event log once per COMMENT_EVENTS_POLL_INTERVAL seconds for all of its subscribers
+# (at most COMMENT_EVENTS_MAX_SUBSCRIBERS); a subscriber with COMMENT_EVENTS_QUEUE_SIZE undelivered events is
+# disconnected and resumes with Last-Event-ID. `manage.py run_jobs` prunes events older than COMMENT_EVENTS_RETENTION
+
+COMMENT_EVENTS_MAX_SUBSCRIBERS = int(os.getenv('COMMENT_EVENTS_MAX_SUBSCRIBERS', 10000))
+
+COMMENT_EVENTS_QUEUE_SIZE = int(os.getenv('COMMENT_EVENTS_QUEUE_SIZE', 100))
+
+COMMENT_EVENTS_POLL_INTERVAL = float(os.getenv('COMMENT_EVENTS_POLL_INTERVAL', 1))
+
+COMMENT_EVENTS_HEARTBEAT = float(os.getenv('COMMENT_EVENTS_HEARTBEAT', 15))
+
+# Client reconnection delay sent in the stream, milliseconds
+COMMENT_EVENTS_RETRY = int(os.getenv('COMMENT_EVENTS_RETRY', 3000))
+
+COMMENT_EVENTS_REPLAY_LIMIT = int(os.getenv('COMMENT_EVENTS_REPLAY_LIMIT', 1000))
+
+# Event ids are assigned before commit, so a lower id can become visible later. Missing ids are polled again and
+# replays resend events of the last COMMENT_EVENTS_WINDOW seconds; it must exceed the longest comment write transaction
+COMMENT_EVENTS_WINDOW = float(os.getenv('COMMENT_EVENTS_WINDOW', 10))
+
+COMMENT_EVENTS_RETENTION = int(os.getenv('COMMENT_EVENTS_RETENTION', 24 * 3600))
+
+# Sync
+# /api/v1/sync/ returns posts and comments changed since a token, SYNC_PAGE_SIZE (at most SYNC_MAX_PAGE_SIZE) rows
+# per source and page. Changes from the last SYNC_WINDOW seconds are sent again on the next sync so that late commits
+# are not skipped. `manage.py run_jobs` prunes deletion records older than SYNC_TOMBSTONE_RETENTION; older tokens get 410
+
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 500))
+
+SYNC_MAX_PAGE_SIZE = int(os.getenv('SYNC_MAX_PAGE_SIZE', 1000))
+
+SYNC_WINDOW = float(os.getenv('SYNC_WINDOW', 10))
+
+SYNC_TOMBSTONE_RETENTION = int(os.getenv('SYNC_TOMBSTONE_RETENTION', 30 * 24 * 3600))
+
+# Async read path
+# Serve post list/detail, comment list and comment tree GETs from async views (run under ASGI)
+
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS') == 'True'
+
+# Comment insertion
+# 'append' inserts new comments as the last child under a per-tree lock,
+# 'ordered' uses django-mptt's order_insertion_by positioning
+
+COMMENT_INSERTION_MODE = os.getenv('COMMENT_INSERTION_MODE', 'append')
+
+# Comment hierarchy
+# 'mptt' reads threads by the nested set (tree_id, lft); 'path' reads them by a materialized path: replies
+# touch only their own row and skip the per-tree lock, and a comments.rebuild_tree job renumbers lft/rght
+# COMMENT_PATH_REBUILD_DELAY seconds after the first reply; until then replies are served with provisional lft/rght.
+# Siblings are ordered by id, not by created_at as with COMMENT_INSERTION_MODE = 'ordered'.
+# Run `manage.py convert_comment_hierarchy` before switching and once more after it (see README)
+
+COMMENT_HIERARCHY = os.getenv('COMMENT_HIERARCHY', 'mptt')
+
+COMMENT_PATH_REBUILD_DELAY = float(os.getenv('COMMENT_PATH_REBUILD_DELAY', 5))
+
+# Response cache
+# Post detail, per-post comment listings and trees are cached until the post version changes.
+# RESPONSE_CACHE_BACKEND selects a shared backend in production (e.g. django.core.cache.backends.redis.RedisCache
+# with maxmemory and an LRU policy on the server, see docker-compose.yml): a post version bumped in one process
+# invalidates the cache of all of them. The local-memory default is per process and capped by RESPONSE_CACHE_MAX_ENTRIES
+
+RESPONSE_CACHE_ALIAS = 'responses'
+
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+	'default': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+	},
+	RESPONSE_CACHE_ALIAS: {
+		'BACKEND': RESPONSE_CACHE_BACKEND,
+		'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+		'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300)),
+	},
+}
+
+if RESPONSE_CACHE_BACKEND.endswith('LocMemCache'):
+	CACHES[RESPONSE_CACHE_ALIAS]['OPTIONS'] = {
+		'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 5000)),
+	}
+
+# Throttle cache
+# Sliding-window rate counters, the per-tree writer counter and overload flags of blog.throttling. They only limit
+# anything when every worker sees the same counters, so production sets THROTTLE_CACHE_BACKEND to a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache, see docker-compose.yml); the local-memory default is per process
+
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+THROTTLE_CACHE_BACKEND = os.getenv('THROTTLE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES[THROTTLE_CACHE_ALIAS] = {
+	'BACKEND': THROTTLE_CACHE_BACKEND,
+	'LOCATION': os.getenv('THROTTLE_CACHE_LOCATION', 'throttle'),
 }
+
+# Authentication cache
+# Token and JWT subject -> user lookups are memoized for AUTH_CACHE_TIMEOUT seconds and dropped on logout,
+# token deletion and any user save (password, is_active). With several workers production sets AUTH_CACHE_BACKEND
+# to a shared backend (e.g. django.core.cache.backends.redis.RedisCache, see docker-compose.yml) so that invalidation
+# reaches every worker at once. The local-memory default evicts least recently used entries beyond
+# AUTH_CACHE_MAX_ENTRIES and is per process: other workers keep accepting a revoked token for up to AUTH_CACHE_TIMEOUT
+
+AUTH_CACHE_ALIAS = 'auth'
+
+AUTH_CACHE_BACKEND = os.getenv('AUTH_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES[AUTH_CACHE_ALIAS] = {
+	'BACKEND': AUTH_CACHE_BACKEND,
+	'LOCATION': os.getenv('AUTH_CACHE_LOCATION', 'auth'),
+	'TIMEOUT': int(os.getenv('AUTH_CACHE_TIMEOUT', 60)),
+}
+
+if AUTH_CACHE_BACKEND.endswith('LocMemCache'):
+	CACHES[AUTH_CACHE_ALIAS]['OPTIONS'] = {
+		'MAX_ENTRIES': int(os.getenv('AUTH_CACHE_MAX_ENTRIES', 10000)),
+	}
@@ -0,0 +1,441 @@
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from collections import namedtuple
+from decimal import Decimal
+from io import StringIO
+from itertools import cycle
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from drf_yasg.generators import OpenAPISchemaGenerator
+from model_bakery import baker
+from mptt.models import MPTTModel
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+import accounts.urls
+import blog.urls
+from blog.bulk import import_comments
+from blog.models import Post, Comment
+from blog.sync import SYNC_SOURCES, Position, encode_token
+from test_comments import timing
+from test_comments.compression import choose_encoding
+from test_comments.renderers import FastJSONRenderer, to_columns
+from test_comments.yasg import get_schema, get_schema_document
+
+User = get_user_model()
+
+SCALE = float(os.getenv('PERF_BUDGET_SCALE', 1))
+TIME_FACTOR = float(os.getenv('PERF_BUDGET_TIME_FACTOR', 1))
+REPORT = os.getenv('PERF_BUDGET_REPORT', os.path.join(tempfile.gettempdir(), 'perf_budget.json'))
+
+POSTS = int(2000 * SCALE)
+USERS = 50
+DEEP_THREAD_DEPTH = int(300 * SCALE)
+WIDE_THREAD_WIDTH = int(3000 * SCALE)
+RANDOM_COMMENTS = int(5000 * SCALE)
+
+PASSWORD = 'budget-password'
+
+# url_name, args - ключи из fixtures, user - 'anon', 'owner', 'other' или 'staff',
+# data - словарь или ключ fixtures с готовым телом запроса
+Case = namedtuple('Case', ['url_name', 'method', 'args', 'data', 'user', 'status', 'max_queries', 'budget_ms'])
+
+CASES = (
+	Case('api-root', 'get', (), None, 'anon', 200, 0, 100),
+	Case('post-list', 'get', (), None, 'anon', 200, 1, 150),
+	Case('post-list', 'get', (), {'expand': 'user,comment_count'}, 'anon', 200, 1, 200),
+	Case('post-list', 'get', (), {'ordering': '-created_at', 'page_size': 1000}, 'anon', 200, 1, 500),
+	Case('post-list', 'get', (), {'user': 'owner_id'}, 'anon', 200, 1, 150),
+	Case('post-list', 'get', (), {'user__in': 'busy_user', 'ordering': 'created_at'}, 'anon', 200, 1, 150),
+	Case('post-list', 'get', (), {'search': 'title'}, 'anon', 200, 1, 200),
+	Case('post-list', 'post', (), {'title': 'title', 'body': 'body'}, 'owner', 201, 1, 100),
+	Case('post-detail', 'get', ('hot_post',), {'expand': 'user,comment_count'}, 'anon', 200, 1, 100),
+	Case('post-detail', 'put', ('own_post',), {'title': 'title', 'body': 'body'}, 'owner', 200, 2, 100),
+	Case('post-detail', 'patch', ('own_post',), {'body': 'body'}, 'owner', 200, 2, 100),
+	Case('post-detail', 'patch', ('own_post',), {'body': 'body'}, 'other', 403, 1, 100),
+	Case('comment-list', 'get', (), None, 'anon', 200, 1, 150),
+	Case('comment-list', 'get', (), {'expand': 'user,reply_count'}, 'anon', 200, 1, 300),
+	Case('comment-list', 'get', (), {'post': 'hot_post'}, 'anon', 200, 1, 150),
+	Case('comment-list', 'get', (), {'parent': 'wide_root'}, 'anon', 200, 1, 150),
+	Case('comment-list', 'get', (), {'post': 'hot_post', 'created_at__gte': 'hot_post_since'}, 'anon', 200, 1, 150),
+	Case('comment-list', 'get', (), {'user': 'busy_user', 'ordering': '-created_at'}, 'anon', 200, 1, 150),
+	Case('comment-list', 'get', (), {'ordering': 'created_at', 'page_size': 1000}, 'anon', 200, 1, 500),
+	Case('comment-list', 'get', (), {'search': 'comment'}, 'anon', 200, 1, 300),
+	Case('comment-list', 'get', (), {'search': 'comment 4242', 'post': 'hot_post'}, 'anon', 200, 1, 150),
+	Case('comment-detail', 'get', ('wide_root',), {'expand': 'user,reply_count'}, 'anon', 200, 1, 100),
+	Case('comment-detail', 'put', ('own_comment',), {'body': 'body'}, 'owner', 200, 3, 100),
+	Case('comment-detail', 'patch', ('own_comment',), {'body': 'body'}, 'owner', 200, 3, 100),
+	Case('comment-detail', 'patch', ('own_comment',), {'body': 'body'}, 'other', 403, 1, 100),
+	Case('comment-post-tree', 'get', ('hot_post',), None, 'anon', 200, 2, 1500),
+	Case('comment-post-tree', 'get', ('hot_post',), {'max_depth': 5, 'max_nodes': 1000}, 'anon', 200, 2, 300),
+	Case('comment-descendants', 'get', ('wide_root',), None, 'anon', 200, 1, 500),
+	Case('comment-descendants', 'get', ('wide_root',), {'flat': 'true', 'limit': 100}, 'anon', 200, 1, 100),
+	Case('comment-descendants', 'get', ('deep_root',), {'max_depth': 20}, 'anon', 200, 1, 100),
+	Case('comment-ancestors', 'get', ('deep_leaf',), None, 'anon', 200, 1, 100),
+	Case('comment-post-create', 'post', ('hot_post',), {'body': 'body'}, 'owner', 201, 5, 100),
+	Case('comment-child-create', 'post', ('deep_leaf',), {'body': 'body'}, 'owner', 201, 8, 200),
+	Case('comment-child-create', 'post', ('wide_root',), {'body': 'body'}, 'owner', 201, 8, 200),
+	Case('batch', 'post', (), 'batch', 'owner', 201, 21, 500),
+	Case('comment-export', 'get', (), {'post': 'hot_post'}, 'staff', 200, 3, 2000),
+	Case('comment-detail', 'delete', ('own_comment',), None, 'owner', 204, 8, 200),
+	Case('post-detail', 'delete', ('own_post',), None, 'owner', 204, 6, 200),
+	Case('sync', 'get', (), None, 'anon', 200, 3, 300),
+	Case('sync', 'get', (), {'post': 'hot_post', 'page_size': 1000}, 'anon', 200, 3, 500),
+	Case('sync', 'get', (), {'since': 'sync_recent'}, 'anon', 200, 3, 100),
+	Case('customuser-list', 'get', (), None, 'staff', 200, 1, 150),
+	Case('customuser-list', 'post', (), {'username': 'new', 'email': 'new@example.com', 'password': 'x7-Budget-pass'}, 'anon', 201, 5, 300),
+	Case('customuser-detail', 'get', ('owner',), None, 'owner', 200, 1, 100),
+	Case('customuser-me', 'get', (), None, 'owner', 200, 0, 100),
+	Case('customuser-activation', 'post', (), {'uid': 'x', 'token': 'x'}, 'anon', 400, 0, 100),
+	Case('customuser-resend-activation', 'post', (), {'email': 'owner@example.com'}, 'anon', 400, 1, 100),
+	Case('customuser-reset-password', 'post', (), {'email': 'owner@example.com'}, 'anon', 204, 1, 200),
+	Case('customuser-reset-password-confirm', 'post', (), {'uid': 'x', 'token': 'x', 'new_password': 'x'}, 'anon', 400, 0, 100),
+	Case('customuser-set-password', 'post', (), {'current_password': PASSWORD, 'new_password': 'x7-Budget-pass'}, 'other', 204, 1, 300),
+	Case('customuser-set-username', 'post', (), {'current_password': PASSWORD, 'new_username': 'renamed'}, 'staff', 204, 2, 300),
+	Case('customuser-reset-username', 'post', (), {'email': 'owner@example.com'}, 'anon', 204, 1, 200),
+	Case('customuser-reset-username-confirm', 'post', (), {'uid': 'x', 'token': 'x', 'new_username': 'x'}, 'anon', 400, 1, 100),
+)
+
+
+@tag('budget')
+@override_settings(
+	PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+	# Пакет создает больше комментариев, чем допускают ограничения частоты по умолчанию.
+	REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+)
+class PerformanceBudgetTest(APITestCase):
+	"""
+	Проверяет для каждого маршрута blog/urls.py и accounts/urls.py верхнюю границу числа
+	SQL-запросов и времени ответа на реалистичном объеме данных. Результаты пишутся в JSON
+	(PERF_BUDGET_REPORT, по умолчанию во временном каталоге), объем данных и допуски по времени
+	задаются PERF_BUDGET_SCALE и PERF_BUDGET_TIME_FACTOR. Замеры времени зависят от машины, поэтому
+	обычный запуск тестов их пропускает: ``python manage.py test --tag budget``.
+	"""
+	results = []
+
+	@classmethod
+	def setUpClass(cls):
+		# Под ``manage.py test`` django-mptt проверяет стек вызовов (inspect) при создании
+		# каждого узла, чтобы поймать model_bakery. Это ~3 мс на объект, которых нет в продакшене.
+		patcher = mock.patch.object(MPTTModel, '_check_no_testing_generators', lambda self: None)
+		patcher.start()
+		cls.addClassCleanup(patcher.stop)
+		super().setUpClass()
+
+	@classmethod
+	def setUpTestData(cls):
+		rnd = random.Random(0)
+		users = baker.make(User, _quantity=USERS, _bulk_create=True)
+		cls.owner = baker.make(User, username='owner', email='owner@example.com')
+		cls.other = baker.make(User, username='other', email='other@example.com')
+		cls.staff = baker.make(User, username='staff', email='staff@example.com', is_staff=True)
+		for user in (cls.owner, cls.other, cls.staff):
+			user.set_password(PASSWORD)
+			user.save()
+
+		posts = baker.make(Post, user=cycle(users), _quantity=POSTS, _bulk_create=True)
+		hot_post = baker.make(Post, user=cls.other)
+		own_post = baker.make(Post, user=cls.owner)
+
+		user_ids = [user.id for user in users]
+		started = timezone.now()
+		records = []
+
+		def add(parent=None, post=None):
+			records.append({
+				'id': len(records),
+				'parent': parent,
+				'post': post,
+				'user': rnd.choice(user_ids),
+				'body': f'comment {len(records)}',
+				'created_at': started + timezone.timedelta(microseconds=len(records)),
+			})
+			return len(records) - 1
+
+		deep = add(post=hot_post.id)
+		for _ in range(DEEP_THREAD_DEPTH):
+			deep = add(parent=deep)
+		wide_root = add(post=hot_post.id)
+		for _ in range(WIDE_THREAD_WIDTH):
+			add(parent=wide_root)
+		first_random = len(records)
+		for _ in range(RANDOM_COMMENTS):
+			if len(records) > first_random and rnd.random() < 0.7:
+				add(parent=rnd.randrange(first_random, len(records)))
+			else:
+				add(post=rnd.choice(posts).id)
+		import_comments(records)
+
+		comments = Comment.objects.filter(post=hot_post)
+		own_comment = Comment.objects.create(user=cls.owner, post=own_post, body='own comment')
+		cls.fixtures = {
+			'hot_post': hot_post.id,
+			'own_post': own_post.id,
+			'own_comment': own_comment.id,
+			'deep_leaf': comments.order_by('-level').values_list('id', flat=True).first(),
+			'wide_root': comments.get(level=0, body=f'comment {wide_root}').id,
+			'deep_root': comments.get(level=0, body='comment 0').id,
+			'owner': cls.owner.id,
+			'owner_id': cls.owner.id,
+			'batch': {
+				'posts': [{'ref': f'post {index}', 'title': 'title', 'body': 'body'} for index in range(50)],
+				'comments': [
+					{'ref': 'root', 'post': hot_post.id, 'body': 'body'},
+					*({'parent_ref': 'root', 'body': 'body'} for _ in range(100)),
+					*({'parent': parent_id, 'body': 'body'} for parent_id in list(comments.order_by('id').values_list('id', flat=True))[::33]),
+					*({'post_ref': f'post {index}', 'body': 'body'} for index in range(50)),
+				],
+			},
+			'busy_user': Comment.objects.values('user').annotate(count=Count('id')).order_by('-count')[0]['user'],
+			'hot_post_since': comments.order_by('created_at')[comments.count() // 2].created_at.isoformat(),
+			'sync_recent': encode_token(dict.fromkeys(SYNC_SOURCES, Position(timezone.now(), 0))),
+		}
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		if REPORT and cls.results:
+			with open(REPORT, 'w', encoding='utf-8') as report:
+				json.dump({
+					'generated_at': timezone.now().isoformat(),
+					'vendor': connection.vendor,
+					'scale': SCALE,
+					'comments': DEEP_THREAD_DEPTH + WIDE_THREAD_WIDTH + RANDOM_COMMENTS + 3,
+					'posts': POSTS + 2,
+					'results': cls.results,
+				}, report, indent=2)
+
+	def request(self, case):
+		users = {'anon': None, 'owner': self.owner, 'other': self.other, 'staff': self.staff}
+		self.client.force_authenticate(users[case.user])
+
+		url = reverse(case.url_name, args=[self.fixtures[arg] for arg in case.args])
+		data = case.data
+		if isinstance(data, str):
+			data = self.fixtures[data]
+		elif data and case.method == 'get':
+			data = {key: self.fixtures.get(value, value) for key, value in data.items()}
+
+		with CaptureQueriesContext(connection) as context:
+			started = time.perf_counter()
+			response = getattr(self.client, case.method)(url, data=data, format=None if case.method == 'get' else 'json')
+			if response.streaming:
+				b''.join(response.streaming_content)
+			elapsed = (time.perf_counter() - started) * 1000
+		return url, response, len(context.captured_queries), elapsed
+
+	def test_budgets(self):
+		for case in CASES:
+			url, response, queries, elapsed = self.request(case)
+			self.results.append({
+				'name': case.url_name,
+				'method': case.method.upper(),
+				'url': url,
+				'status': response.status_code,
+				'queries': queries,
+				'max_queries': case.max_queries,
+				'ms': round(elapsed, 2),
+				'budget_ms': case.budget_ms * TIME_FACTOR,
+			})
+			with self.subTest(case.url_name, method=case.method, data=case.data):
+				self.assertEqual(response.status_code, case.status)
+				self.assertLessEqual(queries, case.max_queries)
+				self.assertLessEqual(elapsed, case.budget_ms * TIME_FACTOR)
+
+
+class PerformanceBudgetCasesTest(APITestCase):
+	def test_cases_cover_all_routes(self):
+		# Проверяется и без ``--tag budget``: новый маршрут без бюджета должен ронять обычный запуск.
+		names = {pattern.name for urls in (blog.urls, accounts.urls) for pattern in urls.urlpatterns}
+		self.assertEqual(names - {case.url_name for case in CASES}, set())
+
+
+class RequestTimingMiddlewareTest(APITestCase):
+	def setUp(self):
+		self.user = baker.make(User)
+		self.post = baker.make(Post, user=self.user)
+		for _ in range(3):
+			Comment.objects.create(user=self.user, post=self.post, body='body')
+		timing._slowest.clear()
+
+	def test_server_timing(self):
+		self.client.force_authenticate(self.user)
+		middleware = ['test_comments.timing.RequestTimingMiddleware'] + settings.MIDDLEWARE
+
+		with override_settings(MIDDLEWARE=middleware, REQUEST_TIMING_SLOWEST=1):
+			with self.assertLogs('test_comments.timing', 'INFO') as logs:
+				response = self.client.get(reverse('comment-list'))
+				self.client.get(reverse('post-detail', args=(self.post.id,)))
+
+		metrics = {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+		self.assertEqual(set(metrics), {'db', 'auth', 'serialize', 'total'})
+		self.assertIn('desc="1 queries"', metrics['db'])
+
+		record = json.loads(logs.records[0].getMessage())
+		self.assertEqual(record['path'], reverse('comment-list'))
+		self.assertEqual(record['queries'], 1)
+		self.assertEqual(record['status'], 200)
+		self.assertIn('serialize_ms', record)
+
+		slowest = timing.slowest_requests()
+		self.assertEqual(len(slowest), 1)
+		self.assertIn('blog_', slowest[0]['sql'][0]['sql'])
+
+	def test_streaming(self):
+		self.client.force_authenticate(baker.make(User, is_staff=True))
+		middleware = ['test_comments.timing.RequestTimingMiddleware'] + settings.MIDDLEWARE
+
+		with override_settings(MIDDLEWARE=middleware), self.assertLogs('test_comments.timing', 'INFO') as logs:
+			response = self.client.get(reverse('comment-export'), HTTP_ACCEPT_ENCODING='identity')
+			self.assertEqual(logs.records, [])
+			lines = b''.join(response.streaming_content).splitlines()
+
+		self.assertEqual(len(lines), 3)
+		self.assertIn('db;', response['Server-Timing'])
+		record = json.loads(logs.records[0].getMessage())
+		self.assertTrue(record['streaming'])
+		self.assertGreaterEqual(record['queries'], 1)
+		self.assertIn('serialize_ms', record)
+
+	def test_disabled(self):
+		response = self.client.get(reverse('comment-list'))
+
+		self.assertNotIn('Server-Timing', response)
+
+
+class SchemaTest(APITestCase):
+	def setUp(self):
+		get_schema_document.cache_clear()
+		self.addCleanup(get_schema_document.cache_clear)
+
+	def test_schema_document(self):
+		response = self.client.get(reverse('schema-json'))
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		schema = json.loads(response.content)
+		self.assertIn('/api/v1/posts/', schema['paths'])
+		self.assertNotIn('host', schema)
+
+		not_modified = self.client.get(reverse('schema-json'), HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+		compressed = self.client.get(reverse('schema-json'), HTTP_ACCEPT_ENCODING='gzip, br')
+		self.assertEqual(compressed['Content-Encoding'], 'gzip')
+		self.assertEqual(compressed['Vary'], 'Accept-Encoding')
+		self.assertEqual(gzip.decompress(compressed.content), response.content)
+
+		response = self.client.get(reverse('schema-yaml'))
+		self.assertTrue(response['Content-Type'].startswith('application/yaml'))
+		self.assertIn(b"swagger: '2.0'", response.content)
+
+	@override_settings(WHITENOISE_USE_FINDERS=True)
+	def test_swagger_static_files(self):
+		# Под gunicorn статику Swagger UI отдает WhiteNoise, а не runserver.
+		response = Client().get(f'{settings.STATIC_URL}drf-yasg/insQ.min.js')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertIn('javascript', response['Content-Type'])
+
+	def test_schema_generated_once(self):
+		generate_schema = OpenAPISchemaGenerator.get_schema
+		with mock.patch.object(OpenAPISchemaGenerator, 'get_schema', autospec=True, side_effect=generate_schema) as generate:
+			get_schema.cache_clear()
+			self.addCleanup(get_schema.cache_clear)
+			for url in (reverse('schema-swagger-ui'), reverse('schema-json'), reverse('schema-yaml')):
+				self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+		self.assertEqual(generate.call_count, 1)
+
+	def test_build_schema(self):
+		with tempfile.TemporaryDirectory() as directory:
+			call_command('build_schema', output=directory, stdout=StringIO())
+			with open(os.path.join(directory, 'openapi.json'), 'rb') as file:
+				content = file.read()
+
+			with override_settings(OPENAPI_SCHEMA_DIR=directory):
+				response = self.client.get(reverse('schema-json'))
+		self.assertEqual(response.content, content)
+
+
+class RenderingTest(APITestCase):
+	def setUp(self):
+		self.user = baker.make(User)
+		self.post = baker.make(Post, user=self.user)
+		for index in range(30):
+			Comment.objects.create(user=self.user, post=self.post, body=f'комментарий {index} ')
+
+	def test_fast_json_renderer(self):
+		data = {
+			'comments': self.client.get(reverse('comment-list')).data['results'],
+			'decimal': Decimal('1.50'),
+			'created_at': timezone.now(),
+			1: None,
+		}
+		self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+		self.assertEqual(FastJSONRenderer().render({'big': 2 ** 70}), b'{"big":1180591620717411303424}')
+		self.assertEqual(FastJSONRenderer().render(None), b'')
+		# Float записываются иначе, но читаются теми же значениями; NaN становится null.
+		floats = [1e-05, 1e16, 0.1, 1.2345678901234568e+17]
+		self.assertEqual(json.loads(FastJSONRenderer().render(floats)), json.loads(JSONRenderer().render(floats)))
+		self.assertEqual(FastJSONRenderer().render([float('nan')]), b'[null]')
+
+	def test_columns(self):
+		response = self.client.get(reverse('comment-list'), {'post': self.post.id})
+		columnar = self.client.get(reverse('comment-list'), {'post': self.post.id, 'format': 'columns'})
+
+		self.assertEqual(columnar['Content-Type'], 'application/vnd.columns+json')
+		results = json.loads(columnar.content)['results']
+		self.assertEqual(results['columns'], list(response.data['results'][0]))
+		self.assertEqual(
+			[dict(zip(results['columns'], row)) for row in results['rows']],
+			json.loads(response.content)['results'],
+		)
+		self.assertEqual(to_columns({'detail': 'x'}), {'detail': 'x'})
+		self.assertEqual(to_columns([{'a': 1}, {'b': 2}]), [{'a': 1}, {'b': 2}])
+
+	def test_compression(self):
+		url = reverse('comment-list')
+		response = self.client.get(url, {'post': self.post.id})
+		self.assertIn('Accept-Encoding', response['Vary'])
+		self.assertNotIn('Content-Encoding', response)
+
+		compressed = self.client.get(url, {'post': self.post.id}, HTTP_ACCEPT_ENCODING='gzip;q=0.5, identity')
+		self.assertEqual(compressed['Content-Encoding'], 'gzip')
+		self.assertEqual(gzip.decompress(compressed.content), response.content)
+		self.assertEqual(compressed['ETag'], 'W/' + response['ETag'])
+		not_modified = self.client.get(url, {'post': self.post.id}, HTTP_IF_NONE_MATCH=compressed['ETag'])
+		self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+		export = self.client.get(reverse('comment-export'), HTTP_ACCEPT_ENCODING='gzip')
+		self.assertEqual(export.status_code, status.HTTP_401_UNAUTHORIZED)
+		self.client.force_authenticate(baker.make(User, is_staff=True))
+		export = self.client.get(reverse('comment-export'), HTTP_ACCEPT_ENCODING='gzip')
+		self.assertEqual(export['Content-Encoding'], 'gzip')
+		self.assertEqual(len(gzip.decompress(b''.join(export.streaming_content)).splitlines()), 30)
+
+		for params, encoding in (({'page_size': 1}, 'gzip'), ({'post': self.post.id}, 'gzip;q=0, br;q=0')):
+			self.assertNotIn('Content-Encoding', self.client.get(url, params, HTTP_ACCEPT_ENCODING=encoding))
+		created = self.client.post(reverse('comment-post-create', args=(self.post.id,)), {'body': 'x' * 2000}, HTTP_ACCEPT_ENCODING='gzip')
+		self.assertNotIn('Content-Encoding', created)
+
+	def test_choose_encoding(self):
+		with mock.patch('test_comments.compression.brotli', object()):
+			self.assertEqual(choose_encoding('gzip, deflate, br'), 'br')
+			self.assertEqual(choose_encoding('gzip, br;q=0.5'), 'gzip')
+			self.assertEqual(choose_encoding('*'), 'br')
+		with mock.patch('test_comments.compression.brotli', None):
+			self.assertEqual(choose_encoding('br'), None)
+			self.assertEqual(choose_encoding('br, *;q=0.1'), 'gzip')
+		self.assertEqual(choose_encoding(''), None)
+		self.assertEqual(choose_encoding('gzip;q=0'), None)
@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('test_comments.timing')
+
+_current = ContextVar('request_timing', default=None)
+
+_slowest = []
+_slowest_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+class RequestTiming:
+	"""
+	Накопитель метрик одного запроса: SQL-запросы с длительностью и именованные интервалы.
+	"""
+	__slots__ = ('started', 'db_time', 'queries', 'spans')
+
+	def __init__(self):
+		self.started = time.perf_counter()
+		self.db_time = 0.0
+		self.queries = []
+		self.spans = {}
+
+	def execute(self, execute, sql, params, many, context):
+		started = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			duration = time.perf_counter() - started
+			self.db_time += duration
+			self.queries.append((sql, duration))
+
+	def add(self, name, duration):
+		self.spans[name] = self.spans.get(name, 0.0) + duration
+
+
+@contextmanager
+def timed(name):
+	"""
+	Добавляет время выполнения блока к интервалу ``name`` текущего запроса.
+	Без включенного RequestTimingMiddleware ничего не делает.
+	"""
+	timing = _current.get()
+	if timing is None:
+		yield
+		return
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		timing.add(name, time.perf_counter() - started)
+
+
+class TimedDataMixin:
+	"""
+	Для сериализаторов: время построения ``.data`` учитывается как ``serialize``.
+	"""
+
+	@property
+	def data(self):
+		with timed('serialize'):
+			return super().data
+
+
+class TimedAuthenticationMixin:
+	"""
+	Для APIView: время аутентификации (Token, JWT) учитывается как ``auth``.
+	"""
+
+	def perform_authentication(self, request):
+		with timed('auth'):
+			super().perform_authentication(request)
+
+
+@contextmanager
+def measuring(timing):
+	"""
+	Делает ``timing`` текущим накопителем и считает SQL-запросы всех соединений внутри блока.
+	"""
+	token = _current.set(timing)
+	try:
+		with ExitStack() as stack:
+			for connection in connections.all():
+				stack.enter_context(connection.execute_wrapper(timing.execute))
+			yield
+	finally:
+		_current.reset(token)
+
+
+def slowest_requests():
+	"""
+	Самые медленные запросы процесса с их SQL, от самого медленного.
+	"""
+	with _slowest_lock:
+		return [record for _, _, record in sorted(_slowest, reverse=True)]
+
+
+class RequestTimingMiddleware:
+	"""
+	Считает число и время SQL-запросов, время аутентификации и сериализации для каждого
+	запроса, отдает их заголовком Server-Timing и пишет JSON-строку в лог ``test_comments.timing``.
+	Для потоковых ответов (NDJSON) запросы и сериализация при чтении тела тоже учитываются,
+	а строка лога пишется после последней части.
+	REQUEST_TIMING_SLOWEST самых медленных запросов процесса сохраняются вместе с SQL
+	и пишутся в лог с уровнем WARNING при попадании в выборку.
+
+	Накладные расходы - два вызова perf_counter и добавление в список на каждый SQL-запрос,
+	параметры запросов не сохраняются.
+	"""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.sample_size = settings.REQUEST_TIMING_SLOWEST
+		self.sql_limit = settings.REQUEST_TIMING_SQL_LIMIT
+
+	def __call__(self, request):
+		timing = RequestTiming()
+		with measuring(timing):
+			response = self.get_response(request)
+		# Заголовки потокового ответа уходят до тела, поэтому Server-Timing описывает только
+		# подготовку ответа, а запись в лог ждет конца потока с запросами и сериализацией при чтении тела.
+		response['Server-Timing'] = self.format_metrics(self.get_metrics(timing))
+		if response.streaming:
+			response.streaming_content = self.stream(request, response, timing, response.streaming_content)
+		else:
+			self.finish(request, response, timing)
+		return response
+
+	def stream(self, request, response, timing, content):
+		iterator = iter(content)
+		try:
+			while True:
+				# Время построения части без ее SQL-запросов учитывается как ``serialize``.
+				started, db_time = time.perf_counter(), timing.db_time
+				with measuring(timing):
+					chunk = next(iterator, None)
+				timing.add('serialize', time.perf_counter() - started - (timing.db_time - db_time))
+				if chunk is None:
+					break
+				yield chunk
+		finally:
+			self.finish(request, response, timing)
+
+	def get_metrics(self, timing):
+		metrics = [('db', timing.db_time, f'{len(timing.queries)} queries')]
+		metrics += [(name, duration, None) for name, duration in timing.spans.items()]
+		metrics.append(('total', time.perf_counter() - timing.started, None))
+		return metrics
+
+	def format_metrics(self, metrics):
+		return ', '.join(
+			f'{name};dur={duration * 1000:.2f}' + (f';desc="{desc}"' if desc else '')
+			for name, duration, desc in metrics
+		)
+
+	def finish(self, request, response, timing):
+		metrics = self.get_metrics(timing)
+		record = {
+			'method': request.method,
+			'path': request.path,
+			'status': response.status_code,
+			'queries': len(timing.queries),
+			**{f'{name}_ms': round(duration * 1000, 2) for name, duration, _ in metrics},
+		}
+		if response.streaming:
+			record['streaming'] = True
+		logger.info(json.dumps(record))
+		self.sample(record, timing, metrics[-1][1])
+
+	def sample(self, record, timing, total):
+		if not self.sample_size:
+			return
+		with _slowest_lock:
+			if len(_slowest) >= self.sample_size and total <= _slowest[0][0]:
+				return
+			record = {
+				**record,
+				'sql': [
+					{'sql': sql, 'ms': round(duration * 1000, 2)}
+					for sql, duration in timing.queries[:self.sql_limit]
+				],
+			}
+			entry = (total, next(_sequence), record)
+			if len(_slowest) < self.sample_size:
+				heapq.heappush(_slowest, entry)
+			else:
+				heapq.heapreplace(_slowest, entry)
+		logger.warning(json.dumps({'slow_request': record}))
@@ -1,18 +1,104 @@
+import gzip
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
 from django.urls import path
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
 from rest_framework import permissions
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+API_INFO = openapi.Info(
+	title="Test Comments",
+	default_version='v1',
+	description="REST API для системы комментариев блога.",
+)
+
+# Формат: имя файла build_schema, тип содержимого, кодек drf_yasg.
+SCHEMA_FORMATS = {
+	'json': ('openapi.json', 'application/json; charset=utf-8', OpenAPICodecJson),
+	'yaml': ('openapi.yaml', 'application/yaml; charset=utf-8', OpenAPICodecYaml),
+}
+
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+@lru_cache(maxsize=None)
+def get_schema():
+	"""
+	Схема API, построенная один раз на процесс. Она не зависит от пользователя (``public=True``)
+	и меняется только с кодом, а обход всех ViewSet и сериализаторов занимает сотни миллисекунд.
+	"""
+	# Представления читают request (?expand=, пользователь), поэтому нужен анонимный запрос, как у
+	# ``generate_swagger --mock-request``. Пустой url не дает адресу этого запроса попасть в схему.
+	request = APIView().initialize_request(APIRequestFactory().get('/swagger.json'))
+	return OpenAPISchemaGenerator(API_INFO, url='').get_schema(request=request, public=True)
+
+
+def encode_schema(schema_format):
+	return SCHEMA_FORMATS[schema_format][2](validators=[]).encode(get_schema())
+
+
+@lru_cache(maxsize=None)
+def get_schema_document(schema_format):
+	"""
+	Готовый документ схемы: содержимое, оно же в gzip и ETag. Берется из OPENAPI_SCHEMA_DIR,
+	если схема собрана заранее командой ``build_schema``, иначе кодируется из ``get_schema()``.
+	"""
+	filename = SCHEMA_FORMATS[schema_format][0]
+	if settings.OPENAPI_SCHEMA_DIR:
+		with open(os.path.join(settings.OPENAPI_SCHEMA_DIR, filename), 'rb') as file:
+			content = file.read()
+	else:
+		content = encode_schema(schema_format)
+	etag = '"{}"'.format(hashlib.sha256(content).hexdigest()[:32])
+	return content, gzip.compress(content, mtime=0), etag
+
+
+class PrecomputedSchemaGenerator(OpenAPISchemaGenerator):
+	"""
+	Отдает swagger UI и ``?format=openapi`` схему из ``get_schema()`` вместо нового обхода API.
+	"""
+
+	def get_schema(self, request=None, public=False):
+		return get_schema()
+
+
+@require_safe
+def schema_document(request, schema_format):
+	content, compressed, etag = get_schema_document(schema_format)
+	if etag in parse_etags(request.headers.get('If-None-Match', '')):
+		response = HttpResponseNotModified()
+	elif accepts_gzip.search(request.headers.get('Accept-Encoding', '')):
+		response = HttpResponse(compressed, content_type=SCHEMA_FORMATS[schema_format][1])
+		response['Content-Encoding'] = 'gzip'
+	else:
+		response = HttpResponse(content, content_type=SCHEMA_FORMATS[schema_format][1])
+	response['ETag'] = etag
+	response['Cache-Control'] = 'no-cache'
+	patch_vary_headers(response, ('Accept-Encoding',))
+	return response
+
+
 schema_view = get_schema_view(
-	openapi.Info(
-		title="Test Comments",
-		default_version='v1',
-		description="REST API для системы комментариев блога.",
-	),
+	API_INFO,
 	public=True,
 	permission_classes=[permissions.AllowAny],
+	generator_class=PrecomputedSchemaGenerator,
 )
 
 urlpatterns = [
 	path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+	path('swagger.json', schema_document, {'schema_format': 'json'}, name='schema-json'),
+	path('swagger.yaml', schema_document, {'schema_format': 'yaml'}, name='schema-yaml'),
 ]